@@ -1,71 +1,139 @@
+import asyncio
 import logging
-import uuid
-import websockets
-import json
-import requests
 
-from typing import Literal, List
+from typing import List
 from datetime import datetime, timedelta
 from configurations.alor import AlorConfiguration
-from api.token import AlorTokenService
+from api.token import AlorTokenProvider
+from api.websocket import AlorWebsocketSession, Subscription
+from api.http import get_http_session, close_http_session
 
 __all__ = "AlorClientService"
 
 logger = logging.getLogger(__name__)
 
-TickerType = Literal['SBER', 'GASP', 'ALRS']
+TickerType = str  # any instrument of the exchange, see 'tickers' in the configuration
 
 
 class AlorClientService:
 
     def __init__(self):
         config = AlorConfiguration()  # Load ALOR broker configuration
-        token = AlorTokenService()  # Load token service
 
-        self.access_token = token.get_access_token()['access_token']  # Get access token
+        self.__tokens = AlorTokenProvider.instance()  # JWT cache shared by the whole process, the first request receives the token
         self.ws_url = config.websocket_url  # Get websocket url
         self.__url = config.https_url+'/md/v2/Clients/'+config.stock_market+'/'+config.contract  # Get https url
-        self.__headers = {'Accept': 'application/json', 'Authorization': 'Bearer ' + self.access_token}
+        self.__history_url = config.https_url+'/md/v2/history'  # bars of a time range
+        self.__session = None  # websocket session shared by all subscriptions of the client
+        self.__timeout = config.http_timeout  # timeout of REST requests
 
-    async def ws_history_date(self, ticker: TickerType, start_date: datetime, timedelta: timedelta = None) -> List:
+    async def access_token(self) -> str:
+        return await self.__tokens.get_token_async()  # Get cached access token, it is refreshed in background before expiry
+
+    async def ws_history_date(self, ticker: TickerType, start_date: datetime, timedelta: timedelta = None,
+                              raise_errors: bool = False) -> List:
+        """
+        Get bars of the ticker from the start date to now through the websocket.
+
+        :param ticker: The ticker symbol.
+        :param start_date: The date of the first bar.
+        :param timedelta: Optional shift of the start date.
+        :param raise_errors: Raise connection errors instead of logging them and returning an empty list.
+        :return: A list of JSON strings, one for each bar.
+        """
         if timedelta is not None:
             start_date += timedelta  # add 5 minutes to the start date, because we need data from the past 5 minutes
 
-        responses = []  # list to store responses
-
         try:
-            async with websockets.connect(self.ws_url) as websocket:  # connect to websocket
-                message = {
-                    "opcode": "BarsGetAndSubscribe",
-                    "code": ticker,
-                    "tf": "300",
-                    "from": start_date.timestamp(),
-                    "delayed": False,
-                    "skipHistory": False,
-                    "exchange": "MOEX",
-                    "format": "Simple",
-                    "frequency": 100,
-                    "guid": uuid.uuid4().hex,
-                    "token": self.access_token
-                }
-                await websocket.send(json.dumps(message))  # send message
-                # receive response
-                while True:
-                    try:
-                        response = await websocket.recv()  # receive response
-                        response_dict = json.loads(response)  # convert response to dictionary
-
-                        if 'httpCode' in response_dict:  # check if response contains 'httpCode'
-                            return responses  # return responses because httpCode is last field in response
-
-                        responses.append(response)  # append response to list
-                    except websockets.ConnectionClosed:
-                        break
+            subscription = await self.bars_subscribe(ticker, start_date)  # subscribe to bars in the shared session
+            try:
+                return await subscription.history()  # receive bars until 'httpCode', it is sent after the history
+            finally:
+                await subscription.close()
 
         except Exception as e:
             logger.error(f'Error connecting to websocket with {ticker}: {e}')
+            if raise_errors:
+                raise
+
+        return []
+
+    async def bars_subscribe(self, ticker: TickerType, start_date: datetime) -> Subscription:
+        """
+        Subscribe to 5-minute bars of the ticker from the start date in the shared websocket session.
+
+        The subscription first receives the history and the 'httpCode' message, then the updates of the bars.
+        """
+        session = await self.get_session()
+        return await session.subscribe({
+            "opcode": "BarsGetAndSubscribe",
+            "code": ticker,
+            "tf": "300",
+            "from": start_date.timestamp(),
+            "delayed": False,
+            "skipHistory": False,
+            "exchange": "MOEX",
+            "format": "Simple",
+            "frequency": 100
+        })
+
+    async def get_history(self, ticker: TickerType, start: int, end: int) -> list[dict]:
+        """
+        Get 5-minute bars of the ticker in a time range through the REST API.
+
+        Unlike ws_history_date, the range has an end, so a gap in the middle of the history is downloaded
+        without the bars after it.
+
+        :param ticker: The ticker symbol.
+        :param start: Start of the range in seconds since epoch (UTC).
+        :param end: End of the range in seconds since epoch (UTC).
+        :return: A list of bars, dictionaries with 'time', 'open', 'high', 'low', 'close' and 'volume'.
+        """
+        http = await get_http_session(self.__timeout)
+        headers = {'Accept': 'application/json', 'Authorization': 'Bearer ' + await self.access_token()}
+        params = {'symbol': ticker, 'exchange': 'MOEX', 'tf': 300, 'from': start, 'to': end, 'format': 'Simple'}
+        async with http.get(self.__history_url, params=params, headers=headers) as response:
+            response.raise_for_status()
+            return (await response.json(content_type=None)).get('history', [])
+
+    async def get_session(self) -> AlorWebsocketSession:
+        """
+        Return the websocket session of the client, it is opened on the first call in the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self.__session is None or self.__session.is_closed or self.__session.loop not in (None, loop):
+            self.__session = AlorWebsocketSession(self.ws_url, self.__tokens.get_token_async)
+
+        await self.__session.connect()
+
+        return self.__session
+
+    async def close(self) -> None:
+        """
+        Close the websocket and HTTP sessions of the client.
+        """
+        if self.__session is not None and not self.__session.is_closed:
+            await self.__session.close()
+        self.__session = None
 
-        return responses
+        await close_http_session()
+
+    async def __get(self, path: str):
+        """
+        Make a GET request to the ALOR client API through the pooled HTTP session and return the JSON response.
+        """
+        http = await get_http_session(self.__timeout)
+        headers = {'Accept': 'application/json', 'Authorization': 'Bearer ' + await self.access_token()}
+        async with http.get(self.__url+path, headers=headers) as response:
+            return await response.json(content_type=None)
+
+    async def get_account(self) -> tuple[dict, list, list]:
+        """
+        Get balance, positions and orders from ALOR concurrently.
+
+        :return: A tuple with the balance, the positions and the orders.
+        """
+        return await asyncio.gather(self.get_balance(), self.get_positions(), self.get_orders())
 
     async def get_balance(self) -> dict:
         """
@@ -80,8 +148,7 @@ class AlorClientService:
         """
         try:
 
-            response = requests.request("GET", self.__url+'/summary', headers=self.__headers, data={})
-            return response.json()
+            return await self.__get('/summary')
 
         except Exception as e:
             logger.error('Error getting balance: %s', e)
@@ -98,8 +165,7 @@ class AlorClientService:
         """
         try:
 
-            response = requests.request("GET", self.__url+'/positions', headers=self.__headers, data={})
-            return response.json()
+            return await self.__get('/positions')
 
         except Exception as e:
             logger.error('Error getting positions: %s', e)
@@ -117,8 +183,7 @@ class AlorClientService:
         """
         try:
 
-            response = requests.request("GET", self.__url+'/orders', headers=self.__headers, data={})
-            return response.json()
+            return await self.__get('/orders')
 
         except Exception as e:
             logger.error('Error getting orders: %s', e)
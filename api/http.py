@@ -0,0 +1,42 @@
+import asyncio
+import logging
+import weakref
+import aiohttp
+
+__all__ = "get_http_session"
+
+logger = logging.getLogger(__name__)
+
+# one pooled keep-alive session per event loop, shared by the client and token services
+_sessions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+async def get_http_session(timeout: float = 10.0, limit: int = 20) -> aiohttp.ClientSession:
+    """
+    Return the HTTP session of the running event loop, it is created on the first call.
+
+    The session keeps the connections to ALOR alive, so the REST calls do not pay for the connection setup.
+
+    :param timeout: Total timeout of a request in seconds.
+    :param limit: Maximum number of simultaneous connections.
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=limit, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        )
+        _sessions[loop] = session
+
+    return session
+
+
+async def close_http_session() -> None:
+    """
+    Close the HTTP session of the running event loop.
+    """
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
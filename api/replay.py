@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import logging
+import json
+import threading
+import numpy as np
+import pandas as pd
+
+from aiohttp import web, WSMsgType
+from services.bars import BarStore, UTC_OFFSET
+from services.metrics import metrics
+
+__all__ = "AlorReplayServer"
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8791
+BAR_SECONDS = 300  # the server replays 5-minute bars
+
+
+class AlorReplayServer:
+    def __init__(self, stores: dict[str, BarStore], host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                 speed: float = 1000.0, start: int = None, balance: float = 100000.0) -> None:
+        """
+        Local stand-in for the ALOR API which replays stored bars, for offline end-to-end runs and benchmarks.
+
+        The server has a replay clock: it starts at 'start' and runs 'speed' bars per second. A bar is released
+        when the clock passes its end. A 'BarsGetAndSubscribe' subscription (format 'Simple') first receives
+        the released bars from 'from', then the 'httpCode' message, then every new bar when it is released.
+
+        With the configuration pointed at the server, the client works without changes:
+
+        - websocket_url: 'ws://{host}:{port}/ws'
+        - https_url and url_oauth: 'http://{host}:{port}'
+
+        The REST routes '/refresh', '/md/v2/history', '/md/v2/Clients/{market}/{contract}/summary', '/positions'
+        and '/orders' answer with the released bars, a fixed balance and the 'positions' and 'orders' lists of the server.
+        The token of the client is refreshed with a blocking request, so the server must run in another
+        thread (run_in_thread) or another process ('python -m api.replay').
+
+        :param stores: Bar stores of the tickers.
+        :param host: The host to listen on.
+        :param port: The port to listen on.
+        :param speed: Replay speed in bars per second.
+        :param start: Start of the replay clock in seconds since epoch (UTC), by default the first stored bar.
+        :param balance: Balance in '/summary'.
+        """
+        self.__host = host
+        self.__port = port
+        self.__speed = speed
+        self.__balance = balance
+        self.positions: list = []
+        self.orders: list = []
+
+        # the columns are read once, the time of the end of every bar is used to release it
+        self.__columns = {ticker: {column: np.asarray(values) for column, values in store.read_columns().items()}
+                          for ticker, store in stores.items()}
+        self.__ends = {ticker: columns['time'] + BAR_SECONDS for ticker, columns in self.__columns.items()}
+
+        if start is None:
+            times = [int(columns['time'][0]) for columns in self.__columns.values() if len(columns['time']) > 0]
+            start = min(times) if len(times) > 0 else 0
+        self.__start = start
+        self.__started = None  # loop time when the clock was started
+        self.__runner = None
+        self.__loop = None
+        self.__thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.__host}:{self.__port}'
+
+    @property
+    def websocket_url(self) -> str:
+        return f'ws://{self.__host}:{self.__port}/ws'
+
+    def clock(self) -> float:
+        """
+        Return the time of the replay clock in seconds since epoch (UTC).
+        """
+        if self.__started is None:
+            return self.__start
+        return self.__start + (asyncio.get_running_loop().time() - self.__started) * self.__speed * BAR_SECONDS
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/ws', self.__websocket)
+        app.router.add_post('/refresh', self.__refresh)
+        app.router.add_get('/md/v2/history', self.__history)
+        app.router.add_get('/md/v2/Clients/{market}/{contract}/summary', self.__summary)
+        app.router.add_get('/md/v2/Clients/{market}/{contract}/positions', self.__positions)
+        app.router.add_get('/md/v2/Clients/{market}/{contract}/orders', self.__orders)
+
+        self.__runner = web.AppRunner(app, access_log=None)
+        await self.__runner.setup()
+        await web.TCPSite(self.__runner, self.__host, self.__port).start()
+        self.__started = asyncio.get_running_loop().time()
+        logger.info(f"Replay server on {self.url}, {self.__speed} bars/s from {pd.Timestamp(self.__start + UTC_OFFSET, unit='s')}")
+
+    async def close(self) -> None:
+        if self.__runner is not None:
+            await self.__runner.cleanup()
+            self.__runner = None
+
+    def run_in_thread(self) -> None:
+        """
+        Start the server in a background thread with its own event loop, it returns when the server is listening.
+        """
+        started = threading.Event()
+
+        def serve() -> None:
+            self.__loop = asyncio.new_event_loop()
+            self.__loop.run_until_complete(self.start())
+            started.set()
+            self.__loop.run_forever()
+            self.__loop.run_until_complete(self.close())
+            self.__loop.close()
+
+        self.__thread = threading.Thread(target=serve, name='replay', daemon=True)
+        self.__thread.start()
+        started.wait()
+
+    def stop(self) -> None:
+        """
+        Stop the server started by run_in_thread.
+        """
+        if self.__thread is not None:
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.__thread.join()
+            self.__thread = None
+
+    async def __refresh(self, request: web.Request) -> web.Response:
+        return web.json_response({'AccessToken': 'replay'})
+
+    async def __history(self, request: web.Request) -> web.Response:
+        ticker = request.query.get('symbol')
+        if ticker not in self.__columns:
+            return web.json_response({'message': f"Unknown instrument {ticker}"}, status=400)
+
+        columns = self.__columns[ticker]
+        first = int(np.searchsorted(columns['time'], float(request.query['from']), side='left'))
+        last = int(np.searchsorted(columns['time'], float(request.query['to']), side='right'))
+        last = min(last, int(np.searchsorted(self.__ends[ticker], self.clock(), side='right')))  # only released bars
+
+        history = [{'time': int(columns['time'][i]), 'close': float(columns['close'][i]), 'open': float(columns['open'][i]),
+                    'high': float(columns['high'][i]), 'low': float(columns['low'][i]), 'volume': int(columns['volume'][i])}
+                   for i in range(first, last)]
+        metrics.count('AlorReplayServer', 'bars_sent', len(history))
+        return web.json_response({'history': history, 'next': None, 'prev': None})
+
+    async def __summary(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'buyingPowerAtMorning': self.__balance,
+            'buyingPower': self.__balance,
+            'profit': 0.0,
+            'profitRate': 0.0,
+            'portfolioEvaluation': self.__balance,
+            'portfolioLiquidationValue': self.__balance,
+            'initialMargin': 0.0,
+            'riskBeforeForcePositionClosing': self.__balance,
+            'commission': 0.0
+        })
+
+    async def __positions(self, request: web.Request) -> web.Response:
+        return web.json_response(self.positions)
+
+    async def __orders(self, request: web.Request) -> web.Response:
+        return web.json_response(self.orders)
+
+    async def __websocket(self, request: web.Request) -> web.WebSocketResponse:
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+
+        # the messages of all subscriptions of the connection are sent by one writer, in order
+        outgoing = asyncio.Queue()
+        writer = asyncio.create_task(self.__write(websocket, outgoing))
+        streams: dict[str, asyncio.Task] = {}
+
+        try:
+            async for message in websocket:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                request = json.loads(message.data)
+                guid = request.get('guid')
+
+                if request.get('opcode') == 'BarsGetAndSubscribe':
+                    streams[guid] = asyncio.create_task(self.__stream(request, outgoing))
+                elif request.get('opcode') == 'unsubscribe' and guid in streams:
+                    streams.pop(guid).cancel()
+                else:
+                    outgoing.put_nowait(json.dumps({'requestGuid': guid, 'httpCode': 400,
+                                                    'message': f"Unknown opcode {request.get('opcode')}"}))
+        finally:
+            for stream in streams.values():
+                stream.cancel()
+            writer.cancel()
+
+        return websocket
+
+    @staticmethod
+    async def __write(websocket: web.WebSocketResponse, outgoing: asyncio.Queue) -> None:
+        while True:
+            message = await outgoing.get()
+            try:
+                await websocket.send_str(message)
+            except ConnectionError:
+                return
+
+    async def __stream(self, request: dict, outgoing: asyncio.Queue) -> None:
+        """
+        Send the bars of a subscription: the history, the 'httpCode' message, then the new bars.
+        """
+        guid = request['guid']
+        ticker = request['code']
+        if ticker not in self.__columns:
+            outgoing.put_nowait(json.dumps({'requestGuid': guid, 'httpCode': 400,
+                                            'message': f"Unknown instrument {ticker}"}))
+            return
+
+        columns = self.__columns[ticker]
+        ends = self.__ends[ticker]
+        index = int(np.searchsorted(columns['time'], float(request['from']), side='left'))
+
+        def send(stop: int) -> None:
+            for i in range(index, stop):
+                outgoing.put_nowait(json.dumps({'data': {
+                    'time': int(columns['time'][i]), 'open': float(columns['open'][i]), 'high': float(columns['high'][i]),
+                    'low': float(columns['low'][i]), 'close': float(columns['close'][i]), 'volume': int(columns['volume'][i])
+                }, 'guid': guid}))
+            metrics.count('AlorReplayServer', 'bars_sent', stop - index)
+
+        # history, then the confirmation which has only 'requestGuid', like the one of ALOR
+        released = int(np.searchsorted(ends, self.clock(), side='right'))
+        send(max(released, index))
+        index = max(released, index)
+        outgoing.put_nowait(json.dumps({'requestGuid': guid, 'httpCode': 200, 'message': 'Handled successfully'}))
+
+        # new bars, all bars released since the last wake up are sent at once
+        while index < len(ends):
+            clock = self.clock()
+            released = int(np.searchsorted(ends, clock, side='right'))
+            if released > index:
+                send(released)
+                index = released
+            if index < len(ends):
+                await asyncio.sleep(max(float(ends[index] - clock) / (self.__speed * BAR_SECONDS), 0))
+
+
+def main() -> None:
+    from services.manager import Manager
+
+    parser = argparse.ArgumentParser(description='Local ALOR server which replays the stored bars.')
+    parser.add_argument('tickers', nargs='+', help='tickers with stored bars')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--speed', type=float, default=1000.0, help='bars per second')
+    parser.add_argument('--start', help='start of the replay, exchange time (by default the first stored bar)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    start = None if args.start is None else int(pd.Timestamp(args.start).timestamp()) - UTC_OFFSET
+    stores = {ticker: BarStore(Manager(ticker).get_directory(), ticker) for ticker in args.tickers}
+    server = AlorReplayServer(stores, args.host, args.port, args.speed, start)
+
+    async def serve() -> None:
+        await server.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,15 @@
+import asyncio
 import logging
+import threading
+import weakref
+import aiohttp
 import requests
 
 from json import JSONDecodeError
 from datetime import datetime
 from typing import Union
 from configurations.alor import AlorConfiguration
+from api.http import get_http_session
 
 __all__ = "AlorTokenService"
 
@@ -22,11 +27,13 @@ class AlorTokenService:
 
         - url_oauth: URL for ALOR OAuth service
         - token: refresh token for ALOR
+        - timeout: timeout of the request in seconds
         """
         config = AlorConfiguration()  # Load configuration
 
         self.url_oauth = config.url_oauth
         self.token = config.token
+        self.timeout = config.http_timeout
 
     def get_access_token(self) -> dict[str, Union[str, None]]:
         """
@@ -41,7 +48,11 @@ class AlorTokenService:
         :return: A JWT token as a string, or None if an error occurred
         """
         payload = {"token": self.token}
-        response = requests.post(url=f"{self.url_oauth}/refresh", params=payload)
+        try:
+            response = requests.post(url=f"{self.url_oauth}/refresh", params=payload, timeout=self.timeout)
+        except requests.RequestException as e:  # connection errors and timeouts
+            logger.error(f"JWT request error: {e}")
+            return None
 
         try:
             if response.status_code == 200:
@@ -57,3 +68,162 @@ class AlorTokenService:
         except JSONDecodeError as e:  # JSONDecodeError is raised if the response is not in JSON format
             logger.error(f"JWT decoding error: {e}")
             return None
+
+    async def fetch_access_token(self) -> dict[str, Union[str, None]]:
+        """
+        Get a JWT token from ALOR by using refresh token without blocking the event loop.
+
+        The same as get_access_token, but the request goes through the pooled HTTP session.
+
+        :return: A JWT token as a string, or None if an error occurred
+        """
+        payload = {"token": self.token}
+        http = await get_http_session(self.timeout)
+
+        try:
+            async with http.post(f"{self.url_oauth}/refresh", params=payload) as response:
+                if response.status == 200:
+                    res_json = await response.json(content_type=None)
+                    access_token: str = res_json.get("AccessToken")
+                    logger.info(f"JWT received: {access_token}")
+                    return {"access_token": access_token, "created_at": int(datetime.now().timestamp())}
+
+                else:
+                    logger.error(f"JWT return Error: {response.status}")
+                    return None
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:  # connection errors and timeouts
+            logger.error(f"JWT request error: {e}")
+            return None
+
+        except JSONDecodeError as e:  # JSONDecodeError is raised if the response is not in JSON format
+            logger.error(f"JWT decoding error: {e}")
+            return None
+
+
+class AlorTokenProvider:
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, service: AlorTokenService = None, ttl: int = None, margin: int = 60, retry: int = 10):
+        """
+        Initialize a JWT cache.
+
+        The JWT is received once and kept with its creation time. A background thread refreshes it 'margin'
+        seconds before it expires, so callers get a valid token without waiting for ALOR.
+
+        :param service: The token service used to refresh the JWT.
+        :param ttl: Time to live of the JWT in seconds, by default 'ttl_jwt' from the configuration.
+        :param margin: How many seconds before the expiry the JWT is refreshed.
+        :param retry: Delay in seconds before the next attempt if refreshing failed.
+        """
+        self.__service = AlorTokenService() if service is None else service
+        self.__ttl = AlorConfiguration().ttl_jwt if ttl is None else ttl
+        self.__margin = min(margin, self.__ttl // 2)
+        self.__retry = retry
+        self.__token: dict = None
+        self.__lock = threading.Lock()  # guards the token, it is never held during a request
+        self.__refresh_lock = threading.Lock()  # only one refresh at a time
+        self.__async_locks = weakref.WeakKeyDictionary()  # only one refresh at a time in every event loop
+        self.__timer: threading.Timer = None
+
+    @classmethod
+    def instance(cls) -> 'AlorTokenProvider':
+        """
+        Return the token provider shared by the whole process.
+        """
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls()
+            return cls.__instance
+
+    def get_token(self) -> str:
+        """
+        Return the cached JWT, it is received from ALOR only if there is no valid token.
+
+        While the token is valid it is returned at once: the background refresh receives the new token
+        without holding the lock and only swaps it, so callers on the event loop never wait for ALOR.
+        """
+        token = self.__valid_token()
+        if token is None:
+            with self.__refresh_lock:  # one caller receives the token, the others wait for it
+                token = self.__valid_token()
+                if token is None:
+                    self.__refresh()
+                    token = self.__valid_token()
+
+        if token is None:
+            raise ConnectionError("JWT is not available")
+
+        return token['access_token']
+
+    async def get_token_async(self) -> str:
+        """
+        Return the cached JWT like get_token, but a missing or expired token is received through
+        the pooled HTTP session, so coroutines do not block the event loop while they wait for ALOR.
+        """
+        token = self.__valid_token()
+        if token is None:
+            lock = self.__async_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+            async with lock:  # one coroutine receives the token, the others wait for it
+                token = self.__valid_token()
+                if token is None:
+                    try:
+                        received = await self.__service.fetch_access_token()
+                    except Exception as e:
+                        logger.error(f"JWT refresh error: {e}")
+                        received = None
+                    self.__store(received)
+                    token = self.__valid_token()
+
+        if token is None:
+            raise ConnectionError("JWT is not available")
+
+        return token['access_token']
+
+    def stop(self) -> None:
+        if self.__timer is not None:
+            self.__timer.cancel()
+
+    def __valid_token(self) -> dict | None:
+        with self.__lock:
+            token = self.__token
+        return token if token is not None and self.__expires_in(token) > 0 else None
+
+    def __expires_in(self, token: dict) -> float:
+        return token['created_at'] + self.__ttl - datetime.now().timestamp()
+
+    def __refresh(self) -> None:
+        # the request is sent without the lock, the old token is served until it expires
+        try:
+            token = self.__service.get_access_token()
+        except Exception as e:
+            logger.error(f"JWT refresh error: {e}")
+            token = None
+
+        self.__store(token)
+
+    def __store(self, token: dict | None) -> None:
+        # swap the received token and schedule the next background refresh
+        if token is not None:
+            delay = max(self.__expires_in(token) - self.__margin, 0)
+        else:
+            logger.error(f"JWT refresh failed, retry in {self.__retry}s")
+            delay = self.__retry
+
+        with self.__lock:
+            if token is not None:
+                self.__token = token
+            self.__schedule(delay)
+
+    def __schedule(self, delay: float) -> None:
+        if self.__timer is not None:
+            self.__timer.cancel()
+
+        self.__timer = threading.Timer(delay, self.__refresh_in_background)
+        self.__timer.daemon = True
+        self.__timer.start()
+
+    def __refresh_in_background(self) -> None:
+        with self.__refresh_lock:
+            self.__refresh()
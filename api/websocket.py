@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import json
+import re
+import uuid
+import websockets
+
+from typing import Awaitable, Callable
+
+__all__ = "AlorWebsocketSession"
+
+logger = logging.getLogger(__name__)
+
+GUID_PATTERN = re.compile(r'"guid"\s*:\s*"([^"]+)"')
+REQUEST_GUID_PATTERN = re.compile(r'"requestGuid"\s*:\s*"([^"]+)"')  # the confirmation messages have only 'requestGuid'
+TIME_PATTERN = re.compile(r'"time"\s*:\s*(\d+)')
+
+HISTORY_END = object()  # marker of the 'httpCode' message, which comes after the history
+
+
+class Subscription:
+    def __init__(self, session: 'AlorWebsocketSession', message: dict) -> None:
+        """
+        A subscription of the websocket session.
+
+        Iterate over the subscription to receive its data messages (raw JSON strings),
+        the confirmation messages with 'httpCode' are skipped.
+        """
+        self.guid: str = message['guid']
+        self.message: dict = message  # message that created the subscription, it is sent again after reconnect
+        self.__session = session
+        self.__queue = asyncio.Queue()
+
+    def put(self, item) -> None:
+        self.__queue.put_nowait(item)
+
+    def __aiter__(self) -> 'Subscription':
+        return self
+
+    async def __anext__(self) -> str:
+        while True:
+            item = await self.__queue.get()
+            if item is HISTORY_END:
+                continue
+            if item is None:
+                raise StopAsyncIteration
+            if isinstance(item, Exception):
+                raise item
+            return item
+
+    async def history(self) -> list[str]:
+        """
+        Receive the messages until the 'httpCode' message, which is sent after the history.
+
+        :return: A list of JSON strings, one for each message.
+        """
+        responses = []
+        while True:
+            item = await self.__queue.get()
+            if item is HISTORY_END or item is None:
+                return responses
+            if isinstance(item, Exception):
+                raise item
+            responses.append(item)
+
+    async def close(self) -> None:
+        await self.__session.unsubscribe(self.guid)
+
+
+class AlorWebsocketSession:
+    def __init__(self, url: str, get_token: Callable[[], Awaitable[str]], retries: int = 5, backoff: float = 1.0) -> None:
+        """
+        A long-lived websocket connection to ALOR shared by many subscriptions.
+
+        Responses are routed to subscriptions by their 'guid', or by 'requestGuid' for the 'httpCode'
+        confirmations which do not have a 'guid'. If the connection is closed,
+        the session reconnects and sends the subscriptions again.
+
+        :param url: The websocket URL.
+        :param get_token: A coroutine function returning the current access token.
+        :param retries: Number of reconnect attempts before the subscriptions fail.
+        :param backoff: Delay before the first reconnect attempt in seconds, it doubles with every next attempt.
+        """
+        self.__url = url
+        self.__get_token = get_token
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__websocket = None
+        self.__reader = None
+        self.__subscriptions: dict[str, Subscription] = {}
+        self.__closed = False
+        self.__lock = asyncio.Lock()
+        self.loop = None  # event loop of the connection
+
+    @property
+    def is_closed(self) -> bool:
+        return self.__closed
+
+    async def connect(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        async with self.__lock:
+            if self.__websocket is None:
+                self.__websocket = await websockets.connect(self.__url)
+                self.__reader = asyncio.create_task(self.__read())
+
+    async def subscribe(self, message: dict) -> Subscription:
+        """
+        Send a subscription message (for example 'BarsGetAndSubscribe') and return the subscription.
+
+        The 'guid' and 'token' fields are added to the message.
+        """
+        await self.connect()
+
+        message = {**message, 'guid': uuid.uuid4().hex}
+        subscription = Subscription(self, message)
+        self.__subscriptions[subscription.guid] = subscription
+
+        try:
+            await self.__send(message)
+        except websockets.ConnectionClosed:
+            pass  # the subscription is sent again after reconnect
+
+        return subscription
+
+    async def unsubscribe(self, guid: str) -> None:
+        subscription = self.__subscriptions.pop(guid, None)
+        if subscription is None:
+            return
+
+        subscription.put(None)
+        try:
+            await self.__send({'opcode': 'unsubscribe', 'guid': guid})
+        except websockets.ConnectionClosed:
+            pass
+
+    async def close(self) -> None:
+        self.__closed = True
+
+        for subscription in self.__subscriptions.values():
+            subscription.put(None)
+        self.__subscriptions.clear()
+
+        if self.__websocket is not None:
+            await self.__websocket.close()
+        if self.__reader is not None:
+            await self.__reader
+
+    async def __send(self, message: dict) -> None:
+        await self.__websocket.send(json.dumps({**message, 'token': await self.__get_token()}))
+
+    def __dispatch(self, response: str) -> None:
+        match = GUID_PATTERN.search(response) or REQUEST_GUID_PATTERN.search(response)
+        if match:
+            guid = match.group(1)
+        else:
+            message = json.loads(response)
+            guid = message.get('guid', message.get('requestGuid'))
+        subscription = self.__subscriptions.get(guid)
+
+        if subscription is None:
+            logger.debug(f'Response without subscription: {response}')
+            return
+
+        if '"httpCode"' in response:  # 'httpCode' is the last message of the history
+            subscription.put(HISTORY_END)
+            return
+
+        # remember the time of the last bar to continue from it after reconnect
+        if 'from' in subscription.message:
+            time = TIME_PATTERN.search(response)
+            if time:
+                subscription.message['from'] = int(time.group(1))
+
+        subscription.put(response)
+
+    async def __read(self) -> None:
+        while not self.__closed:
+            try:
+                async for response in self.__websocket:
+                    self.__dispatch(response)
+            except websockets.ConnectionClosed as e:
+                logger.warning(f'Websocket connection closed: {e}')
+
+            if self.__closed:
+                break
+
+            await self.__reconnect()
+
+    async def __reconnect(self) -> None:
+        for attempt in range(self.__retries):
+            delay = self.__backoff * 2 ** attempt  # exponential backoff
+            await asyncio.sleep(delay)
+
+            try:
+                self.__websocket = await websockets.connect(self.__url)
+                for subscription in self.__subscriptions.values():
+                    await self.__send(subscription.message)  # subscribe again
+
+                logger.info(f'Websocket reconnected, {len(self.__subscriptions)} subscriptions restored')
+                return
+
+            except Exception as e:
+                logger.error(f'Error reconnecting to websocket: {e}')
+
+        # reconnect failed, stop the subscriptions
+        self.__closed = True
+        for subscription in self.__subscriptions.values():
+            subscription.put(ConnectionError('Websocket connection lost'))
+        self.__subscriptions.clear()
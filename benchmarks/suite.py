@@ -0,0 +1,234 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from typing import Callable
+from benchmarks.synthetic import synthetic_quotes
+from indicators.super_trend import super_trend
+from indicators.dmoex import dmoex
+from services.bars import BarStore, UTC_OFFSET
+from services.file import FileService
+from terminals.main import DoubleST
+
+__all__ = "BenchmarkSuite"
+
+logger = logging.getLogger(__name__)
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000, '10M': 10_000_000}
+SUPER_TRENDS = [{'period': 10, 'multiplier': 3}, {'period': 20, 'multiplier': 5}]
+CONFIG = {'var_take': 1.5, 'indicators': {'super_trends': SUPER_TRENDS}}
+
+
+class BenchmarkSuite:
+    def __init__(self, sizes: list[str], repeat: int = 3, memory: bool = True, seed: int = 0) -> None:
+        """
+        Benchmarks of the hot paths on synthetic quotes, they run offline and do not need the 'settings' module.
+
+        Every benchmark prepares its input outside of the measurement, then it is timed 'repeat' times
+        (the best time is kept) and run once more under tracemalloc to measure the peak memory.
+
+        :param sizes: Sizes of the quotes, keys of SIZES ('10k', '100k', '1M', '10M').
+        :param repeat: Number of timed runs of every benchmark.
+        :param memory: Measure the peak memory.
+        :param seed: Seed of the synthetic quotes.
+        """
+        self.__sizes = sizes
+        self.__repeat = repeat
+        self.__memory = memory
+        self.__seed = seed
+        self.__directory = None
+        self.__prepared = {}  # inputs shared by the runs of the benchmarks of one size
+
+    def benchmarks(self) -> dict[str, Callable[[pd.DataFrame], Callable[[], object]]]:
+        """
+        Return the benchmarks: name -> function that takes the quotes and returns the measured function.
+        """
+        return {
+            'super_trend': self.__super_trend,
+            'DoubleST.run': self.__double_st_run,
+            'DoubleST.calculate': self.__double_st_calculate,
+            'DoubleST.report': self.__double_st_report,
+            'FileService.update_file': self.__update_file,
+            'dmoex': self.__dmoex,
+            'csv_load': self.__csv_load,
+        }
+
+    def run(self, names: list[str] = None) -> dict:
+        """
+        Run the benchmarks and return the results: '{name}@{size}' -> {'bars', 'seconds', 'bars_per_second', 'peak_memory'}.
+        """
+        benchmarks = self.benchmarks()
+        names = list(benchmarks) if names is None else names
+        results = {}
+
+        self.__directory = tempfile.mkdtemp(prefix='benchmarks_')
+        try:
+            with open(os.path.join(self.__directory, 'config.json'), 'w') as f:
+                json.dump(CONFIG, f)
+
+            for size in self.__sizes:
+                quotes = synthetic_quotes(SIZES[size], self.__seed)
+                self.__prepared = {}
+                for name in names:
+                    result = self.__measure(benchmarks[name], quotes)
+                    results[f'{name}@{size}'] = result
+                    print(f"{name + '@' + size:<32} {result['seconds']:>10.4f}s {result['bars_per_second']:>14,.0f} bars/s"
+                          f" {result['peak_memory'] / 2 ** 20:>10.1f} MiB")
+        finally:
+            shutil.rmtree(self.__directory, ignore_errors=True)
+
+        return results
+
+    def __measure(self, benchmark: Callable, quotes: pd.DataFrame) -> dict:
+        seconds = float('inf')
+        for _ in range(self.__repeat):
+            function = benchmark(quotes)
+            gc.collect()
+            start = time.perf_counter()
+            function()
+            seconds = min(seconds, time.perf_counter() - start)
+
+        peak_memory = 0
+        if self.__memory:
+            function = benchmark(quotes)
+            gc.collect()
+            tracemalloc.start()
+            function()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        return {'bars': len(quotes), 'seconds': seconds, 'bars_per_second': len(quotes) / seconds, 'peak_memory': peak_memory}
+
+    def __prepare(self, name: str, factory: Callable[[], object]) -> object:
+        if name not in self.__prepared:
+            self.__prepared[name] = factory()
+        return self.__prepared[name]
+
+    def __workspace(self) -> str:
+        # a new ticker directory, so the indicator cache and the bar store start empty
+        directory = tempfile.mkdtemp(dir=self.__directory)
+        shutil.copy(os.path.join(self.__directory, 'config.json'), directory)
+        return directory
+
+    def __super_trend(self, quotes: pd.DataFrame) -> Callable:
+        data = quotes.copy()
+        return lambda: super_trend(SUPER_TRENDS, data)
+
+    def __double_st_run(self, quotes: pd.DataFrame) -> Callable:
+        double_st = DoubleST(self.__workspace())
+        return lambda: double_st.run(quotes)
+
+    def __indicators(self, quotes: pd.DataFrame) -> pd.DataFrame:
+        return self.__prepare('indicators', lambda: DoubleST(self.__workspace()).run(quotes))
+
+    def __double_st_calculate(self, quotes: pd.DataFrame) -> Callable:
+        double_st = DoubleST(self.__workspace())
+        data = self.__indicators(quotes)
+        return lambda: double_st.calculate(data)
+
+    def __double_st_report(self, quotes: pd.DataFrame) -> Callable:
+        double_st = DoubleST(self.__workspace())
+        data = self.__prepare('backtest', lambda: double_st.calculate(self.__indicators(quotes)))
+        return lambda: double_st.report(data, 'optimization')
+
+    def __update_file(self, quotes: pd.DataFrame) -> Callable:
+        messages = self.__prepare('messages', lambda: self.__messages(quotes))
+        store = BarStore(self.__workspace(), 'SBER')  # every run appends to an empty store
+        return lambda: FileService().update_file(store, messages)
+
+    @staticmethod
+    def __messages(quotes: pd.DataFrame) -> list[str]:
+        # websocket messages with the bars, as they come from ALOR
+        times = quotes['date'].values.astype('datetime64[s]').astype(np.int64) - UTC_OFFSET
+        columns = [times.tolist()] + [quotes[column].tolist() for column in ('open', 'high', 'low', 'close', 'volume')]
+        return [json.dumps({'data': {'time': t, 'open': o, 'high': h, 'low': l, 'close': c, 'volume': v}, 'guid': 'benchmark'})
+                for t, o, h, l, c, v in zip(*columns)]
+
+    def __dmoex(self, quotes: pd.DataFrame) -> Callable:
+        def index() -> pd.DataFrame:
+            index = synthetic_quotes(len(quotes), self.__seed + 1, ticker='IMOEX', price=3000.0)
+            index['date'] = index['date'].dt.strftime('%Y%m%d %H:%M:%S')
+            return index
+
+        index = self.__prepare('index', index)
+        return lambda: dmoex(index, quotes)
+
+    def __csv_load(self, quotes: pd.DataFrame) -> Callable:
+        # the legacy data.csv is imported into the bar store and read back, as Manager.get_quotes does on the first run
+        def csv() -> str:
+            directory = self.__workspace()
+            data = quotes.copy()
+            data['date'] = data['date'].dt.strftime('%Y%m%d %H:%M:%S')
+            data.to_csv(os.path.join(directory, 'data.csv'), index=False)
+            return directory
+
+        directory = self.__prepare('csv', csv)
+        path = os.path.join(directory, 'data.csv')
+
+        def load() -> pd.DataFrame:
+            shutil.rmtree(os.path.join(directory, 'bars'), ignore_errors=True)
+            store = BarStore(directory, 'SBER')
+            store.migrate(path)
+            return store.read()
+
+        return load
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Return the benchmarks which are slower than the baseline by more than the threshold (0.2 is 20%).
+    """
+    regressions = []
+    for key, result in results.items():
+        if key in baseline['results']:
+            ratio = result['seconds'] / baseline['results'][key]['seconds']
+            if ratio > 1 + threshold:
+                regressions.append(f"{key}: {result['seconds']:.4f}s, baseline {baseline['results'][key]['seconds']:.4f}s (x{ratio:.2f})")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks of the hot paths on synthetic quotes.')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['10k', '100k', '1M'])
+    parser.add_argument('--benchmarks', nargs='+', default=None, help='names of the benchmarks, all by default')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=os.path.join(os.path.dirname(__file__), 'baseline.json'))
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    suite = BenchmarkSuite(args.sizes, repeat=args.repeat, memory=not args.no_memory, seed=args.seed)
+    results = suite.run(args.benchmarks)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': sys.version, 'platform': platform.platform(), 'numpy': np.__version__,
+                       'pandas': pd.__version__, 'results': results}, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from services.bars import UTC_OFFSET
+
+__all__ = "synthetic_quotes"
+
+SESSION_START = 10 * 60 * 60  # first bar of the day, 10:00:00
+SESSION_BARS = 168  # 5-minute bars from 10:00:00 to 23:55:00
+
+
+def synthetic_quotes(length: int, seed: int = 0, ticker: str = 'SBER', start: str = '2020-01-06',
+                     price: float = 250.0, volatility: float = 0.0015) -> pd.DataFrame:
+    """
+    Generate a seeded series of 5-minute OHLCV bars in the format of BarStore.read.
+
+    The bars follow the trading sessions of the exchange (weekdays from 10:00 to 23:55), so the market stop
+    at 23:45 of the strategy is reached every day. Closes are a geometric random walk, open is the previous
+    close with a small gap, high and low are around the body of the bar, prices are rounded to 0.01.
+
+    :param length: Number of bars.
+    :param seed: Seed of the random generator, the same seed gives the same quotes.
+    :param ticker: The ticker symbol.
+    :param start: The first day of the series.
+    :param price: The first price.
+    :param volatility: Standard deviation of the relative change of the close of one bar.
+    :return: A DataFrame with the columns 'ticker', 'time' (seconds since epoch, UTC), 'date' (datetime64), 'open', 'high', 'low', 'close', 'volume'.
+    """
+    rng = np.random.default_rng(seed)
+
+    # trading days and the time of every bar inside the session
+    days = pd.bdate_range(start, periods=length // SESSION_BARS + 1).values.astype('datetime64[s]')
+    bar = np.arange(length)
+    date = days[bar // SESSION_BARS] + (SESSION_START + (bar % SESSION_BARS) * 300).astype('timedelta64[s]')
+
+    close = price * np.exp(np.cumsum(rng.normal(0, volatility, length)))
+    open = np.concatenate([[price], close[:-1]]) * (1 + rng.normal(0, volatility / 4, length))
+    body_high = np.maximum(open, close)
+    body_low = np.minimum(open, close)
+
+    return pd.DataFrame({
+        'ticker': ticker,
+        'time': date.astype(np.int64) - UTC_OFFSET,
+        'date': date,
+        'open': np.round(open, 2),
+        'high': np.round(body_high * (1 + np.abs(rng.normal(0, volatility / 2, length))), 2),
+        'low': np.round(body_low * (1 - np.abs(rng.normal(0, volatility / 2, length))), 2),
+        'close': np.round(close, 2),
+        'volume': rng.integers(1, 5000, length),
+    })
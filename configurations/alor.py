@@ -22,6 +22,8 @@ class AlorConfiguration:
         self.https_url: str = alor['https_url']  # Alor HTTPS URL
         self.stock_market: str = alor['stock_market']  # Alor stock market
         self.tickers: list = alor['tickers']  # List of tickers
+        self.download_concurrency: int = alor.get('download_concurrency', 10)  # Maximum number of simultaneous downloads
+        self.http_timeout: float = alor.get('http_timeout', 10)  # Timeout of REST requests in seconds
 
     @property
     def is_work(self) -> bool:
@@ -0,0 +1,44 @@
+import math
+
+
+class ATRState:
+    """Streaming Average True Range with Wilder smoothing, the same way talib.ATR calculates it.
+
+    The first value is available on the bar with index 'period' and is the simple average of the previous
+    'period' true ranges, after that ATR = (previous ATR * (period - 1) + true range) / period.
+    """
+
+    def __init__(self, period: int, count: int = 0, prev_close: float = math.nan, total: float = 0.0,
+                 value: float = math.nan):
+        self.period = period
+        self.count = count  # number of bars seen
+        self.prev_close = prev_close
+        self.total = total  # sum of true ranges until the first value
+        self.value = value
+
+    def update(self, high: float, low: float, close: float) -> float:
+        """Advance the ATR by one bar and return its value (NaN until there is enough bars)."""
+        self.count += 1
+        prev_close, self.prev_close = self.prev_close, close
+
+        if self.count == 1:
+            return self.value
+
+        true_range = max(high - low, abs(prev_close - high), abs(prev_close - low))
+
+        if self.count <= self.period:
+            self.total += true_range
+        elif self.count == self.period + 1:
+            self.value = (self.total + true_range) / self.period
+        else:
+            self.value = (self.value * (self.period - 1) + true_range) / self.period
+
+        return self.value
+
+    def to_dict(self) -> dict:
+        return {'period': self.period, 'count': self.count, 'prev_close': self.prev_close,
+                'total': self.total, 'value': self.value}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'ATRState':
+        return cls(state['period'], state['count'], state['prev_close'], state['total'], state['value'])
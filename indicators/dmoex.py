@@ -1,40 +1,80 @@
+import numpy as np
 import pandas as pd
 
+from datetime import datetime
+from services.session import Session, seconds, to_datetime, to_epoch
 
-def dmoex(index: pd.DataFrame, data: pd.DataFrame) -> pd.DataFrame:
-
-    # convert the date column to datetime format
-    index['date'] = pd.to_datetime(index['date'], format='%Y%m%d %H:%M:%S')
-    data['date'] = pd.to_datetime(data['date'], format='%Y-%m-%d %H:%M:%S')
 
-    # group the data by date and get the value 'open' at the beginning of the day
-    open_values = index.resample('1D', on='date').first()[['open']]
-    open_values['day'] = open_values.index.date
-    open_values['day'] = pd.to_datetime(open_values['day'], format='%Y%m%d').dt.strftime('%Y%m%d')
+def dmoex(index: pd.DataFrame, data: pd.DataFrame) -> pd.DataFrame:
+    """Add the 'dmoex' column: direction of the IMOEX index in the current session ('UP', 'DOWN' or 'NON').
 
-    # create a new column 'day' in the index DataFrame
-    index['day'] = pd.to_datetime(index['date'], format='%Y%m%d %H:%M:%S').dt.strftime('%Y%m%d')
+    The direction of an index bar compares its close with the open of the first index bar of the day. Every
+    bar of data gets the direction of the index bar with the same time, the bars without it keep the previous
+    direction. The bars at 09:55 are dropped.
 
-    # transform the 'open' column of open_values to a dictionary
-    open_values_map = open_values.set_index('day')['open'].to_dict()
+    Args:
+        index (pd.DataFrame): IMOEX bars with 'time' (seconds since epoch, UTC) or 'date' ('%Y%m%d %H:%M:%S' or datetime),
+            'open' and 'close' columns.
+        data (pd.DataFrame): Quotes with 'date' ('%Y-%m-%d %H:%M:%S' or datetime) column, sorted by date.
+    """
+    index_session = Session(_to_epoch(index, '%Y%m%d %H:%M:%S'))
+    data = data.copy()
+    data['date'] = _to_datetime(data['date'], '%Y-%m-%d %H:%M:%S')
 
-    # compare the values ​​in the close column from index with the corresponding values ​​in the open column from open_values_map
-    index['direction'] = index.apply(lambda row: 'UP' if row['close'] > open_values_map[row['day']]
-                                     else 'DOWN' if row['close'] < open_values_map[row['day']] else 'NON', axis=1)
+    # open of the day for every index bar
+    day_open = index['open'].groupby(index_session.day).transform('first').to_numpy(dtype=float)
 
-    # create a new column 'dmoex' in the date of the frame 'data' using merge
-    data = pd.merge(data, index[['date', 'direction']], on='date', how='left')
+    # direction from the sign of the change since the open of the day
+    sign = np.sign(index['close'].to_numpy(dtype=float) - day_open)
+    direction = np.where(sign > 0, 'UP', np.where(sign < 0, 'DOWN', 'NON')).astype(object)
 
-    # rename column 'direction' in 'dmoex'
-    data = data.rename(columns={'direction': 'dmoex'})
+    # join the bars with the same time, both sides are sorted by time
+    directions = pd.DataFrame({'date': to_datetime(index_session.time).astype(data['date'].dtype), 'dmoex': direction})
+    directions = directions.sort_values('date', kind='stable').drop_duplicates('date', keep='last')
+    data = pd.merge_asof(data, directions, on='date', direction='backward', tolerance=pd.Timedelta(0))
 
     # drop rows with '09:55:00'
-    data = data[data['date'].dt.strftime('%H:%M:%S') != '09:55:00']
-
-    # reset index to ensure the rows are in the correct order and drop the old index column
-    data = data.reset_index(drop=True)
+    data = data[Session.of(data).time_of_day != seconds('09:55:00')].reset_index(drop=True)
 
     # fill missing values
     data['dmoex'] = data['dmoex'].ffill()
 
     return data
+
+
+def _to_datetime(date: pd.Series, format: str) -> pd.Series:
+    return date if pd.api.types.is_datetime64_any_dtype(date) else pd.to_datetime(date, format=format)
+
+
+def _to_epoch(quotes: pd.DataFrame, format: str) -> np.ndarray:
+    return quotes['time'].to_numpy(dtype=np.int64) if 'time' in quotes.columns else to_epoch(quotes['date'], format)
+
+
+class DMOEXState:
+    """Streaming direction of the IMOEX index, it keeps only the open of the current session.
+
+    Fed with the same index bars, it gives the same directions as dmoex; a bar of data gets the last direction.
+    """
+
+    def __init__(self, day: str = None, open: float = np.nan, direction: str = None):
+        self.day = day  # day of the current session, 'YYYY-MM-DD'
+        self.open = open  # open of the first index bar of the session
+        self.direction = direction
+
+    def update(self, date: datetime, open: float, close: float) -> str:
+        """Advance by one index bar and return its direction."""
+        day = date.date().isoformat()
+        if day != self.day or self.open != self.open:  # new session, or no open yet in this one
+            self.day = day
+            self.open = open
+
+        self.direction = 'UP' if close > self.open else 'DOWN' if close < self.open else 'NON'
+
+        return self.direction
+
+    def to_dict(self) -> dict:
+        return {'day': self.day, 'open': self.open, 'direction': self.direction}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'DMOEXState':
+        return cls(state['day'], state['open'], state['direction'])
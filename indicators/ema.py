@@ -0,0 +1,35 @@
+import math
+
+
+class EMAState:
+    """Streaming Exponential Moving Average, the same way talib.EMA calculates it.
+
+    The first value is available on the bar with index 'period - 1' and is the simple average of the first
+    'period' closes, after that EMA = (close - previous EMA) * 2 / (period + 1) + previous EMA.
+    """
+
+    def __init__(self, period: int, count: int = 0, total: float = 0.0, value: float = math.nan):
+        self.period = period
+        self.count = count  # number of bars seen
+        self.total = total  # sum of closes until the first value
+        self.value = value
+
+    def update(self, close: float) -> float:
+        """Advance the EMA by one bar and return its value (NaN until there is enough bars)."""
+        self.count += 1
+
+        if self.count < self.period:
+            self.total += close
+        elif self.count == self.period:
+            self.value = (self.total + close) / self.period
+        else:
+            self.value = ((close - self.value) * (2.0 / (self.period + 1))) + self.value
+
+        return self.value
+
+    def to_dict(self) -> dict:
+        return {'period': self.period, 'count': self.count, 'total': self.total, 'value': self.value}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'EMAState':
+        return cls(state['period'], state['count'], state['total'], state['value'])
@@ -1,41 +1,26 @@
+import math
+import numpy as np
 import pandas as pd
 import talib
 
+from indicators.atr import ATRState
+from services.metrics import metrics
 
-def super_trend(config: pd.DataFrame, data: pd.DataFrame, last_data: pd.DataFrame = None) -> pd.DataFrame:
-
-    def create_supet_trend_lines(period: int, multiplier: int) -> None:
-        """Create SuperTrend lines for the given period and multiplier.
-
-        This function calculates the Average True Range (ATR) for a specified period
-        and uses it to determine the upper and lower SuperTrend lines by applying
-        the specified multiplier.
-
-        Args:
-            period (int): The period over which to calculate the ATR.
-            multiplier (int): The multiplier to apply to the ATR for the SuperTrend lines.
-        """
-        # Define column names for ATR and SuperTrend lines
-        name_ATR = f'ATR {period}'
-        name_upper_line = f'UP {multiplier}'
-        name_lower_line = f'LOW {multiplier}'
-
-        # Calculate ATR for the given period
-        data[name_ATR] = talib.ATR(data['high'].values, data['low'].values, data['close'].values,
-                                   timeperiod=period)
-
-        # Calculate upper and lower SuperTrend lines using the multiplier
-        data[name_upper_line] = data['high'] + (multiplier * data[name_ATR])
-        data[name_lower_line] = data['low'] - (multiplier * data[name_ATR])
-
-        # Initialize columns for the SuperTrend values
-        data[f'ST {period} {multiplier} UP'] = pd.Series(dtype=float)
-        data[f'ST {period} {multiplier} LOW'] = pd.Series(dtype=float)
-
-    for params in config:
-        create_supet_trend_lines(params['period'], params['multiplier'])
 
-    # calculate SuperTrends
+@metrics.timed('super_trend')
+def super_trend(config: pd.DataFrame, data: pd.DataFrame, last_data: pd.DataFrame = None) -> pd.DataFrame:
+    """Calculate SuperTrend columns 'ST {period} {multiplier} UP/LOW' for every indicator in config.
+
+    Prices and ATR are pulled out of the DataFrame once, the band/trend state machine runs over
+    plain arrays and the result columns are written back once per indicator.
+
+    Args:
+        config (list): List of dicts with 'period' and 'multiplier' keys.
+        data (pd.DataFrame): Quotes with 'open', 'high', 'low' and 'close' columns.
+        last_data (pd.DataFrame): Previously calculated data, used to continue the trend and to fill
+            the rows where ATR is not available yet.
+    """
+    # calculate the previous trends
     prev_trend = ['lower'] * len(config)
 
     if last_data is not None:
@@ -50,75 +35,168 @@ def super_trend(config: pd.DataFrame, data: pd.DataFrame, last_data: pd.DataFram
             else:
                 raise ValueError("error:006 Something went wrong")
 
-    def calculate_trend(prefix: str, name: str, trend: str) -> None:
-        """Calculate the SuperTrend value for a given period and multiplier based on the previous value and the current close/open price.
+    high = data['high'].to_numpy(dtype=float)
+    low = data['low'].to_numpy(dtype=float)
+    close_values = data['close'].to_numpy(dtype=float)
+    open = data['open'].to_numpy(dtype=float).tolist()
+    close = close_values.tolist()
+
+    for i, params in enumerate(config):
+        period, multiplier = params['period'], params['multiplier']
+        name = f'ST {period} {multiplier}'
+
+        # Calculate ATR and the upper and lower SuperTrend lines using the multiplier
+        atr = talib.ATR(high, low, close_values, timeperiod=period)
+        upper_line = (high + (multiplier * atr)).tolist()
+        lower_line = (low - (multiplier * atr)).tolist()
+
+        st_up, st_low = calculate_trend(open, close, upper_line, lower_line, prev_trend[i],
+                                        data.index, name, last_data)
+
+        data[name + ' UP'] = np.array(st_up, dtype=float)
+        data[name + ' LOW'] = np.array(st_low, dtype=float)
+
+    return data
+
 
-        The function takes into account the previous trend (lower or upper) and the current close/open price to determine the current SuperTrend value.
+def calculate_trend(open: list, close: list, upper_line: list, lower_line: list, trend: str,
+                    index: pd.Index, name: str, last_data: pd.DataFrame = None) -> tuple[list, list]:
+    """Run the SuperTrend state machine over the whole series of one indicator.
+
+    The function takes into account the previous trend (lower or upper) and the current close/open price
+    to determine the SuperTrend value of every bar.
+
+    Args:
+        open (list): Open prices.
+        close (list): Close prices.
+        upper_line (list): Upper line (high + multiplier * ATR) for every bar.
+        lower_line (list): Lower line (low - multiplier * ATR) for every bar.
+        trend (str): The trend before the first bar (lower or upper).
+        index (pd.Index): Index of the data, used to look up values in last_data.
+        name (str): The name of the SuperTrend columns without the ' UP'/' LOW' suffix.
+        last_data (pd.DataFrame): Previously calculated data or None.
+
+    Returns:
+        tuple: Lists with the values of the UP and LOW SuperTrend lines.
+    """
+    nan = math.nan
+    st_up = [nan] * len(open)
+    st_low = [nan] * len(open)
+    prev_up = prev_low = nan
+
+    for j in range(len(open)):
+        up_line = upper_line[j]
+        low_line = lower_line[j]
 
-        Args:
-            prefix (str): The prefix for the column names of the upper and lower SuperTrend lines.
-            name (str): The name of the column in the data DataFrame to store the SuperTrend value.
-            trend (str): The previous trend (lower or upper).
-        """
         # Check if the upper and lower SuperTrend lines are None
-        if pd.isnull(row[f'UP {prefix}']) or pd.isnull(row[f'LOW {prefix}']):
+        if up_line != up_line or low_line != low_line:
             # If there last data, copy the values from it
             if last_data is not None:
-                data.loc[index, name + ' UP'] = last_data.loc[index, name + ' UP']
-                data.loc[index, name + ' LOW'] = last_data.loc[index, name + ' LOW']
-            # If last data is None, stop the calculation
-            return
-
-        upper = round(row[f'UP {prefix}'], 2) if pd.isnull(data.loc[index - 1, name+' UP']
-                                                           ) else round(min(data.loc[index - 1, name+' UP'], row[f'UP {prefix}']), 2)
-        lower = round(row[f'LOW {prefix}'], 2) if pd.isnull(data.loc[index - 1, name+' LOW']
-                                                            ) else round(max(data.loc[index - 1, name+' LOW'], row[f'LOW {prefix}']), 2)
-        close = row['close']
-        open = row['open']
-
-        if trend == 'lower':
-            if open >= lower:
-                if close >= lower:
-                    data.loc[index, name+' LOW'] = lower
-                elif close < lower:
-                    data.loc[index, name + ' UP'] = round(row[f'UP {prefix}'], 2)
-                    trend = 'upper'
-                else:
-                    raise ValueError("error:001 Something went wrong")
-            elif open < lower:
-                data.loc[index, name + ' UP'] = round(row[f'UP {prefix}'], 2)
+                st_up[j] = prev_up = float(last_data.loc[index[j], name + ' UP'])
+                st_low[j] = prev_low = float(last_data.loc[index[j], name + ' LOW'])
+            else:
+                prev_up = prev_low = nan
+            continue
+
+        trend, prev_up, prev_low = trend_step(trend, prev_up, prev_low, open[j], close[j], up_line, low_line)
+
+        st_up[j] = prev_up
+        st_low[j] = prev_low
+
+    return st_up, st_low
+
+
+def trend_step(trend: str, prev_up: float, prev_low: float, open: float, close: float,
+               up_line: float, low_line: float) -> tuple[str, float, float]:
+    """Calculate the SuperTrend value of one bar based on the previous value and the current close/open price.
+
+    Args:
+        trend (str): The previous trend (lower or upper).
+        prev_up (float): The previous value of the UP SuperTrend line (NaN if there is none).
+        prev_low (float): The previous value of the LOW SuperTrend line (NaN if there is none).
+        open (float): Open price of the bar.
+        close (float): Close price of the bar.
+        up_line (float): Upper line (high + multiplier * ATR) of the bar.
+        low_line (float): Lower line (low - multiplier * ATR) of the bar.
+
+    Returns:
+        tuple: The new trend and the values of the UP and LOW SuperTrend lines (one of them is NaN).
+    """
+    upper = round(up_line, 2) if prev_up != prev_up else round(min(prev_up, up_line), 2)
+    lower = round(low_line, 2) if prev_low != prev_low else round(max(prev_low, low_line), 2)
+    st_up = st_low = math.nan
+
+    if trend == 'lower':
+        if open >= lower:
+            if close >= lower:
+                st_low = lower
+            elif close < lower:
+                st_up = round(up_line, 2)
                 trend = 'upper'
             else:
-                raise ValueError("error:002 Something went wrong")
-        elif trend == 'upper':
-            if open <= upper:
-                if close <= upper:
-                    data.loc[index, name + ' UP'] = upper
-                elif close > upper:
-                    data.loc[index, name + ' LOW'] = round(row[f'LOW {prefix}'], 2)
-                    trend = 'lower'
-                else:
-                    raise ValueError("error:003 Something went wrong")
-            elif open > upper:
-                data.loc[index, name + ' LOW'] = round(row[f'LOW {prefix}'], 2)
+                raise ValueError("error:001 Something went wrong")
+        elif open < lower:
+            st_up = round(up_line, 2)
+            trend = 'upper'
+        else:
+            raise ValueError("error:002 Something went wrong")
+    elif trend == 'upper':
+        if open <= upper:
+            if close <= upper:
+                st_up = upper
+            elif close > upper:
+                st_low = round(low_line, 2)
                 trend = 'lower'
             else:
-                raise ValueError("error:004 Something went wrong")
+                raise ValueError("error:003 Something went wrong")
+        elif open > upper:
+            st_low = round(low_line, 2)
+            trend = 'lower'
         else:
-            raise ValueError("error:005 Unexpected value")
+            raise ValueError("error:004 Something went wrong")
+    else:
+        raise ValueError("error:005 Unexpected value")
 
-        prev_trend[i] = trend
+    return trend, st_up, st_low
 
-    for index, row in data.iterrows():
-        for i, params in enumerate(config):
-            calculate_trend(params['multiplier'], f'ST {params['period']} {params['multiplier']}', prev_trend[i])
 
-    for params in config:
-        columns_to_drop = [
-            f'ATR {params["period"]}',
-            f'UP {params["multiplier"]}',
-            f'LOW {params["multiplier"]}',
-        ]
-        data.drop(columns=columns_to_drop, inplace=True)
+class SuperTrendState:
+    """Streaming SuperTrend: takes one OHLC bar and returns the new UP/LOW values in constant time.
 
-    return data
+    Fed with the same bars from the beginning of the history, it produces the same values as super_trend.
+    """
+
+    def __init__(self, period: int, multiplier: int, atr: ATRState = None, trend: str = 'lower',
+                 up: float = math.nan, low: float = math.nan):
+        self.period = period
+        self.multiplier = multiplier
+        self.atr = ATRState(period) if atr is None else atr
+        self.trend = trend
+        self.up = up
+        self.low = low
+
+    @property
+    def name(self) -> str:
+        return f'ST {self.period} {self.multiplier}'
+
+    def update(self, open: float, high: float, low: float, close: float) -> tuple[float, float]:
+        """Advance the SuperTrend by one bar and return the values of the UP and LOW lines."""
+        atr = self.atr.update(high, low, close)
+        up_line = high + (self.multiplier * atr)
+        low_line = low - (self.multiplier * atr)
+
+        if up_line != up_line or low_line != low_line:
+            self.up = self.low = math.nan
+        else:
+            self.trend, self.up, self.low = trend_step(self.trend, self.up, self.low, open, close, up_line, low_line)
+
+        return self.up, self.low
+
+    def to_dict(self) -> dict:
+        return {'period': self.period, 'multiplier': self.multiplier, 'atr': self.atr.to_dict(),
+                'trend': self.trend, 'up': self.up, 'low': self.low}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'SuperTrendState':
+        return cls(state['period'], state['multiplier'], ATRState.from_dict(state['atr']),
+                   state['trend'], state['up'], state['low'])
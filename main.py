@@ -1,7 +1,6 @@
 import logging
 import os
 import asyncio
-import pandas as pd
 import json
 import time
 
@@ -74,6 +73,8 @@ if __name__ == "__main__":
     2 - show;
     3 - optimize;
     4 - run;
+    5 - run without chart;
+    6 - walk-forward optimization;
     0 - exit;
                          
 Please, enter mode:'''
@@ -89,28 +90,14 @@ Please, enter mode:'''
             start_time = time.time()
             manager = Manager('SBER')
             quotes = manager.get_quotes()
-            quotes['date'] = pd.to_datetime(quotes['date'], format='%Y%m%d %H:%M:%S')
             quotes_completed = time.time()
             print('Quotes completed...'+str(round(quotes_completed-start_time, 3))+'s')
 
             dir = manager.get_directory()
             double_st = DoubleST(dir)
 
-            # Check if file with data exists
-            if os.path.exists(os.path.join(dir, 'explore.csv')):
-                # Read data from file
-                dobleST = pd.read_csv(os.path.join(dir, 'explore.csv'), header=0)
-            else:
-                # Create empty DataFrame with columns
-                dobleST = pd.DataFrame(columns=['ticker', 'date', 'open', 'high', 'low', 'close'])
-                # Write DataFrame to file
-                dobleST.to_csv(os.path.join(dir, 'explore.csv'), index=False)
-                # Calculate data
-                dobleST = double_st.run(quotes)
-
-            # If the data and quotes have the same last dates, then there is no point in recalculating
-            data = dobleST if (dobleST['date'].iloc[-1] == str(quotes['date'].iloc[-1])) else double_st.run(quotes)
-            data.to_csv(os.path.join(dir, 'explore.csv'), index=False)  # write data to file
+            # Indicators are taken from the cache, only new bars are calculated
+            data = double_st.run(quotes)
             data_completed = time.time()
             print('Data completed...'+str(round(data_completed-quotes_completed, 3))+'s')
 
@@ -123,16 +110,28 @@ Please, enter mode:'''
         # Optimize
         elif mode == 3:
             manager = Manager('SBER')
+            quotes = manager.get_quotes()
 
-            data = pd.read_csv(manager.get_doubleST_path(), header=0)
-
+            # the workers take the indicators from the cache, so nothing is written between the modes
             double_st = DoubleST(manager.get_directory())
-            double_st.optimize(data, {'start': 1.0, 'step': 0.1, 'end': 3.0})
+            double_st.optimize(quotes, {'start': 1.0, 'step': 0.1, 'end': 3.0})
         # Run
         elif mode == 4:
             print("Start running...")
             alor = AlorAccount()
             alor.run()
+        # Run without GUI
+        elif mode == 5:
+            print("Start running without chart...")
+            alor = AlorAccount()
+            alor.run(show=False)
+        # Walk-forward optimization of every ticker, the folds of a ticker are optimized in parallel
+        elif mode == 6:
+            for ticker in AlorConfiguration().tickers:
+                manager = Manager(ticker)
+
+                double_st = DoubleST(manager.get_directory())
+                double_st.walk_forward(manager.get_quotes(), {'start': 1.0, 'step': 0.1, 'end': 3.0})
         # Exit
         elif mode == 0:
             print("Program exit")
@@ -0,0 +1,127 @@
+import logging
+import math
+import numpy as np
+import pandas as pd
+
+from services.session import Session
+from strategies.withDoubleTrend import WithDoubleTrend
+
+__all__ = "Backtest"
+
+logger = logging.getLogger(__name__)
+
+BUY_LIMIT, SELL_LIMIT, TAKE_PROFIT = 0, 1, 2
+
+
+class Backtest:
+    def __init__(self, quantity: int = 10, market_stop: str = '23:45:00') -> None:
+        """
+        Array-based backtest of WithDoubleTrend, it gives the same result as the Orders/Position loop of DoubleST.calculate.
+
+        The conditions of the strategy are calculated for all bars at once, then the limit, take profit and
+        market stop fills are simulated in one pass over plain arrays.
+
+        :param quantity: Quantity of every order.
+        :param market_stop: Time of day when an open position is closed at the open price.
+        """
+        self.__quantity = quantity
+        self.__market_stop = market_stop
+
+    def run(self, data: pd.DataFrame, strategy: WithDoubleTrend) -> pd.DataFrame:
+        """
+        Run the backtest and return the order list with the 'SIGNAL', 'BUY_PRICE', 'SELL_PRICE' and 'TAKE_PROFIT' columns.
+
+        :param data: Quotes with the SuperTrend columns of the strategy.
+        :param strategy: The strategy, only its parameters are used.
+        :return: The order list, it has rows only for the bars with fills or a pending take profit.
+        """
+        length = len(data)
+        signals = strategy.signals(data)
+        long_open = signals['long_open'].tolist()
+        long_close = signals['long_close'].tolist()
+        entry_price = signals['price'].tolist()
+        take_profit = signals['take_profit'].tolist()
+
+        open = data['open'].to_numpy(dtype=float).tolist()
+        high = data['high'].to_numpy(dtype=float).tolist()
+        low = data['low'].to_numpy(dtype=float).tolist()
+        close = data['close'].to_numpy(dtype=float).tolist()
+
+        # session arrays, calculated once for all bars
+        market_stop = Session.of(data, self.__market_stop).market_stop.tolist()
+
+        nan = math.nan
+        columns = {
+            'SIGNAL': np.full(length, nan, dtype=object),
+            'BUY_PRICE': np.full(length, nan),
+            'SELL_PRICE': np.full(length, nan),
+            'TAKE_PROFIT': np.full(length, nan),
+        }
+        order = []  # order in which the columns appear
+        touched = np.zeros(length, dtype=bool)  # bars with any record
+
+        def record(index: int, column: str, value) -> None:
+            if column not in order:
+                order.append(column)
+            columns[column][index] = value
+            touched[index] = True
+
+        quantity = self.__quantity
+        position = 0
+        orders = []  # pending orders: (type, price, take profit, id)
+        next_id = 0
+
+        for index in range(1, length):
+            if index == length - 1 and position > 0:
+                orders.append((SELL_LIMIT, open[index], None, next_id))
+                next_id += 1
+
+            # strategy
+            if position == 0:
+                if long_open[index]:
+                    orders.append((BUY_LIMIT, entry_price[index], take_profit[index], next_id))
+                    next_id += 1
+            elif position > 0:
+                if long_close[index]:
+                    orders.append((SELL_LIMIT, close[index], None, next_id))
+                    next_id += 1
+
+            # orders, the orders created during the pass are checked from the next bar
+            if orders:
+                bar_high = high[index]
+                bar_low = low[index]
+
+                for kind, price, take, id in list(orders):
+                    if bar_low <= price <= bar_high:
+                        orders = [item for item in orders if item[3] != id]
+
+                        if kind == BUY_LIMIT:
+                            position += quantity
+                            record(index, 'SIGNAL', 'LONG_BUY')
+                            record(index, 'BUY_PRICE', price)
+                            orders.append((TAKE_PROFIT, take, None, next_id))
+                            next_id += 1
+
+                        elif kind == SELL_LIMIT:
+                            position -= quantity
+                            record(index, 'SIGNAL', 'LONG_SELL')
+                            record(index, 'SELL_PRICE', price)
+                            if position == 0:
+                                orders = []
+
+                        else:
+                            position -= quantity
+                            record(index, 'SIGNAL', 'TAKE_PROFIT')
+                            record(index, 'SELL_PRICE', price)
+
+                    elif kind == TAKE_PROFIT:
+                        record(index, 'TAKE_PROFIT', price)
+
+            if position > 0 and market_stop[index]:
+                position -= quantity
+                record(index, 'SIGNAL', 'MARKET_STOP')
+                record(index, 'SELL_PRICE', open[index])
+                orders = []
+
+        rows = np.flatnonzero(touched)
+        return pd.DataFrame({column: columns[column][rows] for column in order}, index=data.index[rows])
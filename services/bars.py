@@ -0,0 +1,253 @@
+import logging
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from datetime import timezone, timedelta
+
+__all__ = "BarStore"
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = timezone(timedelta(hours=3))  # exchange time zone (UTC+3)
+UTC_OFFSET = 3 * 60 * 60  # exchange time zone offset in seconds
+
+# columns of the store and their types, each column is kept in its own binary file
+COLUMNS = {
+    'time': np.int64,  # start of the bar, seconds since epoch (UTC)
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.int64,
+}
+
+
+class BarStore:
+    def __init__(self, directory: str, ticker: str = None) -> None:
+        """
+        Initialize a columnar bar store in the 'bars' subdirectory of the given directory.
+
+        Every column is an append-only file of raw little-endian values ('time.bin', 'open.bin', ...),
+        so loading the quotes is a memory map of the files and does not parse anything.
+
+        :param directory: The ticker (or index) directory.
+        :param ticker: The ticker symbol, by default the name of the directory.
+        """
+        self.__directory = os.path.join(directory, 'bars')
+        self.__ticker = os.path.basename(os.path.normpath(directory)) if ticker is None else ticker
+
+    def __len__(self) -> int:
+        """
+        Return the number of complete bars in the store.
+
+        If writing was interrupted and the columns have different lengths, the shortest column wins.
+        """
+        self.__recover()
+        sizes = []
+        for column, dtype in COLUMNS.items():
+            path = self.__path(column)
+            sizes.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+        return min(sizes)
+
+    def __path(self, column: str) -> str:
+        return os.path.join(self.__directory, column + '.bin')
+
+    def get_ticker(self) -> str:
+        return self.__ticker
+
+    def read_columns(self) -> dict[str, np.ndarray]:
+        """
+        Return the columns of the store as read-only memory-mapped arrays.
+
+        :return: A dictionary with 'time', 'open', 'high', 'low', 'close' and 'volume' arrays.
+        """
+        length = len(self)
+        if length == 0:
+            return {column: np.empty(0, dtype=dtype) for column, dtype in COLUMNS.items()}
+
+        return {column: np.memmap(self.__path(column), dtype=np.dtype(dtype).newbyteorder('<'), mode='r', shape=(length,))
+                for column, dtype in COLUMNS.items()}
+
+    def read(self) -> pd.DataFrame:
+        """
+        Return the quotes as a DataFrame with the columns 'ticker', 'time', 'date', 'open', 'high', 'low', 'close', 'volume'.
+
+        The 'time' column is the start of the bar in seconds since epoch (UTC), the canonical time of the bar,
+        the 'date' column is the same time as datetime64 in the exchange time zone (naive).
+        """
+        columns = self.read_columns()
+
+        return pd.DataFrame({
+            'ticker': self.__ticker,
+            'time': np.asarray(columns['time'], dtype=np.int64),
+            'date': (columns['time'] + UTC_OFFSET).astype('datetime64[s]'),
+            'open': columns['open'],
+            'high': columns['high'],
+            'low': columns['low'],
+            'close': columns['close'],
+            'volume': columns['volume'],
+        })
+
+    def last_time(self) -> int | None:
+        """
+        Return the time of the last bar in seconds since epoch (UTC), or None if the store is empty.
+        """
+        length = len(self)
+        if length == 0:
+            return None
+
+        with open(self.__path('time'), 'rb') as f:
+            f.seek((length - 1) * np.dtype(np.int64).itemsize)
+            return int(np.frombuffer(f.read(np.dtype(np.int64).itemsize), dtype='<i8')[0])
+
+    def append(self, columns: dict) -> int:
+        """
+        Append bars to the end of the store.
+
+        :param columns: A dictionary with 'time', 'open', 'high', 'low', 'close' and 'volume' sequences of the same length.
+        :return: The number of appended bars.
+        """
+        arrays = {column: np.asarray(columns[column], dtype=np.dtype(dtype).newbyteorder('<')) for column, dtype in COLUMNS.items()}
+        length = len(arrays['time'])
+        if any(len(array) != length for array in arrays.values()):
+            raise ValueError("All columns must have the same length")
+        if length == 0:
+            return 0
+
+        os.makedirs(self.__directory, exist_ok=True)
+
+        # cut the columns to the same length if the previous writing was interrupted
+        stored = len(self)
+        for column, dtype in COLUMNS.items():
+            path = self.__path(column)
+            if os.path.exists(path) and os.path.getsize(path) != stored * np.dtype(dtype).itemsize:
+                with open(path, 'r+b') as f:
+                    f.truncate(stored * np.dtype(dtype).itemsize)
+
+        for column, array in arrays.items():
+            with open(self.__path(column), 'ab') as f:
+                f.write(array.tobytes())
+
+        return length
+
+    def merge(self, columns: dict) -> int:
+        """
+        Insert bars into the store in time order, for example the bars of a gap downloaded later.
+
+        The bars which are already in the store are skipped. If the store has duplicated or unsorted bars,
+        they are repaired too (the last written version of a bar is kept). Only the bars after the first changed
+        position are written again: the new tail is written to '{column}.merge' files and 'merge.json' first,
+        then the columns are cut and the tail is appended, so an interrupted merge is finished by the next call.
+
+        :param columns: A dictionary with 'time', 'open', 'high', 'low', 'close' and 'volume' sequences of the same length.
+        :return: The number of inserted bars.
+        """
+        length = len(self)
+        new = {column: np.asarray(columns[column], dtype=np.dtype(dtype)) for column, dtype in COLUMNS.items()}
+        time = self.__read_column('time', 0, length)
+
+        # the new bars which are not stored yet, the last version of a bar wins
+        _, last = np.unique(new['time'][::-1], return_index=True)
+        keep = len(new['time']) - 1 - last
+        keep = keep[~np.isin(new['time'][keep], time)]
+        new = {column: values[keep] for column, values in new.items()}
+
+        # the stored bars are sorted up to the first duplicated or unsorted bar
+        broken = np.flatnonzero(time[1:] <= time[:-1])
+        sorted_length = int(broken[0]) + 1 if len(broken) > 0 else length
+
+        # the tail starts at the place of the earliest bar which is new or after the sorted part
+        first = [new['time'][:1], time[sorted_length:]]
+        first = np.concatenate(first)
+        if len(first) == 0:
+            return 0
+        position = int(np.searchsorted(time[:sorted_length], first.min(), side='left'))
+
+        # the new tail: the stored bars from the position and the new bars, sorted, the last version of a bar wins
+        tail = {column: np.concatenate([self.__read_column(column, position, length), new[column]]) for column in COLUMNS}
+        _, last = np.unique(tail['time'][::-1], return_index=True)
+        order = len(tail['time']) - 1 - last
+        tail = {column: values[order] for column, values in tail.items()}
+
+        os.makedirs(self.__directory, exist_ok=True)
+        for column, dtype in COLUMNS.items():
+            with open(self.__path(column) + '.merge', 'wb') as f:
+                f.write(tail[column].astype(np.dtype(dtype).newbyteorder('<')).tobytes())
+        journal = os.path.join(self.__directory, 'merge.json')
+        with open(journal + '.tmp', 'w') as f:
+            json.dump({'position': position}, f)
+        os.replace(journal + '.tmp', journal)  # the merge is committed, it is finished even if it is interrupted now
+
+        self.__recover()
+        logger.info(f"Merged {len(keep)} bars into {self.__ticker}, {len(tail['time'])} bars written from position {position}")
+        return len(keep)
+
+    def __read_column(self, column: str, start: int, stop: int) -> np.ndarray:
+        """
+        Read a part of a column into memory (not a memory map, so the file can be cut).
+        """
+        dtype = np.dtype(COLUMNS[column]).newbyteorder('<')
+        if stop <= start or not os.path.exists(self.__path(column)):
+            return np.empty(0, dtype=COLUMNS[column])
+        with open(self.__path(column), 'rb') as f:
+            f.seek(start * dtype.itemsize)
+            return np.fromfile(f, dtype=dtype, count=stop - start).astype(COLUMNS[column])
+
+    def __recover(self) -> None:
+        """
+        Finish a committed merge: cut the columns at the position of the merge and append the new tail.
+        """
+        journal = os.path.join(self.__directory, 'merge.json')
+        if not os.path.exists(journal):
+            return
+
+        with open(journal, 'r') as f:
+            position = json.load(f)['position']
+        for column, dtype in COLUMNS.items():
+            path = self.__path(column)
+            with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+                f.truncate(position * np.dtype(dtype).itemsize)
+                f.seek(0, os.SEEK_END)
+                with open(path + '.merge', 'rb') as merge:
+                    f.write(merge.read())
+        for column in COLUMNS:
+            os.remove(self.__path(column) + '.merge')
+        os.remove(journal)
+
+    def import_csv(self, path: str) -> int:
+        """
+        Append the quotes from a CSV file in the format 'ticker,date,open,high,low,close,volume'
+        with dates in the format 'YYYYMMDD HH:MM:SS' (exchange time).
+
+        :return: The number of imported bars.
+        """
+        quotes = pd.read_csv(path, header=0)
+        date = pd.to_datetime(quotes['date'], format='%Y%m%d %H:%M:%S')
+
+        return self.append({
+            'time': date.values.astype('datetime64[s]').astype(np.int64) - UTC_OFFSET,
+            'open': quotes['open'].values,
+            'high': quotes['high'].values,
+            'low': quotes['low'].values,
+            'close': quotes['close'].values,
+            'volume': quotes['volume'].values,
+        })
+
+    def export_csv(self, path: str) -> None:
+        """
+        Write the quotes to a CSV file in the format 'ticker,date,open,high,low,close,volume'
+        with dates in the format 'YYYYMMDD HH:MM:SS' (exchange time).
+        """
+        quotes = self.read().drop(columns='time')
+        quotes['date'] = quotes['date'].dt.strftime('%Y%m%d %H:%M:%S')
+        quotes.to_csv(path, index=False)
+
+    def migrate(self, path: str) -> None:
+        """
+        Import the legacy CSV file with quotes if the store is still empty.
+        """
+        if len(self) == 0 and os.path.exists(path):
+            logger.info(f"Import {path} into the bar store")
+            self.import_csv(path)
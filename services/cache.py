@@ -0,0 +1,252 @@
+import logging
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import talib
+
+from collections import OrderedDict
+from indicators.super_trend import SuperTrendState, calculate_trend
+from indicators.atr import ATRState
+from indicators.ema import EMAState
+from services.metrics import metrics
+from services.session import epoch
+
+__all__ = "IndicatorCache"
+
+logger = logging.getLogger(__name__)
+
+
+
+def batch_super_trend(params: dict, inputs: dict) -> tuple[tuple, SuperTrendState] | None:
+    """
+    Calculate the SuperTrend of all bars with talib and the array state machine of super_trend.
+
+    :return: The UP and LOW columns and the streaming state after the last bar, or None if the last bar has no ATR yet.
+    """
+    period, multiplier = params['period'], params['multiplier']
+    high, low, close = inputs['high'], inputs['low'], inputs['close']
+
+    atr = talib.ATR(high, low, close, timeperiod=period)
+    if len(atr) == 0 or np.isnan(atr[-1]):
+        return None
+
+    up, down = calculate_trend(inputs['open'].tolist(), close.tolist(), (high + multiplier * atr).tolist(),
+                               (low - multiplier * atr).tolist(), 'lower', None, f'ST {period} {multiplier}')
+
+    # the true ranges before the first ATR value, the state keeps their sum
+    true_range = np.maximum(high[1:period] - low[1:period], np.maximum(np.abs(close[:period - 1] - high[1:period]), np.abs(close[:period - 1] - low[1:period])))
+    state = SuperTrendState(period, multiplier, ATRState(period, len(close), float(close[-1]), float(true_range.sum()), float(atr[-1])),
+                            'upper' if up[-1] == up[-1] else 'lower', up[-1], down[-1])
+    return (up, down), state
+
+
+def batch_ema(params: dict, inputs: dict) -> tuple[tuple, EMAState] | None:
+    """
+    Calculate the EMA of all bars with talib.
+
+    :return: The EMA column and the streaming state after the last bar, or None if the last bar has no EMA yet.
+    """
+    period = params['period']
+    close = inputs['close']
+
+    ema = talib.EMA(close, timeperiod=period)
+    if len(ema) == 0 or np.isnan(ema[-1]):
+        return None
+
+    return (ema,), EMAState(period, len(close), float(close[:period - 1].sum()), float(ema[-1]))
+
+
+# implementations of the cached indicators: state factory, state loader, bar update, batch calculation and output names
+INDICATORS = {
+    'super_trend': {
+        'create': lambda params: SuperTrendState(params['period'], params['multiplier']),
+        'load': SuperTrendState.from_dict,
+        'update': lambda state, open, high, low, close: state.update(open, high, low, close),
+        'batch': batch_super_trend,
+        'outputs': ('UP', 'LOW'),
+    },
+    'ema': {
+        'create': lambda params: EMAState(params['period']),
+        'load': EMAState.from_dict,
+        'update': lambda state, open, high, low, close: (state.update(close),),
+        'batch': batch_ema,
+        'outputs': ('EMA',),
+    },
+}
+
+INPUT_COLUMNS = ('time', 'open', 'high', 'low', 'close')
+
+
+class IndicatorCache:
+    # memory tier shared by all caches of the process: path of the entry -> entry
+    __memory: OrderedDict = OrderedDict()
+    __memory_size = 0
+
+    def __init__(self, directory: str, memory_budget: int = 256 * 1024 * 1024) -> None:
+        """
+        Initialize a cache of indicator columns.
+
+        An entry is addressed by (ticker, indicator, parameters, time of the first bar) and keeps the calculated columns, the streaming state
+        after the last bar and a fingerprint of the quotes it was calculated from. A new entry is calculated with the batch
+        kernel (talib and the arrays of super_trend). If the quotes start with the cached bars, only the new bars
+        are added to the state one by one; if they differ, the entry is calculated again.
+
+        Entries are stored on disk as .npy files in the given directory and kept in memory while they fit into the budget
+        (least recently used entries are dropped first).
+
+        :param directory: The directory of the cache on disk.
+        :param memory_budget: Maximum size of the cached columns in memory in bytes.
+        """
+        self.__directory = directory
+        self.__memory_budget = memory_budget
+
+    def get(self, ticker: str, indicator: str, params: dict, quotes: pd.DataFrame) -> dict[str, np.ndarray]:
+        """
+        Return the columns of the indicator for the quotes.
+
+        :param ticker: The ticker symbol.
+        :param indicator: The name of the indicator ('super_trend' or 'ema').
+        :param params: The parameters of the indicator, for example {'period': 10, 'multiplier': 3}.
+        :param quotes: Quotes with 'time' (or 'date'), 'open', 'high', 'low' and 'close' columns.
+        :return: A dictionary with the output columns ('UP' and 'LOW' for 'super_trend', 'EMA' for 'ema'),
+                 the arrays are shared with the cache and read-only.
+        """
+        definition = INDICATORS[indicator]
+        inputs = self.__inputs(quotes)
+        length = len(inputs['close'])
+
+        # histories with another first bar are other entries, only the extensions of a history share its entry
+        first = int(inputs['time'][0]) if length > 0 else None
+        key = hashlib.blake2b(json.dumps([ticker, indicator, params, first], sort_keys=True).encode(), digest_size=16).hexdigest()
+        path = os.path.join(self.__directory, key)
+        entry = self.__load(path)
+
+        # fingerprints of the cached part of the quotes and of all quotes, calculated in one pass
+        cached_length = entry['length'] if entry is not None and entry['length'] <= length else 0
+        prefix, fingerprint = self.__fingerprint(inputs, cached_length)
+
+        if entry is not None and entry['fingerprint'] == fingerprint and entry['length'] == length:
+            metrics.count('IndicatorCache', 'hits')
+            return entry['outputs']
+
+        if entry is not None and cached_length > 0 and entry['fingerprint'] == prefix:
+            start = cached_length
+            state = definition['load'](entry['state'])
+            previous = entry['outputs']
+            logger.debug(f"Extend {indicator} {params} of {ticker} from {start} to {length} bars")
+        else:
+            start = 0
+            state = definition['create'](params)
+            previous = None
+            logger.debug(f"Calculate {indicator} {params} of {ticker}, {length} bars")
+
+        metrics.count('IndicatorCache', 'extended' if start > 0 else 'misses')
+        metrics.count('IndicatorCache', 'bars_computed', length - start)
+
+        # all bars are calculated with the batch kernel, new bars are added to the state one by one
+        batch = definition['batch'](params, inputs) if start == 0 else None
+        if batch is not None:
+            values, state = batch
+        else:
+            values = [[] for _ in definition['outputs']]
+            update = definition['update']
+            for bar in zip(*(inputs[column][start:].tolist() for column in ('open', 'high', 'low', 'close'))):
+                for output, value in zip(values, update(state, *bar)):
+                    output.append(value)
+
+        outputs = {}
+        for name, output in zip(definition['outputs'], values):
+            tail = np.array(output, dtype=np.float64)
+            outputs[name] = tail if previous is None else np.concatenate([previous[name], tail])
+
+        entry = {'length': length, 'fingerprint': fingerprint, 'state': state.to_dict(), 'outputs': outputs}
+        self.__save(path, entry)
+
+        return outputs
+
+    @staticmethod
+    def __inputs(quotes: pd.DataFrame) -> dict[str, np.ndarray]:
+        inputs = {column: quotes[column].to_numpy(dtype=np.float64) for column in ('open', 'high', 'low', 'close')}
+        inputs['time'] = epoch(quotes)
+        return inputs
+
+    @staticmethod
+    def __fingerprint(inputs: dict, prefix_length: int) -> tuple[str, str]:
+        """
+        Return the fingerprints of the first prefix_length bars and of all bars.
+        """
+        hashes = [hashlib.blake2b(digest_size=16) for _ in INPUT_COLUMNS]
+        for column, hash in zip(INPUT_COLUMNS, hashes):
+            hash.update(np.ascontiguousarray(inputs[column][:prefix_length]).tobytes())
+        prefix = hashlib.blake2b(b''.join(hash.digest() for hash in hashes), digest_size=16).hexdigest()
+
+        for column, hash in zip(INPUT_COLUMNS, hashes):
+            hash.update(np.ascontiguousarray(inputs[column][prefix_length:]).tobytes())
+        fingerprint = hashlib.blake2b(b''.join(hash.digest() for hash in hashes), digest_size=16).hexdigest()
+
+        return prefix, fingerprint
+
+    def __load(self, path: str) -> dict | None:
+        memory = IndicatorCache.__memory
+        if path in memory:
+            memory.move_to_end(path)
+            return memory[path]
+
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+
+        try:
+            with open(meta_path, 'r') as f:
+                entry = json.load(f)
+            entry['outputs'] = {name: np.load(os.path.join(path, name + '.npy')) for name in entry['outputs']}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Broken cache entry {path}: {e}")
+            return None
+
+        if any(len(values) != entry['length'] for values in entry['outputs'].values()):
+            return None  # the files were written by another process at the same time, calculate the entry again
+
+        self.__remember(path, entry)
+        return entry
+
+    def __save(self, path: str, entry: dict) -> None:
+        os.makedirs(path, exist_ok=True)
+
+        # write to temporary files first, so a reader never sees a half written entry
+        # (the names are unique per process, because workers of the optimizer share the cache)
+        suffix = f'.{os.getpid()}.tmp'
+        for name, values in entry['outputs'].items():
+            with open(os.path.join(path, name + suffix), 'wb') as f:
+                np.save(f, values)
+            os.replace(os.path.join(path, name + suffix), os.path.join(path, name + '.npy'))
+
+        meta = {**entry, 'outputs': list(entry['outputs'])}
+        with open(os.path.join(path, 'meta' + suffix), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, 'meta' + suffix), os.path.join(path, 'meta.json'))
+
+        self.__remember(path, entry)
+
+    def __remember(self, path: str, entry: dict) -> None:
+        memory = IndicatorCache.__memory
+        if path in memory:
+            IndicatorCache.__memory_size -= self.__size(memory.pop(path))
+
+        # the callers get the arrays of the memory tier, they must not change them
+        for values in entry['outputs'].values():
+            values.flags.writeable = False
+
+        memory[path] = entry
+        IndicatorCache.__memory_size += self.__size(entry)
+
+        # drop the least recently used entries
+        while IndicatorCache.__memory_size > self.__memory_budget and len(memory) > 1:
+            _, dropped = memory.popitem(last=False)
+            IndicatorCache.__memory_size -= self.__size(dropped)
+
+    @staticmethod
+    def __size(entry: dict) -> int:
+        return sum(values.nbytes for values in entry['outputs'].values())
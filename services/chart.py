@@ -0,0 +1,131 @@
+import logging
+import numpy as np
+import pandas as pd
+
+__all__ = "ChartData"
+
+logger = logging.getLogger(__name__)
+
+# levels of detail from the finest to the coarsest: name -> numpy unit of the bucket (None keeps the bars)
+LEVELS = {'5m': None, '1h': 'h', '1d': 'D'}
+
+SPARSE_COLUMNS = ('BUY_PRICE', 'SELL_PRICE', 'TAKE_PROFIT')
+
+
+class ChartData:
+    def __init__(self, data: pd.DataFrame, lines: list[str] = None) -> None:
+        """
+        Chart data with levels of detail, it is prepared once and gives only the visible window.
+
+        Bars are aggregated into 1-hour and 1-day candles (first open, highest high, lowest low, last close).
+        The indicator lines of an aggregated candle keep their last value and the minimum and the maximum
+        inside the candle ('{line} min', '{line} max'), so the peaks of a line do not disappear on a coarse level.
+        The orders and signals are taken once from the rows where they are set (a sparse index) and moved to the
+        candle which contains them.
+
+        :param data: Quotes with 'date', 'open', 'high', 'low', 'close', the lines and optionally the 'SIGNAL',
+                     'BUY_PRICE', 'SELL_PRICE' and 'TAKE_PROFIT' columns of a backtest.
+        :param lines: Columns of the indicator lines.
+        """
+        self.__lines = [] if lines is None else list(lines)
+
+        date = data['date'] if pd.api.types.is_datetime64_any_dtype(data['date']) else pd.to_datetime(data['date'], format='mixed')
+        self.__date = date.to_numpy(dtype='datetime64[ns]')
+        columns = {column: data[column].to_numpy(dtype=float) for column in ['open', 'high', 'low', 'close'] + self.__lines}
+
+        self.__levels = {}
+        for level, unit in LEVELS.items():
+            self.__levels[level] = self.__aggregate(columns, unit)
+
+        # sparse index of the orders and signals: positions of the rows where they are set
+        self.__sparse = {}
+        for column in SPARSE_COLUMNS:
+            if column in data.columns:
+                values = data[column].to_numpy(dtype=float)
+                rows = np.flatnonzero(~np.isnan(values))
+                self.__sparse[column] = (self.__date[rows], values[rows])
+
+        self.__signals = {}
+        if 'SIGNAL' in data.columns:
+            rows = np.flatnonzero(data['SIGNAL'].notnull().to_numpy())
+            names = data['SIGNAL'].to_numpy()[rows]
+            buy_price = data['BUY_PRICE'].to_numpy(dtype=float)[rows] if 'BUY_PRICE' in data.columns else np.full(len(rows), np.nan)
+            sell_price = data['SELL_PRICE'].to_numpy(dtype=float)[rows] if 'SELL_PRICE' in data.columns else np.full(len(rows), np.nan)
+            price = np.where(np.isnan(buy_price), sell_price, buy_price)
+            for name in pd.unique(names):
+                selected = names == name
+                self.__signals[name] = (self.__date[rows][selected], price[selected])
+
+    def __aggregate(self, columns: dict, unit: str | None) -> pd.DataFrame:
+        if unit is None:
+            return pd.DataFrame(columns, index=pd.DatetimeIndex(self.__date, name='date'))
+
+        # the bars are sorted by time, so every candle is a run of bars with the same bucket
+        bucket = self.__date.astype(f'datetime64[{unit}]')
+        starts = np.flatnonzero(np.concatenate([[True], bucket[1:] != bucket[:-1]])) if len(bucket) > 0 else np.arange(0)
+        ends = np.concatenate([starts[1:], [len(bucket)]]) - 1
+
+        aggregated = {
+            'open': columns['open'][starts],
+            'high': np.fmax.reduceat(columns['high'], starts) if len(starts) > 0 else columns['high'],
+            'low': np.fmin.reduceat(columns['low'], starts) if len(starts) > 0 else columns['low'],
+            'close': columns['close'][ends],
+        }
+        for line in self.__lines:
+            values = columns[line]
+            aggregated[line] = values[ends]
+            aggregated[line + ' min'] = np.fmin.reduceat(values, starts) if len(starts) > 0 else values
+            aggregated[line + ' max'] = np.fmax.reduceat(values, starts) if len(starts) > 0 else values
+
+        return pd.DataFrame(aggregated, index=pd.DatetimeIndex(bucket[starts].astype('datetime64[ns]'), name='date'))
+
+    @staticmethod
+    def __bounds(index: np.ndarray, start, end) -> tuple[int, int]:
+        first = 0 if start is None else int(np.searchsorted(index, np.datetime64(pd.Timestamp(start), 'ns'), side='left'))
+        last = len(index) if end is None else int(np.searchsorted(index, np.datetime64(pd.Timestamp(end), 'ns'), side='right'))
+        return first, last
+
+    def levels(self) -> list[str]:
+        return list(self.__levels)
+
+    def window(self, start=None, end=None, width: int = 4000) -> tuple[str, pd.DataFrame]:
+        """
+        Return the finest level which has at most 'width' candles between start and end, and its candles there.
+
+        :param start: The first visible time, by default the beginning of the data.
+        :param end: The last visible time, by default the end of the data.
+        :param width: Maximum number of candles, about the width of the chart in pixels.
+        :return: The name of the level ('5m', '1h' or '1d') and the candles with the lines.
+        """
+        for level, candles in self.__levels.items():
+            first, last = self.__bounds(candles.index.values, start, end)
+            if last - first <= width or level == list(self.__levels)[-1]:
+                return level, candles.iloc[first:last]
+
+    def __place(self, dates: np.ndarray, values: np.ndarray, level: str, start, end) -> pd.Series:
+        first, last = self.__bounds(dates, start, end)
+        dates, values = dates[first:last], values[first:last]
+
+        unit = LEVELS[level]
+        if unit is not None:
+            dates = dates.astype(f'datetime64[{unit}]').astype('datetime64[ns]')  # the candle which contains the row
+            _, keep = np.unique(dates, return_index=True)  # one marker per candle
+            dates, values = dates[keep], values[keep]
+
+        return pd.Series(values, index=pd.DatetimeIndex(dates, name='date'))
+
+    def sparse(self, column: str, level: str = '5m', start=None, end=None) -> pd.Series:
+        """
+        Return the values of an order column ('BUY_PRICE', 'SELL_PRICE', 'TAKE_PROFIT') between start and end
+        at the times of the candles of the level, or an empty series if the data does not have the column.
+        """
+        if column not in self.__sparse:
+            return pd.Series(dtype=float, index=pd.DatetimeIndex([], dtype='datetime64[ns]', name='date'))
+        return self.__place(*self.__sparse[column], level, start, end)
+
+    def signals(self, level: str = '5m', start=None, end=None) -> dict[str, pd.Series]:
+        """
+        Return the prices of every signal ('LONG_BUY', 'LONG_SELL', ...) between start and end
+        at the times of the candles of the level.
+        """
+        return {name: self.__place(dates, prices, level, start, end) for name, (dates, prices) in self.__signals.items()}
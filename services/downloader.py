@@ -1,9 +1,16 @@
+import asyncio
 import logging
 import os
+import json
+import numpy as np
 import pandas as pd
 
 from datetime import timedelta
 from services.file import FileService
+from services.bars import BarStore, COLUMNS
+from services.integrity import GapScanner
+from services.manager import Manager
+from services.metrics import metrics
 from configurations.alor import AlorConfiguration
 from api.client import AlorClientService
 
@@ -11,64 +18,143 @@ __all__ = "Downloader"
 
 logger = logging.getLogger(__name__)
 
+ROW_SIZE = sum(np.dtype(dtype).itemsize for dtype in COLUMNS.values())  # bytes of one bar in the store
+
 
 class Downloader:
-    def __init__(self) -> None:
+    def __init__(self, concurrency: int = None, retries: int = 3, backoff: float = 1.0) -> None:
+        """
+        Initialize an instance of Downloader.
+
+        :param concurrency: Maximum number of instruments downloaded at the same time, by default 'download_concurrency' from the configuration.
+        :param retries: Number of retries of a failed download.
+        :param backoff: Delay before the first retry in seconds, it doubles with every next retry.
+        """
         config = AlorConfiguration()  # Load ALOR broker configuration
         self.__tickers = config.tickers  # list of tickers
         self.__indexes = ['IMOEX']
-
-    async def run(self, tickers: list = None, indexes: list = None) -> pd.DataFrame:
+        self.__concurrency = config.download_concurrency if concurrency is None else concurrency
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__scanner = GapScanner(config.open, config.close, config.work_days)
+
+    async def run(self, tickers: list = None, indexes: list = None, backfill: bool = True) -> pd.DataFrame:
+        """
+        Download the new bars of the tickers and the indexes.
+
+        With backfill, the stored history is checked against the trading calendar after the new bars are appended:
+        the missing ranges are downloaded concurrently and merged into the store in time order, duplicated bars
+        are removed. The data built from the positions of the bars (timeframes, indicators state) is removed
+        after a merge. The downloaded ranges are remembered in 'gaps.json', so the bars which do not exist
+        (no trades, holidays) are not requested again.
+        """
         file = FileService()
         client = AlorClientService()
+        semaphore = asyncio.Semaphore(self.__concurrency)  # limit of simultaneous downloads
+        ranges = asyncio.Semaphore(self.__concurrency)  # limit of simultaneous requests of missing ranges
+
+        async def fill_gaps(store: BarStore, directory: str, ticker: str) -> None:
+            path = os.path.join(directory, 'gaps.json')  # ranges which were already downloaded
+            checked = []
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    checked = json.load(f)['checked']
+
+            time = store.read_columns()['time']
+            report = self.__scanner.scan(time, checked)
+            broken = report['duplicates'] + report['unsorted']
+            if len(report['ranges']) == 0 and broken == 0:
+                return
+            logger.info(f"{ticker}: {report['missing']} missing bars in {len(report['ranges'])} ranges, {broken} duplicated or unsorted bars")
+
+            async def fetch(start: int, end: int) -> list[dict]:
+                async with ranges:
+                    return await client.get_history(ticker, start, end)
+
+            results = await asyncio.gather(*(fetch(start, end) for start, end in report['ranges']))
+            inserted = store.merge(file.to_columns([bar for bars in results for bar in bars]))
+            logger.info(f"Backfilled {inserted} bars of {ticker}")
+            metrics.count('download', 'bars_backfilled', inserted)
+            if inserted > 0 or broken > 0:
+                Manager.invalidate(directory)  # the bars moved, the data built from their positions is not valid
+
+            with open(path + '.tmp', 'w') as f:
+                json.dump({'checked': GapScanner.compact(checked + report['ranges'], int(time.min()))}, f)  # the file does not grow with every run
+            os.replace(path + '.tmp', path)
 
         async def update_quotes(file_path: str, ticker: str) -> None:
-            if not os.path.exists(file_path):  # if file with quotes doesn't exist
-                file.create_data_file(file_path)  # create date file in directory
+            store = BarStore(os.path.dirname(file_path), ticker)  # bar store in the directory of the ticker
+            store.migrate(file_path)  # import quotes from data.csv if they are not in the store yet
 
-            quotes = pd.read_csv(file_path, header=0)  # read quotes from file data.csv
+            # get last date from store, if there is no data then it will be firs minute of first day of previous month
+            last_date = file.get_last_date(store)
 
-            # get last date from file, if there is no data then it will be firs minute of first day of previous month
-            last_date = file.get_last_date(quotes)
-
-            data = await client.ws_history_date(ticker, last_date, timedelta(minutes=5))  # get data from last date to now
+            # get data from last date to now
+            data = await client.ws_history_date(ticker, last_date, timedelta(minutes=5), raise_errors=True)
 
             if len(data) > 0:
-                file.update_file(ticker, quotes, data,)  # update file
-                quotes.to_csv(file_path, index=False)  # write quotes to file
+                appended = file.update_file(store, data)  # append new quotes to store
+                logger.info(f"Appended {appended} bars of {ticker}")
+
+                metrics.count('download', 'bars_received', len(data))
+                metrics.count('download', 'bars_written', appended)
+                metrics.count('download', 'bytes_written', appended * ROW_SIZE)
 
             else:
                 print(f"No data for {ticker}")
 
-        tickers = self.__tickers if tickers is None else tickers
-        indexes = self.__indexes if indexes is None else indexes
+            if backfill:
+                await fill_gaps(store, os.path.dirname(file_path), ticker)
 
-        percent_step = 100/(len(tickers) + len(indexes))  # initial percentage
-        percentage = 0.0
+        async def download(file_path: str, ticker: str) -> None:
+            nonlocal completed
 
-        logger.info("Start downloading...")
-        print("Start downloading...")
+            for attempt in range(self.__retries + 1):
+                try:
+                    async with semaphore:
+                        await update_quotes(file_path, ticker)
+                    break
+
+                except Exception as e:
+                    metrics.count('download', 'errors')
+                    if attempt == self.__retries:
+                        failed.append(ticker)
+                        logger.error(f"Failed to download {ticker} quotes: {e}")
+                        break
 
-        for ticker in tickers:
+                    delay = self.__backoff * 2 ** attempt  # exponential backoff
+                    logger.warning(f"Error downloading {ticker} quotes: {e}, retry in {delay:.1f}s")
+                    await asyncio.sleep(delay)
 
-            file_path = os.path.join(os.path.dirname(os.path.dirname(__file__))+'\\tickers\\', ticker, 'data.csv')  # file path for ticker
+            completed += 1
+            percentage = completed * 100 / len(jobs)
+            status = 'Failed' if ticker in failed else 'Downloaded'
 
-            await update_quotes(file_path, ticker)
+            logger.info(f"{status} {ticker} quotes, {completed}/{len(jobs)}, {percentage:.2f}% completed")
+            print(f"{status} {ticker} quotes, {completed}/{len(jobs)}, {percentage:.2f}% completed")
 
-            percentage += percent_step
+        tickers = self.__tickers if tickers is None else tickers
+        indexes = self.__indexes if indexes is None else indexes
 
-            logger.info(f"Downloaded {ticker} quotes, {percentage:.2f}% completed")
-            print(f"Downloaded {ticker} quotes, {percentage:.2f}% completed")
+        root = os.path.dirname(os.path.dirname(__file__))
+        jobs = [(os.path.join(root+'\\tickers\\', ticker, 'data.csv'), ticker) for ticker in tickers]  # file paths for tickers
+        jobs += [(os.path.join(root+'\\indexes\\', index, 'data.csv'), index) for index in indexes]  # file paths for indexes
 
-        for index in indexes:
-            file_path = os.path.join(os.path.dirname(os.path.dirname(__file__))+'\\indexes\\', index, 'data.csv')  # file path for index
+        completed = 0
+        failed = []
 
-            await update_quotes(file_path, index)
+        logger.info("Start downloading...")
+        print("Start downloading...")
 
-            percentage += percent_step
+        try:
+            with metrics.stage('download'):
+                await asyncio.gather(*(download(file_path, ticker) for file_path, ticker in jobs))  # all downloads share one websocket
+        finally:
+            await client.close()
 
-            logger.info(f"Downloaded {index} quotes, {percentage:.2f}% completed")
-            print(f"Downloaded {index} quotes, {percentage:.2f}% completed")
+        if len(failed) > 0:
+            logger.error(f"Downloading failed for {', '.join(failed)}")
+            print(f"Downloading failed for {', '.join(failed)}")
 
         logger.info("Downloading completed")
         print("Downloading completed")
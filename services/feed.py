@@ -0,0 +1,132 @@
+import asyncio
+import collections
+import json
+import logging
+import socket
+import threading
+import time
+import pandas as pd
+
+from typing import Callable
+
+__all__ = "BarFeed", "BarFeedClient"
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8790
+
+
+def encode(row: dict) -> bytes:
+    """
+    Encode a row as one JSON line, dates are written in ISO format.
+    """
+    return (json.dumps({key: value.isoformat() if isinstance(value, pd.Timestamp) else value
+                        for key, value in row.items()}, default=str) + '\n').encode()
+
+
+class BarFeed:
+    def __init__(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT, history: int = 500, buffer: int = 1000) -> None:
+        """
+        Local TCP feed of the complete bars of the live engines, one JSON line per bar.
+
+        A viewer which connects first receives the last 'history' bars of every ticker, then the new ones.
+        Every viewer has its own bounded buffer: if a viewer does not read, its oldest bars are dropped,
+        so a slow viewer never holds the engines.
+
+        :param host: The host to listen on.
+        :param port: The port to listen on.
+        :param history: Number of the last bars of every ticker sent to a new viewer.
+        :param buffer: Maximum number of bars waiting for one viewer.
+        """
+        self.__host = host
+        self.__port = port
+        self.__history = collections.defaultdict(lambda: collections.deque(maxlen=history))
+        self.__buffer = buffer
+        self.__clients: set[asyncio.Queue] = set()
+        self.__server = None
+
+    async def start(self) -> None:
+        self.__server = await asyncio.start_server(self.__serve, self.__host, self.__port)
+        logger.info(f"Bar feed on {self.__host}:{self.__port}")
+
+    async def close(self) -> None:
+        if self.__server is not None:
+            self.__server.close()
+            for queue in self.__clients:
+                queue.put_nowait(None)
+            await self.__server.wait_closed()
+
+    def publish(self, row: dict) -> None:
+        """
+        Send a complete bar to the viewers, it must be called in the event loop of the feed.
+        """
+        line = encode(row)
+        self.__history[row['ticker']].append(line)
+
+        for queue in self.__clients:
+            if queue.full():
+                queue.get_nowait()  # drop the oldest bar of a slow viewer
+            queue.put_nowait(line)
+
+    async def __serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        queue = asyncio.Queue(maxsize=self.__buffer)
+        for lines in self.__history.values():
+            for line in list(lines)[-self.__buffer:]:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(line)
+        self.__clients.add(queue)
+
+        try:
+            while True:
+                line = await queue.get()
+                if line is None:
+                    break
+                writer.write(line)
+                await writer.drain()
+        except (ConnectionError, OSError) as e:
+            logger.info(f"Viewer disconnected: {e}")
+        finally:
+            self.__clients.discard(queue)
+            writer.close()
+
+
+class BarFeedClient:
+    def __init__(self, on_row: Callable[[dict], None], host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                 reconnect: float = 1.0) -> None:
+        """
+        Reader of a BarFeed in a background thread, it reconnects while the feed is not available.
+
+        :param on_row: Function called in the reader thread with every received bar (the 'date' is a pd.Timestamp).
+        :param host: The host of the feed.
+        :param port: The port of the feed.
+        :param reconnect: Delay between connection attempts in seconds.
+        """
+        self.__on_row = on_row
+        self.__host = host
+        self.__port = port
+        self.__reconnect = reconnect
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__read, name='feed', daemon=True)
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stopped.set()
+
+    def __read(self) -> None:
+        while not self.__stopped.is_set():
+            try:
+                with socket.create_connection((self.__host, self.__port), timeout=self.__reconnect) as connection:
+                    connection.settimeout(None)
+                    for line in connection.makefile('r', encoding='utf-8'):
+                        if self.__stopped.is_set():
+                            return
+                        row = json.loads(line)
+                        row['date'] = pd.Timestamp(row['date'])
+                        self.__on_row(row)
+            except OSError as e:
+                logger.debug(f"Bar feed is not available: {e}")
+
+            time.sleep(self.__reconnect)
@@ -1,8 +1,9 @@
 import logging
 import json
-import pandas as pd
+import numpy as np
 
 from datetime import datetime, timezone, timedelta
+from services.bars import BarStore, COLUMNS, TIMEZONE
 
 __all__ = "FileService"
 
@@ -11,53 +12,61 @@ logger = logging.getLogger(__name__)
 
 class FileService:
 
-    def create_data_file(self, path: str) -> None:
+    def get_last_date(self, store: BarStore) -> datetime:
         """
-        Create a new file with the given path and write the header line to it.
+        Retrieve the last date from a bar store or return the start of the previous month.
 
-        The header line is a string that contains the column names for the data that will be written to the file.
-        The column names are the following:
-
-        - ticker: the ticker symbol for the data
-        - date: the date of the data in the format 'YYYYMMDD HH:MM:SS'
-        - open: the opening price of the data
-        - high: the highest price of the data
-        - low: the lowest price of the data
-        - close: the closing price of the data
-        - vol: the volume of the data
-
-        :param path: The path to the file to be created
-        :return: None
-        """
-        with open(path, 'w') as f:  # write first line
-            f.write('ticker,date,open,high,low,close,volume\n')
-
-    def get_last_date(self, df: pd.DataFrame) -> datetime:
-        """
-        Retrieve the last date from a DataFrame or return the start of the current month.
-
-        This method checks if the provided DataFrame is empty. If it is, it returns
-        the first minute of the first day of the current month in the timezone UTC+3.
-        If the DataFrame is not empty, it retrieves the date from the last row of the
-        'date' column, converts it to a datetime object, and returns it with the timezone
+        This method checks if the provided store is empty. If it is, it returns
+        the first minute of the first day of the previous month in the timezone UTC+3.
+        If the store is not empty, it returns the time of the last bar with the timezone
         set to UTC+3.
 
-        :param df: A pandas DataFrame containing a 'date' column with dates in the format 'YYYYMMDD HH:MM:SS'.
+        :param store: A bar store with the quotes.
         :return: A datetime object representing the last date with timezone set to UTC+3.
         """
-        if df.empty:
+        last_time = store.last_time()
+        if last_time is None:
             now = datetime.now(timezone.utc)  # Get current date and time
             now = now - timedelta(days=31) # Subtract 1 month ago
             return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone(timedelta(hours=3)))  # Get first day of current month
         else:
-            # Return value from the last row of column 'date' in datetime format
-            return datetime.strptime(df.iloc[-1]["date"], "%Y%m%d %H:%M:%S").replace(tzinfo=timezone(timedelta(hours=3)))
+            # Return time of the last bar in datetime format
+            return datetime.fromtimestamp(last_time, TIMEZONE)
+
+    def parse_bars(self, data: list[str]) -> dict[str, np.ndarray]:
+        """
+        Parse websocket messages with bars into column arrays.
+
+        All messages are decoded with a single json.loads call. If the same bar was received several times,
+        only its last (most recent) version is kept, the bars are returned sorted by time.
+
+        :param data: A list of strings, where each string is a JSON object with the bar in the 'data' key.
+        :return: A dictionary with 'time', 'open', 'high', 'low', 'close' and 'volume' arrays.
+        """
+        items = [item['data'] for item in json.loads('[' + ','.join(data) + ']')]  # decode all messages at once
+        return self.to_columns(items)
+
+    def to_columns(self, items: list[dict]) -> dict[str, np.ndarray]:
+        """
+        Convert decoded bars into column arrays, sorted by time, the last version of a repeated bar is kept.
+
+        :param items: A list of dictionaries with 'time', 'open', 'high', 'low', 'close' and 'volume'.
+        :return: A dictionary with 'time', 'open', 'high', 'low', 'close' and 'volume' arrays.
+        """
+        columns = {column: np.fromiter((item[column] for item in items), dtype=dtype, count=len(items))
+                   for column, dtype in COLUMNS.items()}
 
-    def update_file(self, ticker: str, df: pd.DataFrame, data: list[str]) -> None:
+        # index of the last message of every bar, sorted by time
+        _, last = np.unique(columns['time'][::-1], return_index=True)
+        keep = len(items) - 1 - last
+
+        return {column: values[keep] for column, values in columns.items()}
+
+    def update_file(self, store: BarStore, data: list[str]) -> int:
         """
-        Update a DataFrame with the given by appending new data to it.
+        Update a bar store by appending new data to it.
 
-        This method takes a ticker symbol, a DataFrame, and a list of strings, where
+        This method takes a bar store and a list of strings, where
         each string is a JSON object containing the following keys:
 
         - time: a timestamp in seconds
@@ -67,19 +76,22 @@ class FileService:
         - close: the closing price
         - volume: the volume
 
-        The method converts each timestamp to a datetime object in the timezone
-        UTC+3, and then adds data to the DataFrame in the format 'ticker,date,open,high,low,close,volume\n'.
+        The messages are parsed in one pass, the timestamps are stored as they are (seconds since epoch, UTC).
+        Bars that are already in the store (the overlap of a repeated request) are dropped and only
+        the new bars are appended, the stored data is never rewritten.
 
-        :param ticker: The ticker symbol for the data
-        :param df: A pandas DataFrame containing a 'date' column with dates in the format 'YYYYMMDD HH:MM:SS'.
+        :param store: A bar store with the quotes.
         :param data: A list of strings, where each string is a JSON object containing the keys 'time', 'open', 'high', 'low', 'close', and 'volume'.
-        :return: None
+        :return: The number of appended bars.
         """
-        for item in data:  # for each item in data
-            json_item = json.loads(item)['data']  # convert item to json
-            date = datetime.fromtimestamp(json_item['time'], timezone.utc).astimezone(
-                timezone(offset=timedelta(hours=3))).strftime('%Y%m%d %H:%M:%S')  # convert timestamp to datetime, then to local time (UTC+3)
-
-            df.loc[len(df)] = [ticker, date, json_item["open"],
-                               json_item["high"], json_item["low"],
-                               json_item["close"], json_item["volume"]]  # add row to df
+        if len(data) == 0:
+            return 0
+
+        columns = self.parse_bars(data)
+
+        last_time = store.last_time()
+        if last_time is not None:
+            new = columns['time'] > last_time  # drop the bars that are already in the store
+            columns = {column: values[new] for column, values in columns.items()}
+
+        return store.append(columns)  # add rows to store
@@ -0,0 +1,110 @@
+import logging
+import numpy as np
+
+from services.bars import UTC_OFFSET
+from services.session import DAY_SECONDS
+
+__all__ = "GapScanner"
+
+logger = logging.getLogger(__name__)
+
+BAR_SECONDS = 300  # the store keeps 5-minute bars
+
+
+class GapScanner:
+    def __init__(self, open: int = None, close: int = None, work_days: list = None, merge: int = 12, max_bars: int = 2000) -> None:
+        """
+        Integrity scanner of the stored bars against the trading calendar.
+
+        The calendar has a bar every 5 minutes from 'open' to 'close' on every work day. The bars of the calendar
+        which are missing between the first and the last stored bar are grouped into ranges to download:
+        ranges closer than 'merge' bars are joined, so a few scattered bars do not cost a request each,
+        and long ranges are split into requests of at most 'max_bars' bars.
+
+        :param open: The hour of the session open (exchange time), by default from the configuration.
+        :param close: The hour of the session close (exchange time), by default from the configuration.
+        :param work_days: Work days (0 is Monday), by default from the configuration.
+        :param merge: Ranges closer than this number of bars are joined.
+        :param max_bars: Maximum number of bars in one range.
+        """
+        if open is None or close is None or work_days is None:
+            from configurations.alor import AlorConfiguration
+
+            config = AlorConfiguration()
+            open = config.open if open is None else open
+            close = config.close if close is None else close
+            work_days = config.work_days if work_days is None else work_days
+
+        self.__open = open
+        self.__close = close
+        self.__work_days = list(work_days)
+        self.__merge = merge
+        self.__max_bars = max_bars
+
+    def calendar(self, first: int, last: int) -> np.ndarray:
+        """
+        Return the start of every bar of the calendar from first to last (seconds since epoch, UTC).
+        """
+        first_day, last_day = (first + UTC_OFFSET) // DAY_SECONDS, (last + UTC_OFFSET) // DAY_SECONDS
+        days = np.arange(first_day, last_day + 1, dtype=np.int64)
+        days = days[np.isin((days + 3) % 7, self.__work_days)]  # 1970-01-01 was Thursday
+
+        offsets = np.arange(self.__open * 3600, self.__close * 3600, BAR_SECONDS, dtype=np.int64)
+        time = (days[:, None] * DAY_SECONDS + offsets[None, :]).ravel() - UTC_OFFSET
+        return time[(time >= first) & (time <= last)]
+
+    def scan(self, time: np.ndarray, checked: list = None) -> dict:
+        """
+        Find the missing, duplicated and unsorted bars.
+
+        :param time: Start of the stored bars in seconds since epoch (UTC).
+        :param checked: Ranges [start, end) which were already downloaded, their missing bars are not requested again
+                        (there were no trades or the exchange was closed).
+        :return: A dictionary with the numbers of 'bars', 'duplicates', 'unsorted' and 'missing' bars
+                 and the 'ranges' [start, end) to download.
+        """
+        time = np.asarray(time, dtype=np.int64)
+        report = {'bars': len(time), 'duplicates': 0, 'unsorted': 0, 'missing': 0, 'ranges': []}
+        if len(time) == 0:
+            return report
+
+        step = np.diff(time)
+        report['duplicates'] = int(np.count_nonzero(step == 0))
+        report['unsorted'] = int(np.count_nonzero(step < 0))
+
+        stored = np.unique(time)
+        missing = self.calendar(int(stored[0]), int(stored[-1]))
+        missing = missing[~np.isin(missing, stored)]
+        for start, end in checked or []:
+            missing = missing[(missing < start) | (missing >= end)]
+        report['missing'] = len(missing)
+        if len(missing) == 0:
+            return report
+
+        # join the missing bars into ranges, a new range starts after a distance of 'merge' bars
+        breaks = np.flatnonzero(np.diff(missing) > self.__merge * BAR_SECONDS) + 1
+        for run in np.split(missing, breaks):
+            for chunk in range(0, len(run), self.__max_bars):
+                part = run[chunk:chunk + self.__max_bars]
+                report['ranges'].append([int(part[0]), int(part[-1]) + BAR_SECONDS])
+
+        return report
+
+    @staticmethod
+    def compact(ranges: list, first: int) -> list:
+        """
+        Return the ranges [start, end) sorted and joined where they overlap or touch, without the ranges
+        which end before the first stored bar (the scan does not look before it).
+
+        :param ranges: Ranges [start, end) in seconds since epoch (UTC).
+        :param first: Start of the first stored bar in seconds since epoch (UTC).
+        """
+        compacted = []
+        for start, end in sorted(ranges):
+            if end <= first:
+                continue
+            if len(compacted) > 0 and start <= compacted[-1][1]:
+                compacted[-1][1] = max(compacted[-1][1], end)
+            else:
+                compacted.append([start, end])
+        return compacted
@@ -0,0 +1,269 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+import pandas as pd
+
+from typing import Callable
+from api.client import AlorClientService
+from configurations.alor import AlorConfiguration
+from services.bars import BarStore, UTC_OFFSET, TIMEZONE
+from services.manager import Manager
+from services.orders import Orders
+from services.position import Position
+from services.metrics import metrics
+from strategies.withDoubleTrend import WithDoubleTrend
+from datetime import datetime
+
+__all__ = "LiveEngine", "LiveRunner"
+
+logger = logging.getLogger(__name__)
+
+BAR_SECONDS = 300  # 5-minute bars
+
+
+class LiveEngine:
+    def __init__(self, ticker: str, client: AlorClientService = None, on_bar: Callable[[dict], None] = None,
+                 grace: float = 2.0, history: int = 1000) -> None:
+        """
+        Live loop of the DoubleST strategy driven by the bars pushed through the websocket.
+
+        The engine keeps one 'BarsGetAndSubscribe' subscription open. A bar is complete when an update of the
+        next bar arrives, or when no update arrived 'grace' seconds after the end of the bar. A complete bar
+        advances the indicator state and the strategy in memory, then it is passed to on_bar; the bar and the
+        indicator state are written to disk by a background task, so the loop does not wait for the disk.
+
+        :param ticker: The ticker symbol.
+        :param client: ALOR client, by default a new one.
+        :param on_bar: Function called with every complete bar (a row with the quotes, indicators and signals).
+        :param grace: Seconds after the end of a bar to wait for late updates before the bar is completed.
+        :param history: Number of the last rows kept in memory.
+        """
+        self.__ticker = ticker
+        self.__client = client
+        self.__on_bar = on_bar
+        self.__grace = grace
+
+        self.__manager = Manager(ticker)
+        self.__store = BarStore(self.__manager.get_directory(), ticker)
+        self.rows = collections.deque(maxlen=history)  # last complete rows, the oldest are dropped
+
+        with open(os.path.join(self.__manager.get_directory(), 'config.json'), 'r') as f:
+            config = json.load(f)
+        fast, slow = config['indicators']['super_trends'][0], config['indicators']['super_trends'][1]
+        self.__position = Position()
+        self.__orders = Orders(self.__position)
+        self.__strategy = WithDoubleTrend({
+            'var_take': config['var_take'],
+            'indicators': {
+                'fast_up': f'ST {fast["period"]} {fast["multiplier"]} UP',
+                'fast_down': f'ST {fast["period"]} {fast["multiplier"]} LOW',
+                'slow_up': f'ST {slow["period"]} {slow["multiplier"]} UP',
+                'slow_down': f'ST {slow["period"]} {slow["multiplier"]} LOW'
+            }
+        }, self.__orders, self.__position)
+
+        self.__state = None  # indicator state, it ends on the last processed bar
+        self.__last_time = None  # time of the last processed bar (seconds since epoch, UTC)
+        self.__index = 0  # index of the last processed bar
+        self.__writes = None  # queue of the background writer
+        self.__stopped = None
+        self.__loop = None
+        self.__stop_requested = False  # stop was called before the engine started
+
+    async def run(self) -> None:
+        """
+        Load the indicator state, subscribe to the bars and process them until stop is called.
+        """
+        self.__loop = asyncio.get_running_loop()
+        self.__stopped = asyncio.Event()
+        if self.__stop_requested:
+            self.__stopped.set()
+        self.__writes = asyncio.Queue()
+
+        # the state is built from the stored bars once, it can take a while on the first run
+        self.__state = await asyncio.to_thread(self.__manager.get_indicators_state)
+        quotes = await asyncio.to_thread(self.__store.read)
+        self.__index = len(quotes) - 1
+        self.__last_time = self.__store.last_time()
+        self.rows.extend(quotes.tail(self.rows.maxlen).to_dict('records'))
+        if len(self.rows) > 0:
+            # the strategy compares a new bar with the previous one, so the last stored bar needs its indicators
+            indicators = Manager.get_indicators_values(self.__state)
+            self.rows[-1]['EMA 50'] = indicators.pop('EMA_50')
+            self.rows[-1].update(indicators)
+
+        client = AlorClientService() if self.__client is None else self.__client
+        writer = asyncio.create_task(self.__write())
+
+        try:
+            if self.__last_time is None:
+                raise ValueError(f"No quotes of {self.__ticker}, download them first")
+
+            start = datetime.fromtimestamp(self.__last_time + BAR_SECONDS, TIMEZONE)  # the first bar which is not stored
+            subscription = await client.bars_subscribe(self.__ticker, start)
+            logger.info(f"Live {self.__ticker} from {start}")
+
+            try:
+                await self.__listen(subscription)
+            finally:
+                await subscription.close()
+
+        finally:
+            await self.__writes.put(None)
+            await writer
+            if self.__client is None:
+                await client.close()
+
+    def stop(self) -> None:
+        """
+        Stop the engine, it can be called from another thread.
+        """
+        self.__stop_requested = True
+        if self.__stopped is not None and not self.__loop.is_closed():
+            self.__loop.call_soon_threadsafe(self.__stopped.set)
+
+    async def __listen(self, subscription) -> None:
+        bar = None  # the bar which is not complete yet
+        messages = subscription.__aiter__()
+        stopped = asyncio.create_task(self.__stopped.wait())
+
+        try:
+            while not self.__stopped.is_set():
+                # wait for the next update, but not longer than the end of the current bar
+                timeout = None if bar is None else max(bar['time'] + BAR_SECONDS + self.__grace - time.time(), 0)
+                received = asyncio.ensure_future(messages.__anext__())
+                done, _ = await asyncio.wait({received, stopped}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not received.done():
+                    received.cancel()
+                    if bar is not None and not self.__stopped.is_set():
+                        self.__complete(bar)  # no updates after the end of the bar
+                        bar = None
+                    continue
+
+                try:
+                    update = json.loads(received.result())['data']
+                except StopAsyncIteration:
+                    break
+
+                if update['time'] <= self.__last_time:
+                    continue  # the bar is already processed
+
+                if bar is not None and update['time'] > bar['time']:
+                    self.__complete(bar)  # the next bar started
+
+                bar = update
+        finally:
+            stopped.cancel()
+
+    def __complete(self, bar: dict) -> None:
+        """
+        Advance the indicators and the strategy by the complete bar.
+        """
+        with metrics.stage('live.bar'):
+            self.__index += 1
+            date = pd.Timestamp(bar['time'] + UTC_OFFSET, unit='s')  # exchange time (naive)
+            row = {'ticker': self.__ticker, 'time': bar['time'], 'date': date, 'open': bar['open'], 'high': bar['high'],
+                   'low': bar['low'], 'close': bar['close'], 'volume': bar['volume']}
+            indicators = self.__manager.update_indicators(self.__state, row)
+            row['EMA 50'] = indicators.pop('EMA_50')
+            row.update(indicators)
+
+            # the strategy sees the previous and the current bar, the orders are checked on the current bar
+            if len(self.rows) > 0:
+                self.__strategy.run(previous=self.rows[-1], current=row)
+            self.__orders.run(row, self.__index)
+            row['POSITION'] = self.__position.get_size(self.__strategy.name)
+
+            self.rows.append(row)
+            self.__last_time = bar['time']
+            self.__writes.put_nowait(('bar', bar, Manager.dump_indicators_state(self.__state)))
+
+        metrics.count('live.bar', 'bars_computed')
+        logger.info(f"Bar {self.__ticker} {date}: {row}")
+
+        if self.__on_bar is not None:
+            self.__on_bar(row)
+
+    async def __write(self) -> None:
+        """
+        Background writer: appends the complete bars to the store and saves the indicator state.
+        """
+        while True:
+            item = await self.__writes.get()
+            items = [item]
+            while not self.__writes.empty():
+                items.append(self.__writes.get_nowait())  # write everything that is waiting at once
+
+            bars = [item[1] for item in items if item is not None]
+            states = [item[2] for item in items if item is not None]
+            if len(bars) > 0:
+                columns = {column: [bar[column] for bar in bars] for column in ('time', 'open', 'high', 'low', 'close', 'volume')}
+                try:
+                    await asyncio.to_thread(self.__store.append, columns)
+                    await asyncio.to_thread(self.__manager.write_indicators_state, states[-1])  # the state after the last bar
+                    metrics.count('live.write', 'bars_written', len(bars))
+                except Exception as e:
+                    logger.error(f"Error writing bars of {self.__ticker}: {e}")
+
+            if any(item is None for item in items):
+                return
+
+
+class LiveRunner:
+    def __init__(self, tickers: list = None, client: AlorClientService = None,
+                 on_bar: Callable[[dict], None] = None, grace: float = 2.0) -> None:
+        """
+        Live engines of many instruments in one event loop.
+
+        Every ticker gets its own LiveEngine (bars, indicator state, strategy, orders and position), all of them
+        share one client, so one websocket session and one access token. The engines only wait for their own
+        subscription, the disk is used from worker threads, so a slow or failing ticker does not hold the others.
+
+        :param tickers: The tickers, by default 'tickers' from the configuration.
+        :param client: ALOR client, by default a new one.
+        :param on_bar: Function called with every complete bar of every ticker (the row has the 'ticker' key).
+        :param grace: Seconds after the end of a bar to wait for late updates before the bar is completed.
+        """
+        self.__tickers = AlorConfiguration().tickers if tickers is None else tickers
+        self.__client = client
+        self.__on_bar = on_bar
+        self.__grace = grace
+        self.engines: dict[str, LiveEngine] = {}
+        self.__stop_requested = False
+
+    async def run(self) -> None:
+        """
+        Run the engines until stop is called, an engine which failed is logged and the others continue.
+        """
+        client = AlorClientService() if self.__client is None else self.__client
+
+        for ticker in self.__tickers:
+            try:
+                self.engines[ticker] = LiveEngine(ticker, client, self.__on_bar, self.__grace)
+            except Exception as e:
+                logger.error(f"Error starting live engine of {ticker}: {e}")
+
+        logger.info(f"Live engines: {', '.join(self.engines)}")
+        if self.__stop_requested:
+            self.stop()
+
+        try:
+            results = await asyncio.gather(*(engine.run() for engine in self.engines.values()), return_exceptions=True)
+            for ticker, result in zip(self.engines, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Live engine of {ticker} failed: {result}")
+        finally:
+            if self.__client is None:
+                await client.close()
+
+    def stop(self) -> None:
+        """
+        Stop all engines, it can be called from another thread.
+        """
+        self.__stop_requested = True
+        for engine in self.engines.values():
+            engine.stop()
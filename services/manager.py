@@ -1,10 +1,17 @@
 import logging
 import os
 import pandas as pd
-import talib
 import json
+import shutil
+import numpy as np
 
-from indicators.super_trend import super_trend
+from indicators.super_trend import SuperTrendState
+from indicators.ema import EMAState
+from services.bars import BarStore
+from services.cache import IndicatorCache
+from services.metrics import metrics
+from services.session import to_epoch
+from services.timeframes import BASE_TIMEFRAME, DIRECTORY, TimeframeStore
 
 __all__ = "Manager"
 
@@ -12,36 +19,152 @@ logger = logging.getLogger(__name__)
 
 
 class Manager:
-    def __init__(self, ticker: str):
-        self.__dir = os.path.join(os.path.dirname(os.path.dirname(__file__))+'\\tickers\\', ticker)  # file path to ticker directory
+    def __init__(self, ticker: str, directory: str = None):
+        self.__ticker = ticker
+        self.__dir = os.path.join(os.path.dirname(os.path.dirname(__file__))+'\\tickers\\', ticker) if directory is None else directory  # file path to ticker directory
         with open(os.path.join(self.__dir, 'config.json'), 'r') as f:
             config = json.load(f)
             self.__super_trends = config['indicators']['super_trends']
 
-    def get_quotes(self) -> pd.DataFrame:
-        quotes = pd.read_csv(self.__dir+'\\data.csv', header=0)
+    @metrics.timed()
+    def get_quotes(self, timeframe: str = BASE_TIMEFRAME) -> pd.DataFrame:
+        """
+        Returns the quotes of the ticker, a higher timeframe ('15m', '30m', '1h', '4h', '1d') is resampled
+        from the stored 5-minute bars and cached, its last bar can be not complete yet.
+        """
+        store = BarStore(self.__dir)
+        store.migrate(self.__dir+'\\data.csv')  # import quotes from data.csv if they are not in the store yet
+        quotes = store.read() if timeframe == BASE_TIMEFRAME else TimeframeStore(self.__dir, self.__ticker).read(timeframe)
+        metrics.count('Manager.get_quotes', 'bars_read', len(quotes))
         return quotes
 
     def get_directory(self) -> str:
         return self.__dir
 
-    def get_doubleST_path(self) -> str:
-        return os.path.join(self.__dir, 'explore.csv')
+    @staticmethod
+    def invalidate(directory: str) -> None:
+        """
+        Remove the data derived from the positions of the stored bars: the higher timeframes, 'state.json' and
+        'terminal.csv'. They are built again when they are needed. Call it when bars were inserted before the end
+        of the store (BarStore.merge), the indicator cache checks the quotes by itself.
+
+        :param directory: The ticker (or index) directory.
+        """
+        shutil.rmtree(os.path.join(directory, DIRECTORY), ignore_errors=True)
+        for name in ('state.json', 'terminal.csv'):
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+        logger.info(f"Derived data in {directory} removed")
 
+    @metrics.timed()
     def get_terminal_data(self) -> pd.DataFrame:
         """
         Returns the terminal data for the ticker.
 
-        If the terminal data does not exist, it is calculated and saved to a file.
+        If the terminal data does not exist, it is calculated from the indicator cache and saved to a file.
         """
         terminal_file = os.path.join(self.__dir, 'terminal.csv')
         if not os.path.exists(terminal_file):
             quotes = self.get_quotes()
-            quotes['EMA_50'] = talib.EMA(quotes['close'].values, timeperiod=50)
-            quotes['EMA_50'] = quotes['EMA_50'].round(2)
+            cache = IndicatorCache(os.path.join(self.__dir, 'cache'))
+            quotes['EMA_50'] = np.round(cache.get(self.__ticker, 'ema', {'period': 50}, quotes)['EMA'], 2)
+
+            for item in self.__super_trends:
+                values = cache.get(self.__ticker, 'super_trend', {'period': item['period'], 'multiplier': item['multiplier']}, quotes)
+                quotes[f'ST {item["period"]} {item["multiplier"]} UP'] = values['UP']
+                quotes[f'ST {item["period"]} {item["multiplier"]} LOW'] = values['LOW']
 
-            terminal_data = super_trend(self.__super_trends, quotes)
+            terminal_data = quotes
             terminal_data.to_csv(terminal_file, index=False)
             return terminal_data
 
         return pd.read_csv(terminal_file, header=0)
+
+    def get_indicators_state(self) -> dict:
+        """
+        Returns the streaming state of the terminal indicators (EMA 50 and SuperTrends).
+
+        The state is read from 'state.json'. If the file does not exist or its SuperTrends are not the ones
+        of 'config.json', it is built by replaying the quotes once; quotes newer than the saved state are replayed
+        as well, so the state always ends on the last stored bar.
+        """
+        state_file = os.path.join(self.__dir, 'state.json')
+        saved = None
+        if os.path.exists(state_file):
+            with open(state_file, 'r') as f:
+                saved = json.load(f)
+
+            parameters = [(item['period'], item['multiplier']) for item in saved['super_trends']]
+            if parameters != [(item['period'], item['multiplier']) for item in self.__super_trends]:
+                logger.info(f"SuperTrends of {self.__ticker} changed from {parameters}, the indicators state is built again")
+                saved = None
+
+        if saved is not None:
+            state = {
+                'time': saved['time'] if 'time' in saved else int(to_epoch([saved['date']])[0]),  # old files keep the date
+                'EMA_50': EMAState.from_dict(saved['EMA_50']),
+                'super_trends': [SuperTrendState.from_dict(item) for item in saved['super_trends']]
+            }
+        else:
+            state = {
+                'time': None,
+                'EMA_50': EMAState(50),
+                'super_trends': [SuperTrendState(item['period'], item['multiplier']) for item in self.__super_trends]
+            }
+
+        quotes = self.get_quotes()
+        if state['time'] is not None:
+            quotes = quotes[quotes['time'] > state['time']]
+
+        for bar in quotes[['time', 'open', 'high', 'low', 'close']].to_dict('records'):
+            self.update_indicators(state, bar)
+
+        return state
+
+    def save_indicators_state(self, state: dict) -> None:
+        self.write_indicators_state(self.dump_indicators_state(state))
+
+    @staticmethod
+    def dump_indicators_state(state: dict) -> dict:
+        """
+        Return a copy of the indicators state as plain data, it can be written by another thread.
+        """
+        return {
+            'time': state['time'],
+            'EMA_50': state['EMA_50'].to_dict(),
+            'super_trends': [item.to_dict() for item in state['super_trends']]
+        }
+
+    def write_indicators_state(self, saved: dict) -> None:
+        # write to a temporary file first, so an interrupted write does not break 'state.json'
+        state_file = os.path.join(self.__dir, 'state.json')
+        with open(state_file + '.tmp', 'w') as f:
+            json.dump(saved, f)
+        os.replace(state_file + '.tmp', state_file)
+
+    def update_indicators(self, state: dict, bar: dict) -> dict:
+        """
+        Advance the indicators state by one bar in constant time.
+
+        :param state: The state returned by get_indicators_state.
+        :param bar: A dictionary with 'time' (seconds since epoch, UTC), 'open', 'high', 'low' and 'close' keys.
+        :return: A dictionary with the new 'EMA_50' and 'ST {period} {multiplier} UP/LOW' values.
+        """
+        state['EMA_50'].update(bar['close'])
+        for item in state['super_trends']:
+            item.update(bar['open'], bar['high'], bar['low'], bar['close'])
+
+        state['time'] = int(bar['time'])
+        return self.get_indicators_values(state)
+
+    @staticmethod
+    def get_indicators_values(state: dict) -> dict:
+        """
+        Return the values of the indicators on the last bar of the state, in the format of update_indicators.
+        """
+        values = {'EMA_50': float(np.round(state['EMA_50'].value, 2))}
+        for item in state['super_trends']:
+            values[item.name + ' UP'], values[item.name + ' LOW'] = item.up, item.low
+
+        return values
@@ -0,0 +1,254 @@
+import atexit
+import cProfile
+import functools
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+from contextlib import contextmanager, nullcontext
+
+__all__ = "Metrics"
+
+logger = logging.getLogger(__name__)
+
+# environment variables of the instrumentation
+ENV_ENABLED = 'TRADEBOT_METRICS'  # '1' enables the timers and counters
+ENV_PROFILE = 'TRADEBOT_PROFILE'  # 'cprofile' and/or 'tracemalloc', separated by commas
+ENV_OUTPUT = 'TRADEBOT_METRICS_FILE'  # file written at exit, '.prom' is a Prometheus textfile, anything else is JSON
+
+DISABLED = nullcontext()  # the stage of a disabled registry, it costs one attribute check
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False, profile: list[str] = None, output: str = None) -> None:
+        """
+        Registry of stage timings and counters.
+
+        A stage is measured with the 'stage' context manager or the 'timed' decorator, counters of a stage
+        ('bars_read', 'bars_computed', 'bytes_written', ...) are added with 'count'. When the registry is disabled,
+        a stage is a shared empty context and a counter returns at once. The registry collects the stages of its own
+        process, the process pools bring the stages of their workers back with collect and merge.
+
+        With 'tracemalloc' profiling the peak of the traced memory is recorded for every stage (nested stages
+        are included in the peak of the outer stage; concurrent stages of asyncio tasks share one peak).
+        With 'cprofile' profiling the whole process is profiled and the statistics are written next to the output.
+
+        :param enabled: Collect timings and counters.
+        :param profile: Profilers to run: 'cprofile', 'tracemalloc'.
+        :param output: File to which the metrics are written at exit.
+        """
+        self.enabled = enabled
+        self.__profile = profile or []
+        self.__output = output
+        self.__stages = {}  # name -> {'calls', 'seconds', 'max_seconds', 'peak_memory'}
+        self.__counters = {}  # name -> {counter: value}
+        self.__peaks = []  # peaks of the open stages, innermost last
+        self.__profiler = None
+
+        if enabled:
+            self.__start()
+
+    @classmethod
+    def from_env(cls) -> 'Metrics':
+        """
+        Create the registry from the environment variables TRADEBOT_METRICS, TRADEBOT_PROFILE and TRADEBOT_METRICS_FILE.
+        """
+        profile = [item.strip() for item in os.environ.get(ENV_PROFILE, '').split(',') if item.strip()]
+        enabled = os.environ.get(ENV_ENABLED, '0').lower() in ('1', 'true', 'yes') or len(profile) > 0
+        return cls(enabled, profile, os.environ.get(ENV_OUTPUT))
+
+    def __start(self) -> None:
+        if 'tracemalloc' in self.__profile and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if 'cprofile' in self.__profile:
+            self.__profiler = cProfile.Profile()
+            self.__profiler.enable()
+
+        atexit.register(self.close)
+
+    def stage(self, name: str):
+        """
+        Return a context manager which measures a stage:
+
+            with metrics.stage('download'):
+                ...
+        """
+        if not self.enabled:
+            return DISABLED
+        return self.__stage(name)
+
+    @contextmanager
+    def __stage(self, name: str):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            self.__peaks.append(0)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stage = self.__stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'peak_memory': 0})
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+            stage['max_seconds'] = max(stage['max_seconds'], seconds)
+
+            if tracing and len(self.__peaks) > 0:
+                peak = max(tracemalloc.get_traced_memory()[1], self.__peaks.pop())
+                stage['peak_memory'] = max(stage['peak_memory'], peak)
+                if len(self.__peaks) > 0:
+                    self.__peaks[-1] = max(self.__peaks[-1], peak)  # the peak of a nested stage belongs to the outer one too
+
+    def timed(self, name: str = None):
+        """
+        Decorator which measures every call of the function as a stage (by default the qualified name of the function).
+        """
+        def decorator(function):
+            stage = function.__qualname__ if name is None else name
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self.__stage(stage):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name: str, counter: str, value: int = 1) -> None:
+        """
+        Add the value to the counter of the stage, for example count('download', 'bars_written', 288).
+        """
+        if not self.enabled:
+            return
+        counters = self.__counters.setdefault(name, {})
+        counters[counter] = counters.get(counter, 0) + value
+
+    def to_dict(self) -> dict:
+        return {'stages': self.__stages, 'counters': self.__counters}
+
+    def reset(self) -> None:
+        """
+        Drop the collected timings and counters (a forked worker starts with a copy of the parent's ones).
+        """
+        self.__stages = {}
+        self.__counters = {}
+
+    def snapshot(self) -> dict | None:
+        """
+        Return the timings and counters collected since the last snapshot and start collecting again.
+        """
+        if not self.enabled:
+            return None
+        snapshot = self.to_dict()
+        self.reset()
+        return snapshot
+
+    def merge(self, snapshot: dict | None) -> None:
+        """
+        Add the snapshot of another process (see collect) to the registry.
+        """
+        if not self.enabled or snapshot is None:
+            return
+
+        for name, other in snapshot['stages'].items():
+            stage = self.__stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'peak_memory': 0})
+            stage['calls'] += other['calls']
+            stage['seconds'] += other['seconds']
+            stage['max_seconds'] = max(stage['max_seconds'], other['max_seconds'])
+            stage['peak_memory'] = max(stage['peak_memory'], other['peak_memory'])
+
+        for name, other in snapshot['counters'].items():
+            counters = self.__counters.setdefault(name, {})
+            for counter, value in other.items():
+                counters[counter] = counters.get(counter, 0) + value
+
+    def summary(self) -> str:
+        """
+        Return a table with the stages and their counters.
+        """
+        lines = [f"{'stage':<32} {'calls':>7} {'total, s':>10} {'mean, s':>10} {'max, s':>10} {'peak, MiB':>10}  counters"]
+        for name in sorted(set(self.__stages) | set(self.__counters), key=lambda item: -self.__stages.get(item, {}).get('seconds', 0)):
+            stage = self.__stages.get(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'peak_memory': 0})
+            mean = stage['seconds'] / stage['calls'] if stage['calls'] > 0 else 0.0
+            counters = ', '.join(f'{counter}={value}' for counter, value in self.__counters.get(name, {}).items())
+            lines.append(f"{name:<32} {stage['calls']:>7} {stage['seconds']:>10.4f} {mean:>10.4f} {stage['max_seconds']:>10.4f}"
+                         f" {stage['peak_memory'] / 2 ** 20:>10.1f}  {counters}")
+        return '\n'.join(lines)
+
+    def to_prometheus(self) -> str:
+        """
+        Return the metrics in the Prometheus text format (for the textfile collector of node_exporter).
+        """
+        lines = []
+        series = [
+            ('tradebot_stage_calls_total', 'counter', 'calls'),
+            ('tradebot_stage_seconds_total', 'counter', 'seconds'),
+            ('tradebot_stage_max_seconds', 'gauge', 'max_seconds'),
+            ('tradebot_stage_peak_memory_bytes', 'gauge', 'peak_memory'),
+        ]
+        for metric, kind, key in series:
+            lines.append(f'# TYPE {metric} {kind}')
+            lines += [f'{metric}{{stage="{name}"}} {stage[key]}' for name, stage in self.__stages.items()]
+
+        lines.append('# TYPE tradebot_stage_counter_total counter')
+        for name, counters in self.__counters.items():
+            lines += [f'tradebot_stage_counter_total{{stage="{name}",counter="{counter}"}} {value}'
+                      for counter, value in counters.items()]
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str) -> None:
+        """
+        Write the metrics to a file, '.prom' files are written in the Prometheus text format, other files in JSON.
+        """
+        with open(path, 'w') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+
+    def close(self) -> None:
+        """
+        Stop the profilers, write the summary to the log and the metrics to the output file.
+        """
+        if not self.enabled:
+            return
+
+        if self.__profiler is not None:
+            self.__profiler.disable()
+            path = os.path.splitext(self.__output or 'metrics')[0] + '.prof'
+            self.__profiler.dump_stats(path)
+            logger.info(f"Profile written to {path}")
+            self.__profiler = None
+
+        if len(self.__stages) > 0 or len(self.__counters) > 0:
+            summary = self.summary()
+            logger.info('Metrics:\n' + summary)
+            print(summary)
+
+            if self.__output is not None:
+                self.dump(self.__output)
+
+        self.enabled = False
+
+
+metrics = Metrics.from_env()  # the registry of the process
+
+
+def collect(function, *args):
+    """
+    Run a task in a worker process and return its result with the metrics collected by the task.
+
+    The registry belongs to one process and the workers of a process pool exit without the atexit hooks,
+    so the pools submit their tasks through collect and merge the snapshots into the registry of the parent:
+
+        result, snapshot = executor.submit(collect, task, *args).result()
+        metrics.merge(snapshot)
+    """
+    return function(*args), metrics.snapshot()
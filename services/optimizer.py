@@ -0,0 +1,282 @@
+import logging
+import os
+import json
+import hashlib
+import random
+import itertools
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+from services.session import epoch
+from services.metrics import metrics, collect
+
+__all__ = "Optimizer"
+
+logger = logging.getLogger(__name__)
+
+QUOTES_COLUMNS = {'time': np.int64, 'date': np.int64, 'open': np.float64, 'high': np.float64, 'low': np.float64, 'close': np.float64}
+
+# state of a worker process, it is set once by _attach
+_worker = {}
+
+
+def parameter_values(values) -> list:
+    """
+    Return the values of a parameter.
+
+    :param values: A list of values, a single value or a range {'start': ..., 'step': ..., 'end': ...} (the end is included).
+    """
+    if isinstance(values, dict):
+        count = int(round((values['end'] - values['start']) / values['step'])) + 1
+        if isinstance(values['start'], int) and isinstance(values['step'], int):
+            return [values['start'] + i * values['step'] for i in range(count)]
+        return [round(values['start'] + i * values['step'], 10) for i in range(count)]
+    if isinstance(values, (list, tuple)):
+        return list(values)
+    return [values]
+
+
+def share_quotes(quotes: pd.DataFrame) -> tuple[list, list]:
+    """
+    Copy the quote columns into shared memory blocks.
+
+    :return: The memory blocks and their specifications (column, name, dtype, length) for the workers.
+    """
+    memory = []
+    specs = []
+    date = pd.to_datetime(quotes['date'], format='mixed') if not pd.api.types.is_datetime64_any_dtype(quotes['date']) else quotes['date']
+    columns = {
+        'time': epoch(quotes),
+        'date': date.to_numpy(dtype='datetime64[ns]').view(np.int64),
+        'open': quotes['open'].to_numpy(dtype=np.float64),
+        'high': quotes['high'].to_numpy(dtype=np.float64),
+        'low': quotes['low'].to_numpy(dtype=np.float64),
+        'close': quotes['close'].to_numpy(dtype=np.float64),
+    }
+
+    for column, dtype in QUOTES_COLUMNS.items():
+        values = columns[column]
+        block = SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype=dtype, buffer=block.buf)[:] = values
+        memory.append(block)
+        specs.append((column, block.name, dtype, len(values)))
+
+    return memory, specs
+
+
+def fingerprint(quotes: pd.DataFrame) -> str:
+    """
+    Return a hash of the time and the prices of the quotes, the results of other quotes are not resumed.
+    """
+    hash = hashlib.blake2b(digest_size=16)
+    hash.update(np.ascontiguousarray(epoch(quotes), dtype=np.int64).tobytes())
+    for column in ('open', 'high', 'low', 'close'):
+        hash.update(np.ascontiguousarray(quotes[column].to_numpy(dtype=np.float64)).tobytes())
+    return hash.hexdigest()
+
+
+def _attach(directory: str, ticker: str, specs: list) -> None:
+    """
+    Initializer of a worker: attach the quotes in shared memory and load the strategy.
+    """
+    from terminals.main import DoubleST
+
+    memory = []
+    columns = {}
+    for column, name, dtype, length in specs:
+        block = SharedMemory(name=name)
+        memory.append(block)
+        columns[column] = np.ndarray((length,), dtype=dtype, buffer=block.buf)
+
+    quotes = pd.DataFrame({
+        'ticker': ticker,
+        'time': columns['time'],
+        'date': columns['date'].view('datetime64[ns]'),
+        'open': columns['open'],
+        'high': columns['high'],
+        'low': columns['low'],
+        'close': columns['close'],
+    }, copy=False)
+
+    _worker.update({'memory': memory, 'quotes': quotes, 'double_st': DoubleST(directory)})
+    metrics.reset()  # a forked worker has a copy of the metrics of the parent, the tasks send back only their own
+
+
+def indicator_names(super_trends: list) -> dict:
+    """
+    Return the SuperTrend columns of the strategy (fast first, slow second) for DoubleST.calculate.
+    """
+    fast, slow = super_trends[0], super_trends[1]
+    return {
+        'fast_up': f'ST {fast["period"]} {fast["multiplier"]} UP',
+        'fast_down': f'ST {fast["period"]} {fast["multiplier"]} LOW',
+        'slow_up': f'ST {slow["period"]} {slow["multiplier"]} UP',
+        'slow_down': f'ST {slow["period"]} {slow["multiplier"]} LOW'
+    }
+
+
+@metrics.timed()
+def _evaluate(super_trends: list, var_takes: list) -> list[dict]:
+    """
+    Evaluate all var_take values with one set of SuperTrend parameters.
+
+    The SuperTrends come from the indicator cache, so parameters shared by several tasks are calculated only once.
+    """
+    double_st = _worker['double_st']
+    data = double_st.run(_worker['quotes'], super_trends)
+
+    indicators = indicator_names(super_trends)
+
+    rows = []
+    for var_take in var_takes:
+        row = {'key': Optimizer.key(var_take, super_trends)}
+        for i, params in enumerate(super_trends, start=1):
+            row[f'period {i}'] = params['period']
+            row[f'multiplier {i}'] = params['multiplier']
+
+        try:
+            result = double_st.calculate(data, var_take, indicators=indicators)
+            row.update(double_st.report(result, 'optimization', var_take).iloc[0].to_dict())
+        except Exception as e:
+            logger.error(f'Error evaluating {row["key"]}: {e}')
+            row['var_take'] = var_take
+
+        rows.append(row)
+
+    return rows
+
+
+class Optimizer:
+    def __init__(self, directory: str, space: dict, method: str = 'grid', samples: int = None, workers: int = None,
+                 seed: int = None, file_name: str = 'optimization.csv') -> None:
+        """
+        Initialize a parameter optimizer of the DoubleST strategy.
+
+        The search space contains var_take and the period and multiplier of every SuperTrend (fast first, slow second):
+
+            {'var_take': {'start': 1.0, 'step': 0.1, 'end': 3.0},
+             'super_trends': [{'period': [10], 'multiplier': {'start': 2, 'step': 1, 'end': 4}},
+                              {'period': [20], 'multiplier': [5]}]}
+
+        :param directory: The ticker directory with 'config.json', the results are written there.
+        :param space: The search space, every parameter is a range, a list or a single value.
+        :param method: 'grid' evaluates every combination, 'random' evaluates 'samples' random combinations.
+        :param samples: Number of combinations of the random search.
+        :param workers: Number of worker processes, by default the number of CPUs.
+        :param seed: Seed of the random search.
+        :param file_name: The file to which the results are streamed, existing results of the same quotes
+                          are not evaluated again.
+        """
+        self.__directory = directory
+        self.__space = space
+        self.__method = method
+        self.__samples = samples
+        self.__workers = workers
+        self.__seed = seed
+        self.__path = os.path.join(directory, file_name)
+
+    @staticmethod
+    def key(var_take: float, super_trends: list) -> str:
+        return json.dumps({'var_take': var_take, 'super_trends': super_trends}, sort_keys=True)
+
+    def candidates(self) -> list[tuple[float, list]]:
+        """
+        Return the combinations of parameters (var_take, super_trends) to evaluate.
+        """
+        dimensions = [parameter_values(self.__space['var_take'])]
+        for params in self.__space['super_trends']:
+            dimensions.append(parameter_values(params['period']))
+            dimensions.append(parameter_values(params['multiplier']))
+
+        if self.__method == 'grid':
+            combinations = itertools.product(*dimensions)
+        elif self.__method == 'random':
+            total = int(np.prod([len(values) for values in dimensions]))
+            indexes = random.Random(self.__seed).sample(range(total), min(self.__samples, total))
+            combinations = (self.__combination(dimensions, index) for index in indexes)
+        else:
+            raise ValueError(f"Unknown optimization method: {self.__method}")
+
+        return [(combination[0], [{'period': int(combination[i]), 'multiplier': combination[i + 1]}
+                                  for i in range(1, len(combination), 2)])
+                for combination in combinations]
+
+    @staticmethod
+    def __combination(dimensions: list, index: int) -> tuple:
+        # decode the index of a combination in the grid (mixed radix)
+        combination = []
+        for values in reversed(dimensions):
+            index, position = divmod(index, len(values))
+            combination.append(values[position])
+        return tuple(reversed(combination))
+
+    def run(self, quotes: pd.DataFrame) -> pd.DataFrame:
+        """
+        Evaluate the candidates in a process pool and return the results sorted by the account at the end.
+
+        The quotes are put into shared memory once, every task evaluates all var_take values of one set of
+        SuperTrend parameters. Results are appended to the results file as soon as a task is finished,
+        so an interrupted optimization continues where it stopped. Every result keeps the fingerprint
+        of its quotes, after new bars or with another range the candidates are evaluated again.
+        """
+        candidates = self.candidates()
+        keys = {self.key(var_take, super_trends) for var_take, super_trends in candidates}
+        data = fingerprint(quotes)
+        results = self.__read()
+        done = set(results.loc[results['quotes'] == data, 'key'])
+
+        # group the remaining var_take values by SuperTrend parameters
+        tasks = {}
+        for var_take, super_trends in candidates:
+            if self.key(var_take, super_trends) not in done:
+                tasks.setdefault(json.dumps(super_trends), []).append(var_take)
+
+        logger.info(f"Optimization: {len(candidates)} candidates, {len(candidates) - sum(map(len, tasks.values()))} already done")
+        print(f"Optimization: {len(candidates)} candidates, {len(tasks)} tasks")
+
+        if len(tasks) > 0:
+            memory, specs = share_quotes(quotes)
+            try:
+                with ProcessPoolExecutor(max_workers=self.__workers, initializer=_attach,
+                                         initargs=(self.__directory, quotes['ticker'].iloc[0], specs)) as executor:
+                    futures = [executor.submit(collect, _evaluate, json.loads(super_trends), var_takes)
+                               for super_trends, var_takes in tasks.items()]
+
+                    for completed, future in enumerate(as_completed(futures), start=1):
+                        rows, snapshot = future.result()
+                        metrics.merge(snapshot)
+                        rows = pd.DataFrame(rows)
+                        rows.insert(1, 'quotes', data)
+                        self.__append(rows)
+                        print(f"Optimization: {completed}/{len(futures)} tasks completed")
+            finally:
+                for block in memory:
+                    block.close()
+                    block.unlink()
+
+        results = pd.read_csv(self.__path)
+        results = results[results['key'].isin(keys) & (results['quotes'] == data)].drop_duplicates('key', keep='last')
+
+        return results.drop(columns='quotes').sort_values('account_end', ascending=False, ignore_index=True)
+
+    def __read(self) -> pd.DataFrame:
+        """
+        Return the keys and the quote fingerprints of the results in the file, results written without
+        a fingerprint do not match any quotes.
+        """
+        if not os.path.exists(self.__path):
+            return pd.DataFrame({'key': [], 'quotes': []})
+        return pd.read_csv(self.__path, usecols=lambda column: column in ('key', 'quotes')).reindex(columns=['key', 'quotes'])
+
+    def __append(self, rows: pd.DataFrame) -> None:
+        """
+        Append rows to the results file, the file is written again if the columns of the report have changed.
+        """
+        if not os.path.exists(self.__path):
+            rows.to_csv(self.__path, index=False)
+        elif list(pd.read_csv(self.__path, nrows=0).columns) == list(rows.columns):
+            rows.to_csv(self.__path, mode='a', header=False, index=False)
+        else:
+            pd.concat([pd.read_csv(self.__path), rows], ignore_index=True).to_csv(self.__path, index=False)
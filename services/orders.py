@@ -1,22 +1,128 @@
+import math
+import numpy as np
 import pandas as pd
 
 from services.position import Position
+from services.session import MARKET_STOP, seconds, time_of_day
 from datetime import datetime
 
 
+class OrderBook():
+    def __init__(self):
+        """
+        Pending orders indexed by id and by strategy.
+
+        Orders are kept in a dictionary in creation order, so adding, filling and cancelling an order is O(1)
+        and cancelling all orders of a strategy is proportional to the number of its orders.
+        """
+        self.__orders = {}  # key -> order
+        self.__by_id = {}  # order id -> {key: None}
+        self.__by_strategy = {}  # strategy -> {key: None}
+        self.__next_key = 0
+
+    def __len__(self) -> int:
+        return len(self.__orders)
+
+    def add(self, order: dict) -> None:
+        key = self.__next_key
+        self.__next_key += 1
+
+        self.__orders[key] = order
+        self.__by_id.setdefault(order['id'], {})[key] = None
+        self.__by_strategy.setdefault(order['strategy'], {})[key] = None
+
+    def remove(self, order_id) -> None:
+        """
+        Remove the orders with the given id.
+        """
+        for key in self.__by_id.pop(order_id, {}):
+            order = self.__orders.pop(key)
+            self.__by_strategy[order['strategy']].pop(key, None)
+
+    def cancel(self, strategy: str) -> None:
+        """
+        Remove all orders of the strategy.
+        """
+        for key in self.__by_strategy.pop(strategy, {}):
+            order = self.__orders.pop(key)
+            keys = self.__by_id[order['id']]
+            keys.pop(key, None)
+            if len(keys) == 0:
+                del self.__by_id[order['id']]
+
+    def clear(self) -> None:
+        self.__orders.clear()
+        self.__by_id.clear()
+        self.__by_strategy.clear()
+
+    def snapshot(self) -> list[dict]:
+        """
+        Return the pending orders in creation order.
+        """
+        return list(self.__orders.values())
+
+
+class FillLog():
+    COLUMNS = {'SIGNAL': object, 'BUY_PRICE': np.float64, 'SELL_PRICE': np.float64, 'TAKE_PROFIT': np.float64}
+
+    def __init__(self, capacity: int = 1024):
+        """
+        Log of fills in preallocated typed columns, it becomes a DataFrame only once in to_frame.
+
+        A row is created for every index with a record, the columns appear in the order of their first record.
+
+        :param capacity: Initial number of rows, the columns grow twice when they are full.
+        """
+        self.__length = 0
+        self.__index = np.empty(capacity, dtype=np.int64)
+        self.__columns = {column: np.full(capacity, math.nan, dtype=dtype) for column, dtype in self.COLUMNS.items()}
+        self.__rows = {}  # index -> row
+        self.__order = []  # columns in the order of the first record
+
+    def record(self, index: int, column: str, value) -> None:
+        row = self.__rows.get(index)
+        if row is None:
+            if self.__length == len(self.__index):
+                self.__grow()
+
+            row = self.__length
+            self.__rows[index] = row
+            self.__index[row] = index
+            self.__length += 1
+
+        if column not in self.__order:
+            self.__order.append(column)
+
+        self.__columns[column][row] = value
+
+    def __grow(self) -> None:
+        capacity = 2 * len(self.__index)
+        self.__index = np.resize(self.__index, capacity)
+        for column, values in self.__columns.items():
+            grown = np.full(capacity, math.nan, dtype=values.dtype)
+            grown[:len(values)] = values
+            self.__columns[column] = grown
+
+    def to_frame(self) -> pd.DataFrame:
+        length = self.__length
+        return pd.DataFrame({column: self.__columns[column][:length] for column in self.__order},
+                            index=self.__index[:length])
+
+
 class Orders():
     def __init__(self, position: Position):
-        self.__orders = []
-        self.__order_list = pd.DataFrame()
+        self.__orders = OrderBook()
+        self.__order_list = FillLog()
         self.__position = position
+        self.__market_stop = seconds(MARKET_STOP)  # time of day of the market stop in seconds
 
     def create(self, order: dict):
-        self.__orders.append(order)
+        self.__orders.add(order)
 
     def run(self, row: pd.DataFrame, index: int):
-        # orders
+        # orders, the orders created during the pass are checked from the next bar
         if len(self.__orders) > 0:
-            for order in self.__orders:
+            for order in self.__orders.snapshot():
                 if order['order'] == 'BUY_LIMIT':
                     self.__buy_limit(order, row, index)
 
@@ -26,18 +132,18 @@ class Orders():
                 elif order['order'] == 'TAKE_PROFIT':
                     self.__take_profit(order, row, index)
 
-        if self.__position.get_size() > 0 and pd.to_datetime(row['date']).time() == pd.Timestamp('23:45:00').time():
+        if self.__position.get_size() > 0 and time_of_day(row['time']) == self.__market_stop:
             self.__position.decrease('WithDoubleTrend', 10)
-            self.__order_list.loc[index, 'SIGNAL'] = 'MARKET_STOP'
-            self.__order_list.loc[index, 'SELL_PRICE'] = row['open']
+            self.__order_list.record(index, 'SIGNAL', 'MARKET_STOP')
+            self.__order_list.record(index, 'SELL_PRICE', row['open'])
             self.__orders.clear()
 
     def __buy_limit(self, order: dict, row: pd.DataFrame, index: int):
         if order['price'] <= row['high'] and order['price'] >= row['low']:
             self.__position.increase(order['strategy'], 10)
-            self.__order_list.loc[index, 'SIGNAL'] = order['signal']
-            self.__order_list.loc[index, 'BUY_PRICE'] = order['price']
-            self.__orders = list(filter(lambda item: item['id'] != order['id'], self.__orders))
+            self.__order_list.record(index, 'SIGNAL', order['signal'])
+            self.__order_list.record(index, 'BUY_PRICE', order['price'])
+            self.__orders.remove(order['id'])
 
             if 'take_profit' in order:
                 self.create({'id': datetime.now().timestamp(), 'strategy': order['strategy'],
@@ -46,21 +152,21 @@ class Orders():
     def __sell_limit(self, order: dict, row: pd.DataFrame, index: int):
         if order['price'] <= row['high'] and order['price'] >= row['low']:
             self.__position.decrease(order['strategy'], 10)
-            self.__order_list.loc[index, 'SIGNAL'] = order['signal']
-            self.__order_list.loc[index, 'SELL_PRICE'] = order['price']
-            self.__orders = list(filter(lambda item: item['id'] != order['id'], self.__orders))
+            self.__order_list.record(index, 'SIGNAL', order['signal'])
+            self.__order_list.record(index, 'SELL_PRICE', order['price'])
+            self.__orders.remove(order['id'])
 
             if self.__position.get_size(order['strategy']) == 0:
-                self.__orders = list(filter(lambda item: item['strategy'] != order['strategy'], self.__orders))
+                self.__orders.cancel(order['strategy'])
 
     def __take_profit(self, order: dict, row: pd.DataFrame, index: int):
         if order['price'] <= row['high'] and order['price'] >= row['low']:
             self.__position.decrease(order['strategy'], 10)
-            self.__order_list.loc[index, 'SIGNAL'] = order['signal']
-            self.__order_list.loc[index, 'SELL_PRICE'] = order['price']
-            self.__orders = list(filter(lambda item: item['id'] != order['id'], self.__orders))
+            self.__order_list.record(index, 'SIGNAL', order['signal'])
+            self.__order_list.record(index, 'SELL_PRICE', order['price'])
+            self.__orders.remove(order['id'])
         else:
-            self.__order_list.loc[index, 'TAKE_PROFIT'] = order['price']
+            self.__order_list.record(index, 'TAKE_PROFIT', order['price'])
 
     def get_order_list(self) -> pd.DataFrame:
-        return self.__order_list
+        return self.__order_list.to_frame()
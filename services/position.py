@@ -1,18 +1,20 @@
-import pandas as pd
-
-
 class Position():
+    __slots__ = ('__position', '__size')
+
     def __init__(self):
-        self.__position = {}
+        self.__position = {}  # strategy -> quantity
+        self.__size = 0  # total quantity of all strategies
 
     def get_size(self, strategy: str = None) -> int:
         if strategy is None:
-            return sum(self.__position.values())
+            return self.__size
         else:
             return self.__position.get(strategy, 0)
 
     def increase(self, strategy: str, quantity: int):
         self.__position[strategy] = self.__position.get(strategy, 0) + quantity
+        self.__size += quantity
 
     def decrease(self, strategy: str, quantity: int):
         self.__position[strategy] = self.__position.get(strategy, 0) - quantity
+        self.__size -= quantity
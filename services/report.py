@@ -0,0 +1,147 @@
+import logging
+import math
+import numpy as np
+import pandas as pd
+
+from services.session import Session
+
+__all__ = "TradeReport"
+
+logger = logging.getLogger(__name__)
+
+
+class TradeReport:
+    def __init__(self, init: float = 3000, commission: float = 0.00005, quantity: int = 10, periods: int = 252) -> None:
+        """
+        Array-based report of the fills of a backtest.
+
+        The deals, the account and the equity curve are calculated with array operations, so the report costs
+        a few passes over the columns instead of a Python loop over the deals.
+
+        :param init: Initial capital.
+        :param commission: Commission as a share of the deal amount.
+        :param quantity: Quantity of every deal.
+        :param periods: Number of trading days in a year, it is used to annualize Sharpe and Sortino ratios.
+        """
+        self.__init = init
+        self.__commission = commission
+        self.__quantity = quantity
+        self.__periods = periods
+
+    def deals(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Return the list of deals with the 'COMMISSION', 'P/L' and 'ACCOUNT' columns.
+
+        A row with a buy price is a buy (even if it has a sell price too), a row with only a sell price is a sell.
+        The P/L of a sell is calculated against the last buy after the previous sell.
+
+        :param data: The result of the backtest with the 'SIGNAL', 'BUY_PRICE' and 'SELL_PRICE' columns.
+        """
+        # a backtest without fills may have no order columns at all
+        missing = [column for column in ('SIGNAL', 'BUY_PRICE', 'SELL_PRICE') if column not in data.columns]
+        if len(missing) > 0:
+            data = data.assign(**{column: math.nan for column in missing})
+        deals = data.loc[data['SIGNAL'].notnull(), ['ticker', 'date', 'SIGNAL', 'BUY_PRICE', 'SELL_PRICE']].copy()
+        quantity = self.__quantity
+
+        buy_price = deals['BUY_PRICE'].to_numpy(dtype=float)
+        sell_price = deals['SELL_PRICE'].to_numpy(dtype=float)
+        is_buy = ~np.isnan(buy_price)
+        is_sell = ~is_buy & ~np.isnan(sell_price)
+
+        price = np.where(is_buy, buy_price, sell_price)
+        commission = np.where(is_buy | is_sell, np.round(quantity * price * self.__commission, 2), math.nan)
+
+        # the account changes by the rounded amount of every deal, the sum is accumulated in the order of the deals
+        change = np.where(is_buy, -np.round(quantity * buy_price + commission, 2),
+                          np.where(is_sell, np.round(quantity * sell_price - commission, 2), 0.0))
+        account = np.cumsum(np.concatenate([[self.__init], change]))[1:]
+
+        last_buy, opened = self.__last_buy(is_buy, is_sell)
+        last_buy_price = np.where(opened, buy_price[last_buy], 0.0)
+
+        deals['COMMISSION'] = commission
+        deals['P/L'] = np.where(is_sell, (sell_price - last_buy_price) * quantity, math.nan)
+        deals['ACCOUNT'] = np.where(is_buy | is_sell, account, math.nan)
+
+        return deals
+
+    @staticmethod
+    def __last_buy(is_buy: np.ndarray, is_sell: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the position of the last buy for every deal and whether it was after the previous sell.
+        """
+        position = np.arange(len(is_buy))
+        last_buy = np.maximum.accumulate(np.where(is_buy, position, -1))
+        last_sell = np.maximum.accumulate(np.where(is_sell, position, -1))
+        previous_sell = np.concatenate([[-1], last_sell])[:-1]
+        return np.maximum(last_buy, 0), last_buy > previous_sell
+
+    def metrics(self, data: pd.DataFrame, deals: pd.DataFrame) -> dict:
+        """
+        Return the performance metrics of the backtest.
+
+        The equity curve is the account plus the value of the position at the close of every bar.
+
+        :param data: The result of the backtest.
+        :param deals: The deals of the backtest (see deals).
+        :return: A dictionary with 'trades', 'loss', 'profit', 'account_end', 'max_drawdown' (%), 'sharpe', 'sortino',
+                 'exposure' (% of bars with an open position) and 'avg_holding' (pd.Timedelta).
+        """
+        length = len(data)
+        quantity = self.__quantity
+        rows = np.flatnonzero(data['SIGNAL'].notnull().to_numpy()) if 'SIGNAL' in data.columns else np.empty(0, dtype=np.int64)
+
+        is_buy = deals['BUY_PRICE'].notnull().to_numpy()
+        is_sell = ~is_buy & deals['SELL_PRICE'].notnull().to_numpy()
+        profit_loss = deals['P/L'].to_numpy(dtype=float)
+        account = deals['ACCOUNT'].to_numpy(dtype=float)
+
+        # account and position at every bar
+        filled = is_buy | is_sell
+        cash = np.full(length, math.nan)
+        cash[rows[filled]] = account[filled]
+        last_fill = np.maximum.accumulate(np.where(~np.isnan(cash), np.arange(length), 0))
+        cash = np.where(np.isnan(cash[last_fill]), self.__init, cash[last_fill])
+
+        change = np.zeros(length)
+        change[rows[is_buy]] += quantity
+        change[rows[is_sell]] -= quantity
+        position = np.cumsum(change)
+
+        equity = cash + position * data['close'].to_numpy(dtype=float)
+
+        # drawdown from the highest equity
+        peak = np.maximum.accumulate(equity)
+        max_drawdown = float(np.max((peak - equity) / peak) * 100) if length > 0 else 0.0
+
+        # daily returns from the equity at the last bar of every day
+        session = Session.of(data)
+        day_end = np.flatnonzero(session.day_end)[:length]
+        daily = equity[day_end]
+        returns = daily / np.concatenate([[self.__init], daily[:-1]]) - 1
+        sharpe, sortino = math.nan, math.nan
+        if len(returns) > 1:
+            deviation = returns.std(ddof=1)
+            downside = math.sqrt(np.mean(np.minimum(returns, 0) ** 2))
+            sharpe = float(returns.mean() / deviation * math.sqrt(self.__periods)) if deviation > 0 else math.nan
+            sortino = float(returns.mean() / downside * math.sqrt(self.__periods)) if downside > 0 else math.nan
+
+        # holding time of the trades, from the last buy before a sell to the sell
+        deal_time = session.time[rows]
+        last_buy, opened = self.__last_buy(is_buy, is_sell)
+        closed = is_sell & opened
+        holding = deal_time[closed] - deal_time[last_buy[closed]]
+        avg_holding = pd.Timedelta(holding.astype('timedelta64[s]').mean()) if len(holding) > 0 else pd.NaT
+
+        return {
+            'trades': int(is_sell.sum()),
+            'loss': int((profit_loss < 0).sum()),
+            'profit': int((profit_loss > 0).sum()),
+            'account_end': float(account[filled][-1]) if filled.any() else self.__init,
+            'max_drawdown': max_drawdown,
+            'sharpe': sharpe,
+            'sortino': sortino,
+            'exposure': float(np.mean(position != 0) * 100) if length > 0 else 0.0,
+            'avg_holding': avg_holding,
+        }
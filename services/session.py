@@ -0,0 +1,88 @@
+import logging
+import numpy as np
+import pandas as pd
+
+from services.bars import UTC_OFFSET
+
+__all__ = "Session"
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 24 * 60 * 60
+MARKET_STOP = '23:45:00'  # time of day when an open position is closed
+
+
+def to_epoch(date, format: str = 'mixed') -> np.ndarray:
+    """
+    Convert exchange-time dates (datetime64 or strings) to seconds since epoch (UTC), the canonical time of the bars.
+
+    :param date: Dates in the exchange time zone, strings are parsed once with the given format.
+    :param format: Format of string dates.
+    :return: An int64 array.
+    """
+    date = pd.Series(date) if not isinstance(date, pd.Series) else date
+    if not pd.api.types.is_datetime64_any_dtype(date):
+        date = pd.to_datetime(date, format=format)
+    return date.to_numpy(dtype='datetime64[s]').astype(np.int64) - UTC_OFFSET
+
+
+def to_datetime(time) -> np.ndarray:
+    """
+    Convert seconds since epoch (UTC) to datetime64 in the exchange time zone (naive).
+    """
+    return (np.asarray(time, dtype=np.int64) + UTC_OFFSET).astype('datetime64[s]')
+
+
+def epoch(data: pd.DataFrame) -> np.ndarray:
+    """
+    Return the 'time' column of the quotes, or convert the 'date' column if the quotes do not have it (old CSV files).
+    """
+    if 'time' in data.columns:
+        return data['time'].to_numpy(dtype=np.int64)
+    return to_epoch(data['date'])
+
+
+def time_of_day(time: int) -> int:
+    """
+    Return the time of day of a bar in the exchange time zone in seconds, it works with numbers and arrays.
+    """
+    return (time + UTC_OFFSET) % DAY_SECONDS
+
+
+def seconds(value: str) -> int:
+    """
+    Return the time of day 'HH:MM:SS' in seconds.
+    """
+    return int(pd.Timedelta(value).total_seconds())
+
+
+class Session:
+    def __init__(self, time: np.ndarray, market_stop: str = MARKET_STOP) -> None:
+        """
+        Trading session arrays of a dataset, they are calculated once for all bars.
+
+        - time: start of the bar, seconds since epoch (UTC)
+        - day: trading day in the exchange time zone, days since epoch
+        - time_of_day: seconds since the exchange midnight
+        - market_stop: the bars at the market stop time
+        - day_end: the last bar of every trading day
+
+        :param time: Start of the bars in seconds since epoch (UTC), sorted.
+        :param market_stop: Time of day of the market stop, 'HH:MM:SS'.
+        """
+        self.time = np.asarray(time, dtype=np.int64)
+        local = self.time + UTC_OFFSET
+        self.day = local // DAY_SECONDS
+        self.time_of_day = local - self.day * DAY_SECONDS
+        self.market_stop = self.time_of_day == seconds(market_stop)
+        self.day_end = np.concatenate([self.day[1:] != self.day[:-1], [True]]) if len(self.day) > 0 else np.zeros(0, dtype=bool)
+
+    @classmethod
+    def of(cls, data: pd.DataFrame, market_stop: str = MARKET_STOP) -> 'Session':
+        """
+        Return the session arrays of the quotes.
+        """
+        return cls(epoch(data), market_stop)
+
+    def __len__(self) -> int:
+        return len(self.time)
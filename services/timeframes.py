@@ -0,0 +1,226 @@
+import logging
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+from services.bars import BarStore, COLUMNS, UTC_OFFSET
+from services.session import Session, DAY_SECONDS
+from services.metrics import metrics
+
+__all__ = "TimeframeStore"
+
+logger = logging.getLogger(__name__)
+
+BASE_TIMEFRAME = '5m'
+DIRECTORY = 'timeframes'  # subdirectory of the ticker directory with the stores of the timeframes
+TIMEFRAMES = {'5m': 300, '15m': 900, '30m': 1800, '1h': 3600, '4h': 4 * 3600, '1d': DAY_SECONDS}  # name -> seconds
+
+
+def session_hours() -> tuple[int, int]:
+    """
+    Return the open and close hours of the exchange from the configuration.
+    """
+    from configurations.alor import AlorConfiguration
+
+    config = AlorConfiguration()
+    return config.open, config.close
+
+
+def buckets(time: np.ndarray, timeframe: str, open: int, close: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the start and the end of the bar of the timeframe which contains every base bar (seconds since epoch, UTC).
+
+    The bars are counted from the session open, so they never span two sessions, and the last bar of the session
+    ends at the session close ('4h' with the session 10-24 gives 10-14, 14-18, 18-22 and 22-24).
+    Bars before the open get their own bars before the open, '1d' is the whole trading day.
+
+    :param time: Start of the base bars in seconds since epoch (UTC).
+    :param timeframe: A key of TIMEFRAMES.
+    :param open: The hour of the session open (exchange time).
+    :param close: The hour of the session close (exchange time).
+    """
+    seconds = TIMEFRAMES[timeframe]
+    session = Session(time)
+    midnight = session.day * DAY_SECONDS - UTC_OFFSET
+    open, close = open * 3600, close * 3600
+
+    if seconds >= DAY_SECONDS:
+        return midnight + open, midnight + close
+
+    start = open + (session.time_of_day - open) // seconds * seconds
+    end = np.where(session.time_of_day < close, np.minimum(start + seconds, close), start + seconds)
+    return midnight + start, midnight + end
+
+
+def resample(columns: dict, timeframe: str, open: int, close: int) -> tuple[dict[str, np.ndarray], np.ndarray]:
+    """
+    Aggregate base bars into the bars of the timeframe (first open, highest high, lowest low, last close, total volume).
+
+    :param columns: A dictionary with 'time', 'open', 'high', 'low', 'close' and optionally 'volume' arrays of the base bars, sorted by time.
+    :param timeframe: A key of TIMEFRAMES.
+    :param open: The hour of the session open (exchange time).
+    :param close: The hour of the session close (exchange time).
+    :return: The columns of the bars ('time' is the start of the bar) and the number of base bars in every bar.
+    """
+    time = np.asarray(columns['time'], dtype=np.int64)
+    if len(time) == 0:
+        return {column: np.empty(0, dtype=dtype) for column, dtype in COLUMNS.items()}, np.empty(0, dtype=np.int64)
+
+    start, end = buckets(time, timeframe, open, close)
+    starts = np.flatnonzero(np.concatenate([[True], start[1:] != start[:-1]]))
+    ends = np.concatenate([starts[1:], [len(time)]])
+
+    bars = {
+        'time': start[starts],
+        'open': np.asarray(columns['open'], dtype=np.float64)[starts],
+        'high': np.maximum.reduceat(np.asarray(columns['high'], dtype=np.float64), starts),
+        'low': np.minimum.reduceat(np.asarray(columns['low'], dtype=np.float64), starts),
+        'close': np.asarray(columns['close'], dtype=np.float64)[ends - 1],
+    }
+    if 'volume' in columns:
+        bars['volume'] = np.add.reduceat(np.asarray(columns['volume'], dtype=np.int64), starts)
+    return bars, ends - starts
+
+
+def is_complete(time: int, timeframe: str, open: int, close: int) -> bool:
+    """
+    Return True if the base bar which starts at time is the last base bar of its bar of the timeframe.
+    """
+    _, end = buckets(np.array([time], dtype=np.int64), timeframe, open, close)
+    return time + TIMEFRAMES[BASE_TIMEFRAME] >= end[0]
+
+
+def align(time: np.ndarray, timeframe: str, bars_time: np.ndarray, values: dict, open: int, close: int) -> dict[str, np.ndarray]:
+    """
+    Give every base bar the indicator values of the last complete bar of the timeframe, without looking ahead.
+
+    A bar of the timeframe is complete on the base bar which ends at its end, before that the base bars
+    see the previous bar of the timeframe.
+
+    :param time: Start of the base bars in seconds since epoch (UTC).
+    :param timeframe: A key of TIMEFRAMES.
+    :param bars_time: Start of the complete bars of the timeframe, sorted.
+    :param values: Indicator arrays of the bars of the timeframe.
+    :param open: The hour of the session open (exchange time).
+    :param close: The hour of the session close (exchange time).
+    :return: The indicator arrays for the base bars, NaN before the first complete bar.
+    """
+    time = np.asarray(time, dtype=np.int64)
+    start, end = buckets(time, timeframe, open, close)
+    complete = time + TIMEFRAMES[BASE_TIMEFRAME] >= end
+
+    # the bar which contains the base bar if it is complete, otherwise the previous one
+    index = np.where(complete, np.searchsorted(bars_time, start, side='right'), np.searchsorted(bars_time, start, side='left')) - 1
+    found = index >= 0
+    index = np.maximum(index, 0)
+
+    aligned = {}
+    for name, array in values.items():
+        array = np.asarray(array, dtype=np.float64)
+        aligned[name] = np.where(found, array[index] if len(array) > 0 else np.nan, np.nan)
+    return aligned
+
+
+class TimeframeStore:
+    def __init__(self, directory: str, ticker: str = None, open: int = None, close: int = None) -> None:
+        """
+        Higher timeframes derived from the 5-minute bars of a BarStore.
+
+        Every timeframe is kept in its own BarStore ('timeframes/{timeframe}' in the ticker directory) with
+        the complete bars only, and 'meta.json' remembers how many base bars they contain. When new base bars
+        arrive, only these bars are aggregated: the complete bars are appended and the last bar, which can
+        still change, is calculated again from the few base bars after the stored ones. The time of the last consumed
+        base bar is remembered too: if the base store was rewritten before it, the timeframe is built again.
+
+        :param directory: The ticker directory with the base BarStore.
+        :param ticker: The ticker symbol, by default the name of the directory.
+        :param open: The hour of the session open, by default from the configuration.
+        :param close: The hour of the session close, by default from the configuration.
+        """
+        if open is None or close is None:
+            open, close = session_hours()
+
+        self.__directory = directory
+        self.__open = open
+        self.__close = close
+        self.__base = BarStore(directory, ticker)
+
+    def __path(self, timeframe: str) -> str:
+        return os.path.join(self.__directory, DIRECTORY, timeframe)
+
+    def __meta(self, timeframe: str) -> dict:
+        path = os.path.join(self.__path(timeframe), 'meta.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def __write_meta(self, timeframe: str, meta: dict) -> None:
+        path = os.path.join(self.__path(timeframe), 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+
+    @metrics.timed()
+    def update(self, timeframe: str) -> dict | None:
+        """
+        Append the bars of the timeframe which were completed by the new base bars.
+
+        :return: The last bar which is not complete yet (the columns of one bar), or None.
+        """
+        base = self.__base.read_columns()
+        length = len(base['time'])
+        store = BarStore(self.__path(timeframe), self.__base.get_ticker())
+
+        meta = self.__meta(timeframe)
+        consumed = meta.get('consumed', 0)
+        if (meta.get('open') != self.__open or meta.get('close') != self.__close or consumed > length or len(store) != meta.get('bars', 0)
+                or (consumed > 0 and int(base['time'][consumed - 1]) != meta.get('last_time'))):
+            # no bars yet, the session hours changed, the base store was rewritten (merged, truncated, downloaded again)
+            # or the last writing was interrupted
+            shutil.rmtree(self.__path(timeframe), ignore_errors=True)
+            consumed = 0
+
+        bars, counts = resample({column: values[consumed:] for column, values in base.items()}, timeframe, self.__open, self.__close)
+        if len(counts) == 0:
+            return None
+
+        # every bar except the last one is complete, the last one is complete if its last base bar ends at its end
+        complete = len(counts) if is_complete(int(base['time'][-1]), timeframe, self.__open, self.__close) else len(counts) - 1
+
+        if complete > 0:
+            os.makedirs(self.__path(timeframe), exist_ok=True)
+            store.append({column: values[:complete] for column, values in bars.items()})
+            consumed += int(counts[:complete].sum())
+            metrics.count('TimeframeStore.update', 'bars_written', complete)
+            self.__write_meta(timeframe, {'consumed': consumed, 'last_time': int(base['time'][consumed - 1]), 'bars': len(store),
+                                          'open': self.__open, 'close': self.__close})
+
+        if complete == len(counts):
+            return None
+        return {column: values[-1] for column, values in bars.items()}
+
+    def read(self, timeframe: str, partial: bool = True) -> pd.DataFrame:
+        """
+        Return the bars of the timeframe in the format of BarStore.read.
+
+        :param timeframe: A key of TIMEFRAMES, '5m' returns the base bars.
+        :param partial: Add the last bar which is not complete yet. Indicators for other timeframes should be
+                        calculated without it, so they do not change when the bar changes.
+        """
+        if timeframe not in TIMEFRAMES:
+            raise ValueError(f"Unknown timeframe {timeframe}, expected one of {', '.join(TIMEFRAMES)}")
+        if timeframe == BASE_TIMEFRAME:
+            return self.__base.read()
+
+        last = self.update(timeframe)
+        quotes = BarStore(self.__path(timeframe), self.__base.get_ticker()).read()
+        if partial and last is not None:
+            row = pd.DataFrame({'ticker': self.__base.get_ticker(), 'time': [last['time']],
+                                'date': (np.array([last['time']]) + UTC_OFFSET).astype('datetime64[s]'),
+                                **{column: [last[column]] for column in ('open', 'high', 'low', 'close', 'volume')}})
+            quotes = pd.concat([quotes, row], ignore_index=True) if len(quotes) > 0 else row
+
+        return quotes
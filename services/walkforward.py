@@ -0,0 +1,259 @@
+import logging
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from services.optimizer import Optimizer, _attach, _worker, indicator_names, share_quotes
+from services.bars import UTC_OFFSET
+from services.session import Session, epoch
+from services.metrics import metrics, collect
+
+__all__ = "WalkForward"
+
+logger = logging.getLogger(__name__)
+
+ORDER_COLUMNS = ['SIGNAL', 'BUY_PRICE', 'SELL_PRICE', 'TAKE_PROFIT']
+
+
+@metrics.timed()
+def _fit(super_trends: list, var_takes: list, windows: list, objective: str) -> list[dict]:
+    """
+    Evaluate all var_take values with one set of SuperTrend parameters on the in-sample windows (fold, start, end).
+
+    The indicators are calculated once on the whole history and every fold backtests its own rows of them,
+    the indicators only look back, so the values are the same as if the history was cut at the window.
+    """
+    double_st = _worker['double_st']
+    data = double_st.run(_worker['quotes'], super_trends)
+    indicators = indicator_names(super_trends)
+
+    rows = []
+    for fold, start, end in windows:
+        sample = data.iloc[start:end].reset_index(drop=True)
+        for var_take in var_takes:
+            row = {'fold': fold, 'key': Optimizer.key(var_take, super_trends), 'score': -np.inf, 'trades': 0, 'account_end': np.nan}
+            try:
+                report = double_st.report(double_st.calculate(sample, var_take, indicators=indicators), 'optimization', var_take).iloc[0]
+                row.update({'score': float(report[objective]), 'trades': int(report['trades']), 'account_end': float(report['account_end'])})
+            except Exception as e:
+                logger.error(f'Error evaluating {row["key"]} on fold {fold}: {e}')
+            rows.append(row)
+
+    return rows
+
+
+@metrics.timed()
+def _test(fold: int, super_trends: list, var_take: float, start: int, end: int) -> tuple[int, pd.DataFrame, dict]:
+    """
+    Backtest the parameters chosen for a fold on its out-of-sample window.
+
+    :return: The fold, the order columns of the window (indexed by the position of the bar in the quotes)
+             and the report of the window.
+    """
+    double_st = _worker['double_st']
+    data = double_st.run(_worker['quotes'], super_trends)  # the cache keeps the indicators of _fit in memory
+
+    window = data.iloc[start:end]
+    try:
+        result = double_st.calculate(window, var_take, indicators=indicator_names(super_trends))
+    except Exception as e:
+        logger.error(f'Error testing fold {fold}: {e}')
+        result = window  # the window counts as a window without trades
+
+    # a window without fills has no order columns, its report has no trades and the initial account
+    report = double_st.report(result, 'optimization', var_take).iloc[0]
+    orders = result.reindex(columns=ORDER_COLUMNS).dropna(how='all')
+    return fold, orders, {'oos_trades': int(report['trades']), 'oos_account_end': float(report['account_end'])}
+
+
+class WalkForward:
+    def __init__(self, directory: str, space: dict, in_sample: int = 120, out_of_sample: int = 20, anchored: bool = False,
+                 objective: str = 'account_end', min_trades: int = 1, method: str = 'grid', samples: int = None,
+                 workers: int = None, seed: int = None) -> None:
+        """
+        Walk-forward optimization of the DoubleST strategy.
+
+        The history is split into folds by trading days: the parameters are optimized on the in-sample window
+        of a fold and tested on the following out-of-sample window, then the fold moves by the out-of-sample
+        window. The out-of-sample windows do not overlap, their trades are chained into one backtest,
+        which shows how the strategy would have worked with parameters chosen only from the past.
+
+        The in-sample evaluations run in a process pool (see Optimizer): every task takes one set of SuperTrend
+        parameters, calculates the indicators once and evaluates all var_take values on its folds,
+        then the out-of-sample windows are tested in the same pool. With few SuperTrend sets the folds are
+        split between several tasks.
+
+        :param directory: The ticker directory with 'config.json'.
+        :param space: The search space, see Optimizer.
+        :param in_sample: Number of trading days of the in-sample window.
+        :param out_of_sample: Number of trading days of the out-of-sample window.
+        :param anchored: The in-sample window starts at the first day and grows, instead of rolling.
+        :param objective: The column of the report which is maximized ('account_end', 'sharpe', 'sortino').
+        :param min_trades: Candidates with fewer in-sample trades are chosen only if no candidate has enough trades.
+        :param method: 'grid' or 'random', see Optimizer.
+        :param samples: Number of combinations of the random search.
+        :param workers: Number of worker processes, by default the number of CPUs.
+        :param seed: Seed of the random search.
+        """
+        self.__directory = directory
+        self.__in_sample = in_sample
+        self.__out_of_sample = out_of_sample
+        self.__anchored = anchored
+        self.__objective = objective
+        self.__min_trades = min_trades
+        self.__workers = workers
+        self.__candidates = Optimizer(directory, space, method, samples, workers, seed).candidates()
+
+    def folds(self, time: np.ndarray) -> list[dict]:
+        """
+        Return the folds: the positions [start, end) of the in-sample and out-of-sample bars.
+
+        :param time: Start of the bars in seconds since epoch (UTC).
+        """
+        day = Session(time).day
+        starts = np.flatnonzero(np.concatenate([[True], day[1:] != day[:-1]]))  # first bar of every trading day
+        bounds = np.concatenate([starts, [len(day)]])
+        days = len(starts)
+
+        folds = []
+        first = 0
+        while first + self.__in_sample < days:
+            split = first + self.__in_sample
+            last = min(split + self.__out_of_sample, days)
+            folds.append({'is_start': int(bounds[0 if self.__anchored else first]), 'is_end': int(bounds[split]),
+                          'oos_start': int(bounds[split]), 'oos_end': int(bounds[last])})
+            first += self.__out_of_sample
+
+        return folds
+
+    @metrics.timed()
+    def run(self, quotes: pd.DataFrame) -> dict[str, pd.DataFrame]:
+        """
+        Run the walk-forward optimization.
+
+        :param quotes: The quotes of the ticker ('ticker', 'date', 'open', 'high', 'low', 'close').
+        :return: A dictionary with
+                 'folds' - the windows, the chosen parameters and the in-sample and out-of-sample results of every fold,
+                 'stability' - the statistics of every chosen parameter over the folds,
+                 'data' - the chained out-of-sample backtest (the quotes with the order columns).
+        """
+        time = epoch(quotes)
+        folds = self.folds(time)
+        if len(folds) == 0:
+            raise ValueError(f"Not enough history for a walk-forward: {self.__in_sample + 1} trading days are needed")
+
+        groups = {}
+        for var_take, super_trends in self.__candidates:
+            groups.setdefault(json.dumps(super_trends), []).append(var_take)
+
+        # the folds are split into chunks when there are fewer SuperTrend sets than workers, so all workers are busy
+        windows = [(fold, window['is_start'], window['is_end']) for fold, window in enumerate(folds)]
+        chunks = min(len(folds), -(-4 * (self.__workers or os.cpu_count() or 1) // len(groups)))
+        size = -(-len(windows) // chunks)
+        tasks = [(super_trends, var_takes, windows[i:i + size]) for super_trends, var_takes in groups.items()
+                 for i in range(0, len(windows), size)]
+
+        logger.info(f"Walk-forward: {len(folds)} folds, {len(self.__candidates)} candidates, {len(tasks)} tasks")
+        print(f"Walk-forward: {len(folds)} folds, {len(self.__candidates)} candidates, {len(tasks)} tasks")
+
+        memory, specs = share_quotes(quotes)
+        try:
+            with ProcessPoolExecutor(max_workers=self.__workers, initializer=_attach,
+                                     initargs=(self.__directory, quotes['ticker'].iloc[0], specs)) as executor:
+                # in-sample: every candidate on every fold
+                futures = [executor.submit(collect, _fit, json.loads(super_trends), var_takes, chunk, self.__objective)
+                           for super_trends, var_takes, chunk in tasks]
+                results = []
+                for completed, future in enumerate(as_completed(futures), start=1):
+                    rows, snapshot = future.result()
+                    metrics.merge(snapshot)
+                    results.extend(rows)
+                    print(f"Walk-forward: {completed}/{len(futures)} tasks completed")
+
+                chosen = self.__choose(pd.DataFrame(results), len(folds))
+
+                # out-of-sample: the chosen parameters of every fold on its next window
+                futures = [executor.submit(collect, _test, fold, row['super_trends'], row['var_take'], folds[fold]['oos_start'], folds[fold]['oos_end'])
+                           for fold, row in enumerate(chosen)]
+                orders, reports = {}, {}
+                for future in as_completed(futures):
+                    (fold, orders[fold], reports[fold]), snapshot = future.result()
+                    metrics.merge(snapshot)
+        finally:
+            for block in memory:
+                block.close()
+                block.unlink()
+
+        # the out-of-sample windows follow each other, so their trades form one backtest
+        start, end = folds[0]['oos_start'], folds[-1]['oos_end']
+        columns = ['ticker', 'time', 'date', 'open', 'high', 'low', 'close'] if 'time' in quotes.columns else ['ticker', 'date', 'open', 'high', 'low', 'close']
+        parts = [orders[fold] for fold in range(len(folds)) if len(orders[fold]) > 0]
+        data = quotes[columns].iloc[start:end].reset_index(drop=True)
+        if len(parts) > 0:
+            parts = pd.concat(parts)
+            data = data.join(parts.set_axis(parts.index - start))
+        data = data.reindex(columns=list(data.columns) + [column for column in ORDER_COLUMNS if column not in data.columns])
+
+        table = self.__table(folds, chosen, reports, time)
+        return {'folds': table, 'stability': self.stability(table), 'data': data}
+
+    def __choose(self, results: pd.DataFrame, count: int) -> list[dict]:
+        """
+        Return the best candidate of every fold by the objective, ties go to the first candidate.
+        """
+        chosen = []
+        for fold in range(count):
+            rows = results[results['fold'] == fold]
+            enough = rows[rows['trades'] >= self.__min_trades]
+            rows = enough if len(enough) > 0 else rows
+            best = rows.loc[rows['score'].fillna(-np.inf).idxmax()]
+            params = json.loads(best['key'])
+            chosen.append({'var_take': params['var_take'], 'super_trends': params['super_trends'],
+                           'is_score': best['score'], 'is_trades': int(best['trades']), 'is_account_end': best['account_end']})
+        return chosen
+
+    def __table(self, folds: list, chosen: list, reports: dict, time: np.ndarray) -> pd.DataFrame:
+        """
+        Return the table of the folds with the chosen parameters and the in-sample and out-of-sample results.
+        """
+        rows = []
+        for fold, (window, params) in enumerate(zip(folds, chosen)):
+            row = {'fold': fold}
+            for name in ('is_start', 'is_end', 'oos_start', 'oos_end'):
+                position = window[name] if name.endswith('start') else window[name] - 1  # the first and the last bar
+                row[name] = pd.Timestamp(int(time[position]) + UTC_OFFSET, unit='s')
+            row['var_take'] = params['var_take']
+            for i, super_trend in enumerate(params['super_trends'], start=1):
+                row[f'period {i}'] = super_trend['period']
+                row[f'multiplier {i}'] = super_trend['multiplier']
+            row[f'is_{self.__objective}'] = params['is_score']
+            row['is_trades'] = params['is_trades']
+            row['is_account_end'] = params['is_account_end']
+            row.update(reports[fold])  # the window alone, from the same initial capital as the in-sample backtest
+            rows.append(row)
+
+        return pd.DataFrame(rows)
+
+    @staticmethod
+    def stability(folds: pd.DataFrame) -> pd.DataFrame:
+        """
+        Return the statistics of every chosen parameter over the folds: mean, std, min, max,
+        'changes' (the number of folds with another value than the previous fold) and 'mode_share'
+        (the share of the folds with the most frequent value).
+        """
+        parameters = ['var_take'] + [column for column in folds.columns if column.startswith(('period ', 'multiplier '))]
+        rows = []
+        for parameter in parameters:
+            values = folds[parameter]
+            rows.append({
+                'parameter': parameter,
+                'mean': values.mean(),
+                'std': values.std(ddof=0),
+                'min': values.min(),
+                'max': values.max(),
+                'changes': int((values.to_numpy()[1:] != values.to_numpy()[:-1]).sum()),
+                'mode_share': round(float(values.value_counts().iloc[0] / len(values)), 2),
+            })
+        return pd.DataFrame(rows)
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 from datetime import datetime
@@ -6,7 +7,7 @@ from services.position import Position
 
 
 class WithDoubleTrend():
-    def __init__(self, params: dict, orders: Orders, position: Position):
+    def __init__(self, params: dict, orders: Orders = None, position: Position = None):
         self.name = 'WithDoubleTrend'
         self.__var_take = params['var_take']
         self.__fast_up = params['indicators']['fast_up']
@@ -23,6 +24,35 @@ class WithDoubleTrend():
         elif self.__position.get_size(self.name) > 0:
             return self.__long_close(current)
 
+    def signals(self, data: pd.DataFrame) -> dict[str, np.ndarray]:
+        """
+        Calculate the conditions of run for every bar at once, bar i is compared with bar i - 1 like in run.
+
+        :return: A dictionary with the arrays 'long_open' (entry condition), 'long_close' (exit condition),
+                 'price' (limit price of the entry) and 'take_profit' (take profit price of the entry).
+        """
+        fast_up = data[self.__fast_up].to_numpy(dtype=float)
+        fast_down = data[self.__fast_down].to_numpy(dtype=float)
+        slow_down = data[self.__slow_down].to_numpy(dtype=float)
+        open = data['open'].to_numpy(dtype=float)
+        close = data['close'].to_numpy(dtype=float)
+
+        # values of the previous bar, the first bar has no previous one
+        prev_fast_up = np.r_[np.nan, fast_up[:-1]]
+        prev_slow_down = np.r_[np.nan, slow_down[:-1]]
+        prev_close = np.r_[np.nan, close[:-1]]
+
+        long_open = (~np.isnan(prev_fast_up) & ~np.isnan(prev_slow_down) & ~np.isnan(fast_down) & ~np.isnan(slow_down)
+                     & (prev_close <= prev_fast_up) & (prev_close > prev_slow_down)
+                     & (open > fast_down) & (open > slow_down))
+
+        return {
+            'long_open': long_open,
+            'long_close': np.isnan(fast_down),
+            'price': prev_fast_up,
+            'take_profit': prev_fast_up + self.__var_take,
+        }
+
     def __long_open(self, previous: pd.DataFrame, current: pd.DataFrame) -> dict:
         if pd.notna(previous[self.__fast_up]) and pd.notna(previous[self.__slow_down]) and pd.notna(current[self.__fast_down]) and pd.notna(current[self.__slow_down]):
             if previous['close'] <= previous[self.__fast_up] and previous['close'] > previous[self.__slow_down]:
@@ -1,14 +1,23 @@
 import logging
 import os
 import pandas as pd
-import finplot as fplt
-import talib
+import numpy as np
 import json
+import subprocess
+import sys
 
-from indicators.super_trend import super_trend
+from typing import Literal
 from strategies.withDoubleTrend import WithDoubleTrend
 from services.position import Position
 from services.orders import Orders
+from services.backtest import Backtest
+from services.optimizer import Optimizer
+from services.walkforward import WalkForward
+from services.cache import IndicatorCache
+from services.report import TradeReport
+from services.metrics import metrics
+from services.session import epoch
+from services.timeframes import BASE_TIMEFRAME, align, is_complete, resample, session_hours
 
 __all__ = "DoubleST_Strategy"
 
@@ -18,6 +27,8 @@ logger = logging.getLogger(__name__)
 class DoubleST:
     def __init__(self, directory: str):
         self.__directory = directory
+        self.__cache = IndicatorCache(os.path.join(directory, 'cache'))  # indicators shared with other modes
+        self.__session_hours = None  # session open and close hours, they are read when a higher timeframe is used
         self.__indicators_aleases = {
             'fast_up': 'ST 10 3 UP',
             'fast_down': 'ST 10 3 LOW',
@@ -30,70 +41,94 @@ class DoubleST:
             self.__var_take = config['var_take']
             self.__super_trends = config['indicators']['super_trends']
 
-    def run(self, quotes: pd.DataFrame) -> pd.DataFrame:
+    @metrics.timed()
+    def run(self, quotes: pd.DataFrame, super_trends: list = None) -> pd.DataFrame:
         """
-        Read data from 'explore.csv' file, calculate SuperTrend indicators if they are not already in the data and return the result.
+        Return the quotes with the 'EMA 50' and SuperTrend indicators.
 
-        If the SuperTrend indicators are already in the data, read the data from the file and return it. Otherwise, calculate the SuperTrend indicators
-        and save the result to the 'explore.csv' file.
-        """
-        with open(os.path.join(self.__directory, 'explore.csv'), 'r') as f:
-            data = pd.read_csv(f, header=0)
-            max_period = 0
-            for indicator in self.__super_trends:
-                # check if the SuperTrend indicators not are already in the data
-                if f'ST {indicator["period"]} {indicator["multiplier"]} UP' not in data.columns or f'ST {indicator["period"]} {indicator["multiplier"]} LOW' not in data.columns:
-                    # calculate the SuperTrend indicators
-                    copy = quotes[['ticker', 'date', 'open', 'high', 'low', 'close']].copy()
-                    copy['EMA 50'] = talib.EMA(quotes['close'].values, timeperiod=50)
-                    copy['EMA 50'] = copy['EMA 50'].round(2)
-
-                    # return the calculated SuperTrend indicators
-                    return super_trend(self.__super_trends, copy)
-
-                # Update max_period with the maximum period from the indicators
-                max_period = max(max_period, indicator['period'])
-
-            # Calculate 50-period EMA for the closing prices
-            quotes['EMA 50'] = talib.EMA(quotes['close'].values, timeperiod=50)
-            quotes['EMA 50'] = quotes['EMA 50'].round(2)
-
-            # Extract the data corresponding to the last max_period entries
-            empty_data = quotes.iloc[len(data) - max_period:]
+        The indicators are read from the indicator cache, only the bars which are not in the cache yet are calculated.
+        A SuperTrend with a 'timeframe' ('15m', '1h', ...) is calculated on the complete bars of that timeframe
+        resampled from the quotes, every bar gets the values of the last complete bar ('ST 10 3 UP 1h').
 
-            # Get the last max_period data from existing data
-            last_data = data.iloc[-max_period:]
-
-            # Calculate new SuperTrend indicators
-            new_data = super_trend(self.__super_trends, empty_data, last_data)
-
-            # Remove the 'volume' column from the new data
-            new_data = new_data.drop(columns=['volume'])
-
-            # Concatenate the existing data with the newly calculated data, excluding the initial max_period entries
-            return pd.concat([data, new_data.iloc[max_period:]], ignore_index=True)
+        :param quotes: The 5-minute quotes of the ticker.
+        :param super_trends: Parameters of the SuperTrend indicators, by default the ones from 'config.json'.
+        """
+        if super_trends is None:
+            super_trends = self.__super_trends
+
+        ticker = quotes['ticker'].iloc[0]
+        columns = ['ticker', 'time', 'date', 'open', 'high', 'low', 'close'] if 'time' in quotes.columns else ['ticker', 'date', 'open', 'high', 'low', 'close']
+        data = quotes[columns].copy()
+
+        # Calculate 50-period EMA for the closing prices
+        data['EMA 50'] = np.round(self.__cache.get(ticker, 'ema', {'period': 50}, quotes)['EMA'], 2)
+
+        for indicator in super_trends:
+            params = {'period': indicator['period'], 'multiplier': indicator['multiplier']}
+            timeframe = indicator.get('timeframe', BASE_TIMEFRAME)
+            name = f'ST {indicator["period"]} {indicator["multiplier"]}'
+            if timeframe == BASE_TIMEFRAME:
+                values = self.__cache.get(ticker, 'super_trend', params, quotes)
+            else:
+                values = self.__timeframe_indicator(ticker, timeframe, 'super_trend', params, quotes)
+                name += f' {timeframe}'
+            data[f'{name} UP'] = values['UP']
+            data[f'{name} LOW'] = values['LOW']
+
+        return data
+
+    def __timeframe_indicator(self, ticker: str, timeframe: str, indicator: str, params: dict, quotes: pd.DataFrame) -> dict:
+        """
+        Calculate an indicator on the complete bars of a higher timeframe and align it with the quotes.
+        """
+        if self.__session_hours is None:
+            self.__session_hours = session_hours()
+        open, close = self.__session_hours
+
+        time = epoch(quotes)
+        bars, counts = resample({'time': time, **{column: quotes[column].to_numpy() for column in ('open', 'high', 'low', 'close')}},
+                                timeframe, open, close)
+        complete = len(counts) if len(counts) > 0 and is_complete(int(time[-1]), timeframe, open, close) else max(len(counts) - 1, 0)
+        bars = pd.DataFrame({column: values[:complete] for column, values in bars.items()})
+
+        # the complete bars only grow, so the cache extends the indicator by the new bars
+        values = self.__cache.get(f'{ticker} {timeframe}', indicator, params, bars)
+        return align(time, timeframe, bars['time'].to_numpy(), values, open, close)
+
+    @metrics.timed()
+    def calculate(self, data: pd.DataFrame, var_take: float = None, engine: Literal['vector', 'loop'] = 'vector',
+                  indicators: dict = None) -> pd.DataFrame:
+        """
+        Backtest the WithDoubleTrend strategy and add the 'SIGNAL', 'BUY_PRICE', 'SELL_PRICE' and 'TAKE_PROFIT' columns to the data.
 
-    def calculate(self, data: pd.DataFrame, var_take: float = None) -> pd.DataFrame:
+        The 'vector' engine calculates the strategy conditions for all bars at once and simulates the fills in one pass
+        over arrays, the 'loop' engine runs the strategy and the orders bar by bar. Both give the same result.
+        The SuperTrend columns of the strategy can be replaced with indicators ('fast_up', 'fast_down', 'slow_up', 'slow_down').
+        """
         if var_take is None:
             var_take = self.__var_take
 
         params = {
             'var_take': var_take,
-            'indicators': self.__indicators_aleases
+            'indicators': self.__indicators_aleases if indicators is None else indicators
         }
 
+        if engine == 'vector':
+            return data.join(Backtest().run(data, WithDoubleTrend(params)))
+
         position = Position()
         orders = Orders(position)
         widthDT = WithDoubleTrend(params, orders, position)
 
-        for index, row in data.iterrows():
+        rows = data if 'time' in data.columns else data.assign(time=epoch(data))  # old files have only the 'date'
+        for index, row in rows.iterrows():
             # config
             if index == 0:
                 continue
             elif index == len(data) - 1 and position.get_size(widthDT.name) > 0:
                 orders.create({'id': index, 'strategy': widthDT.name, 'signal': 'LONG_SELL', 'order': 'SELL_LIMIT',  'price': row['open']})
 
-            widthDT.run(previous=data.loc[index - 1], current=row)
+            widthDT.run(previous=rows.loc[index - 1], current=row)
 
             orders.run(row, index)
 
@@ -101,112 +136,136 @@ class DoubleST:
 
         return data.join(order_list)
 
-    def report(self, data: pd.DataFrame, mode: str = 'default', var_take: float = None) -> pd.DataFrame:
+    @metrics.timed()
+    def report(self, data: pd.DataFrame, mode: str = 'default', var_take: float = None,
+               export: Literal['pickle', 'excel', None] = 'pickle') -> pd.DataFrame:
+        """
+        Return the report of the backtest: the deals, the account and the performance metrics.
+
+        In the default mode the report is printed and the list of deals is written to 'deals.pkl' ('pickle')
+        or 'deals.xlsx' ('excel'), the 'optimization' mode only returns the report.
+        """
         if var_take is None:
             var_take = self.__var_take
-        # list of deals
-        deals = pd.DataFrame()  # create empty DataFrame
-        # add columns
-        deals[['ticker', 'date', 'SIGNAL', 'BUY_PRICE', 'SELL_PRICE']
-              ] = data[['ticker', 'date', 'SIGNAL', 'BUY_PRICE', 'SELL_PRICE']]
-        deals = deals[deals['SIGNAL'].notnull()]
-        deals = deals.assign(COMMISSION=None, **{'P/L': None}, ACCOUNT=None)  # add columns
 
         init = 3000  # initial capital
-        account = init  # current capital
-        commission = 0.00005  # commission
-        last_buy_price = 0  # last buy price
-        trades = 0  # number of trades
-
-        for index, row in deals.iterrows():
-            if not pd.isnull(row['BUY_PRICE']):
-                deals.loc[index, 'COMMISSION'] = round(10 * row['BUY_PRICE'] * commission, 2)
-                account -= round((10 * row['BUY_PRICE'])+deals.loc[index, 'COMMISSION'], 2)
-                deals.loc[index, 'ACCOUNT'] = account
-                last_buy_price = row['BUY_PRICE']
-
-            elif not pd.isnull(row['SELL_PRICE']):
-                deals.loc[index, 'COMMISSION'] = round(10 * row['SELL_PRICE'] * commission, 2)
-                account += round((10 * row['SELL_PRICE'])-deals.loc[index, 'COMMISSION'], 2)
-                deals.loc[index, 'ACCOUNT'] = account
-                deals.loc[index, 'P/L'] = (row['SELL_PRICE']-last_buy_price) * 10
-                last_buy_price = 0
-                trades += 1
-        if mode == 'default':
-            deals.to_excel(os.path.join(self.__directory, 'deals.xlsx'), index=False)
+        trade_report = TradeReport(init=init, commission=0.00005, quantity=10)
+        deals = trade_report.deals(data)  # list of deals
+        stats = trade_report.metrics(data, deals)
 
-        loss = len(deals[deals['P/L'] < 0])  # number of losses
-        profit = len(deals[deals['P/L'] > 0])  # number of profits
-        win_rate = str(round((profit / (loss + profit)) * 100, 2))+'%'  # win rate
+        if mode == 'default':
+            if export == 'pickle':
+                deals.to_pickle(os.path.join(self.__directory, 'deals.pkl'))
+            elif export == 'excel':
+                deals.to_excel(os.path.join(self.__directory, 'deals.xlsx'), index=False)
+
+        loss = stats['loss']  # number of losses
+        profit = stats['profit']  # number of profits
+        win_rate = str(round((profit / (loss + profit)) * 100 if loss + profit > 0 else 0.0, 2))+'%'  # win rate, 0% without trades
+        account = stats['account_end']
         result = (account - init)/init*100  # result in %
 
         # report
-        report = pd.DataFrame(columns=['var_take', 'trades', 'loss', 'profit', 'win_rate', 'account_start', 'account_end', 'result'])
-        report.loc[len(report)] = [var_take, trades, loss, profit, win_rate, init, round(account, 2), str(round(result, 2))+'%']
-        print(report)
+        report = pd.DataFrame([{
+            'var_take': var_take,
+            'trades': stats['trades'],
+            'loss': loss,
+            'profit': profit,
+            'win_rate': win_rate,
+            'account_start': init,
+            'account_end': round(account, 2),
+            'result': str(round(result, 2))+'%',
+            'max_drawdown': str(round(stats['max_drawdown'], 2))+'%',
+            'sharpe': round(stats['sharpe'], 2),
+            'sortino': round(stats['sortino'], 2),
+            'exposure': str(round(stats['exposure'], 2))+'%',
+            'avg_holding': stats['avg_holding'].round('s') if not pd.isnull(stats['avg_holding']) else pd.NaT,
+        }])
+        if mode == 'default':
+            print(report)
 
         return report
 
-    def show(self, data: pd.DataFrame) -> None:
-        if 'SIGNAL' in data.columns:
-            self.report(data)  # create report
-        # candlestick
-        data.set_index('date', inplace=True)
-        data.index = pd.to_datetime(data.index).tz_localize('Etc/GMT-5')
-
-        fplt.candlestick_ochl(data[['open', 'close', 'high', 'low']])
-        fplt.plot(data[self.__indicators_aleases['fast_up']], legend='ST_FAST_UP', color='#FF0000', width=2)
-        fplt.plot(data[self.__indicators_aleases['fast_down']], legend='ST_FAST_LOW', color='#228B22', width=2)
-        fplt.plot(data[self.__indicators_aleases['slow_up']], legend='ST_SLOW_UP', color='#B22222', width=3)
-        fplt.plot(data[self.__indicators_aleases['slow_down']], legend='ST_SLOW_LOW', color='#006400', width=3)
-        fplt.plot(data['EMA 50'], legend='EMA 50')
-
-        if 'TAKE_PROFIT' in data.columns:
-            fplt.plot(data['TAKE_PROFIT'], legend='TAKE_PROFIT', width=1, color='g')
-        if 'BUY_PRICE' in data.columns:
-            fplt.plot(data['BUY_PRICE'], color='b', style='x', width=2)
-        if 'SELL_PRICE' in data.columns:
-            fplt.plot(data['SELL_PRICE'], color='b', style='x', width=2)
+    def show(self, data: pd.DataFrame, block: bool = True) -> None:
+        """
+        Create the report and show the chart of the backtest.
 
+        :param block: Show the chart in this process and wait until it is closed, otherwise the chart is shown
+                      by a separate viewer process and the method returns at once.
+        """
         if 'SIGNAL' in data.columns:
-            long_buy = data.loc[data['SIGNAL'] == 'LONG_BUY', 'BUY_PRICE']
-            if not long_buy.empty:
-                fplt.plot(long_buy-1, color='#4a5', style='^', legend='buy', width=2)
-
-            long_sell = data.loc[data['SIGNAL'] == 'LONG_SELL', 'SELL_PRICE']
-            if not long_sell.empty:
-                fplt.plot(long_sell+1, color='#4a6', style='o', legend='sell', width=2)
-
-            long_take_profit = data.loc[data['SIGNAL'] == 'LONG_TAKE_PROFIT', 'SELL_PRICE']
-            if not long_take_profit.empty:
-                fplt.plot(long_take_profit+1, color='#4a5', style='p', legend='take profit', width=2)
+            self.report(data)  # create report
 
-            short_buy = data.loc[data['SIGNAL'] == 'SHORT_BUY', 'BUY_PRICE']
-            if not short_buy.empty:
-                fplt.plot(short_buy-1, color='r', style='^', legend='short buy', width=2)
+        if block:
+            from terminals.viewer import plot_backtest  # GUI is imported only for showing, so the headless modes do not load it
+            plot_backtest(data, self.__indicators_aleases)
+        else:
+            path = os.path.join(self.__directory, 'show.pkl')
+            data.to_pickle(path)
+            subprocess.Popen([sys.executable, '-m', 'terminals.viewer', '--file', path, '--indicators', json.dumps(self.__indicators_aleases)],
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    @metrics.timed()
+    def optimize(self, data: pd.DataFrame, var_take: dict, super_trends: list = None, method: str = 'grid',
+                 samples: int = None, workers: int = None) -> pd.DataFrame:
+        """
+        Optimize var_take and the SuperTrend parameters in a process pool and write the results to 'optimization.xlsx'.
+
+        :param data: Quotes (only 'ticker', 'date', 'open', 'high', 'low', 'close' are used).
+        :param var_take: Range {'start': ..., 'step': ..., 'end': ...} or list of var_take values.
+        :param super_trends: Ranges or lists of 'period' and 'multiplier' of every SuperTrend (fast first, slow second),
+                             by default the SuperTrends from 'config.json'.
+        :param method: 'grid' or 'random'.
+        :param samples: Number of combinations of the random search.
+        :param workers: Number of worker processes, by default the number of CPUs.
+        """
+        if super_trends is None:
+            super_trends = [{'period': [item['period']], 'multiplier': [item['multiplier']]} for item in self.__super_trends]
 
-            short_sell = data.loc[data['SIGNAL'] == 'SHORT_SELL', 'SELL_PRICE']
-            if not short_sell.empty:
-                fplt.plot(short_sell+1, color='r', style='o', legend='short sell', width=2)
+        optimizer = Optimizer(self.__directory, {'var_take': var_take, 'super_trends': super_trends},
+                              method=method, samples=samples, workers=workers)
+        results = optimizer.run(data)
 
-            short_take_profit = data.loc[data['SIGNAL'] == 'SHORT_TAKE_PROFIT', 'SELL_PRICE']
-            if not short_take_profit.empty:
-                fplt.plot(short_take_profit-1, color='r', style='p', legend='short take profit', width=2)
+        results.to_excel(os.path.join(self.__directory, 'optimization.xlsx'), index=False)
 
-        fplt.add_legend('Double SuperTrend')
-        fplt.show()
+        return results
 
-    def optimize(self, data: pd.DataFrame, var_take: dict) -> None:
+    @metrics.timed()
+    def walk_forward(self, data: pd.DataFrame, var_take: dict, super_trends: list = None, in_sample: int = 120,
+                     out_of_sample: int = 20, anchored: bool = False, objective: str = 'account_end',
+                     workers: int = None) -> dict[str, pd.DataFrame]:
+        """
+        Walk-forward optimization: optimize the parameters on rolling in-sample windows, test them on the following
+        out-of-sample windows and chain the out-of-sample trades into one backtest.
+
+        The folds, the stability of the parameters and the report of the chained backtest are written to
+        'walkforward.xlsx', the chained backtest to 'walkforward.pkl' (it can be shown with terminals.viewer).
+
+        :param data: Quotes (only 'ticker', 'date', 'open', 'high', 'low', 'close' are used).
+        :param var_take: Range {'start': ..., 'step': ..., 'end': ...} or list of var_take values.
+        :param super_trends: Ranges or lists of 'period' and 'multiplier' of every SuperTrend, see optimize.
+        :param in_sample: Number of trading days of the in-sample window.
+        :param out_of_sample: Number of trading days of the out-of-sample window.
+        :param anchored: The in-sample window starts at the first day and grows.
+        :param objective: The column of the report which is maximized ('account_end', 'sharpe', 'sortino').
+        :param workers: Number of worker processes, by default the number of CPUs.
+        """
+        if super_trends is None:
+            super_trends = [{'period': [item['period']], 'multiplier': [item['multiplier']]} for item in self.__super_trends]
 
-        start = var_take['start']
-        results = pd.DataFrame()
+        walk_forward = WalkForward(self.__directory, {'var_take': var_take, 'super_trends': super_trends}, in_sample=in_sample,
+                                   out_of_sample=out_of_sample, anchored=anchored, objective=objective, workers=workers)
+        results = walk_forward.run(data)
 
-        while start <= var_take['end']:
-            data_copy = data.copy()
-            result = self.calculate(data_copy, start)
-            report = self.report(result, 'optimization', start)
-            results = pd.concat([results, report])
+        # the var_take of the chained backtest changes from fold to fold
+        results['report'] = self.report(results['data'], 'optimization').drop(columns='var_take')
+        print(results['folds'])
+        print(results['stability'])
+        print(results['report'])
 
-            start += var_take['step']
+        results['data'].to_pickle(os.path.join(self.__directory, 'walkforward.pkl'))
+        with pd.ExcelWriter(os.path.join(self.__directory, 'walkforward.xlsx')) as writer:
+            for sheet in ('folds', 'stability', 'report'):
+                results[sheet].to_excel(writer, sheet_name=sheet, index=False)
 
-        results.to_excel(os.path.join(self.__directory, 'optimization.xlsx'), index=False)
+        return results
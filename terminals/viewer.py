@@ -0,0 +1,155 @@
+import argparse
+import collections
+import json
+import logging
+import threading
+import finplot as fplt
+import pandas as pd
+
+from services.chart import ChartData
+from services.feed import BarFeedClient, DEFAULT_PORT
+
+__all__ = "LiveViewer"
+
+logger = logging.getLogger(__name__)
+
+
+def plot_backtest(data: pd.DataFrame, indicators: dict, start=None, end=None, width: int = 4000) -> None:
+    """
+    Show the chart of a backtest: candles, SuperTrends, EMA 50, orders and signals. It blocks until the window is closed.
+
+    Only the window between start and end is drawn, on the finest level of ChartData which fits 'width' candles:
+    5-minute bars for a few weeks, hourly or daily candles for years. On a coarse level a line is drawn
+    as its minimum and maximum inside every candle. The level is chosen once for the window: finplot places
+    the candles by their position, so another level would move the zoomed range. To see the bars of a longer
+    window, show it again with a shorter start and end.
+
+    :param data: The result of DoubleST.calculate.
+    :param indicators: Names of the SuperTrend columns ('fast_up', 'fast_down', 'slow_up', 'slow_down').
+    :param start: The first time on the chart, by default the beginning of the data.
+    :param end: The last time on the chart, by default the end of the data.
+    :param width: Maximum number of candles on the chart.
+    """
+    lines = {indicators['fast_up']: ('ST_FAST_UP', '#FF0000', 2),
+             indicators['fast_down']: ('ST_FAST_LOW', '#228B22', 2),
+             indicators['slow_up']: ('ST_SLOW_UP', '#B22222', 3),
+             indicators['slow_down']: ('ST_SLOW_LOW', '#006400', 3),
+             'EMA 50': ('EMA 50', None, 1)}
+    chart = ChartData(data, list(lines))
+    level, candles = chart.window(start, end, width)
+
+    def localize(series):
+        series.index = series.index.tz_localize('Etc/GMT-5')
+        return series
+
+    # candlestick
+    candles = localize(candles.copy())
+    fplt.candlestick_ochl(candles[['open', 'close', 'high', 'low']])
+    for column, (legend, color, line_width) in lines.items():
+        if level == '5m':
+            fplt.plot(candles[column], legend=legend, color=color, width=line_width)
+        else:
+            fplt.plot(candles[column + ' max'], legend=legend, color=color, width=line_width)
+            fplt.plot(candles[column + ' min'], color=color, width=line_width)
+
+    take_profit = localize(chart.sparse('TAKE_PROFIT', level, start, end))
+    if not take_profit.empty:
+        fplt.plot(take_profit, legend='TAKE_PROFIT', width=1, color='g', style='-')
+    for column in ('BUY_PRICE', 'SELL_PRICE'):
+        prices = localize(chart.sparse(column, level, start, end))
+        if not prices.empty:
+            fplt.plot(prices, color='b', style='x', width=2)
+
+    # signal -> offset of the marker from the price, color, style, legend
+    markers = {'LONG_BUY': (-1, '#4a5', '^', 'buy'),
+               'LONG_SELL': (1, '#4a6', 'o', 'sell'),
+               'LONG_TAKE_PROFIT': (1, '#4a5', 'p', 'take profit'),
+               'SHORT_BUY': (-1, 'r', '^', 'short buy'),
+               'SHORT_SELL': (1, 'r', 'o', 'short sell'),
+               'SHORT_TAKE_PROFIT': (-1, 'r', 'p', 'short take profit')}
+    signals = chart.signals(level, start, end)
+    for signal, (offset, color, style, legend) in markers.items():
+        prices = signals.get(signal)
+        if prices is not None and not prices.empty:
+            fplt.plot(localize(prices) + offset, color=color, style=style, legend=legend, width=2)
+
+    fplt.add_legend('Double SuperTrend')
+    fplt.show()
+
+
+class LiveViewer:
+    def __init__(self, ticker: str, host: str = '127.0.0.1', port: int = DEFAULT_PORT, bars: int = 100) -> None:
+        """
+        Chart of the bars of one ticker received from the BarFeed of a live engine in another process.
+
+        The bars are received in a background thread, the chart takes the new ones once a second,
+        so drawing never waits for the network and the engine never waits for drawing.
+
+        :param ticker: The ticker on the chart.
+        :param host: The host of the feed.
+        :param port: The port of the feed.
+        :param bars: Number of the last bars on the chart.
+        """
+        self.__ticker = ticker
+        self.__rows = collections.deque(maxlen=bars)
+        self.__lock = threading.Lock()
+        self.__changed = False
+        self.__candles = None
+        self.__client = BarFeedClient(self.__receive, host, port)
+
+    def __receive(self, row: dict) -> None:
+        if row['ticker'] != self.__ticker:
+            return
+        with self.__lock:
+            if len(self.__rows) > 0 and self.__rows[-1]['date'] >= row['date']:
+                return  # the bar is already on the chart (the feed sends its history again after reconnect)
+            self.__rows.append(row)
+            self.__changed = True
+
+    def __update(self) -> None:
+        with self.__lock:
+            if not self.__changed:
+                return
+            data = pd.DataFrame(list(self.__rows))
+            self.__changed = False
+
+        data.set_index('date', inplace=True)
+        data.index = pd.to_datetime(data.index).tz_localize('Etc/GMT-5')
+        candles = data[['open', 'close', 'high', 'low']]
+
+        if self.__candles is None:
+            self.__candles = fplt.candlestick_ochl(candles)
+        else:
+            self.__candles.update_data(candles)
+
+    def show(self) -> None:
+        fplt.foreground = '#FFFFFF'
+        fplt.background = '#000000'
+        fplt.cross_hair_color = '#FFFFFF'
+
+        fplt.create_plot(self.__ticker)
+        self.__client.start()
+        fplt.timer_callback(self.__update, 1)  # take the new bars
+        fplt.show()
+        self.__client.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Chart of a backtest or of a live engine.')
+    parser.add_argument('--file', help='pickled result of DoubleST.calculate')
+    parser.add_argument('--indicators', help='JSON with the names of the SuperTrend columns of the backtest')
+    parser.add_argument('--start', help='the first time on the backtest chart')
+    parser.add_argument('--end', help='the last time on the backtest chart')
+    parser.add_argument('--ticker', default='SBER', help='ticker of the live chart')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    if args.file is not None:
+        plot_backtest(pd.read_pickle(args.file), json.loads(args.indicators), args.start, args.end)
+    else:
+        LiveViewer(args.ticker, args.host, args.port).show()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the modules are imported from the repository root
+
+from benchmarks.synthetic import synthetic_quotes
+
+
+@pytest.fixture
+def quotes():
+    """Seeded synthetic 5-minute quotes, a little more than 20 trading days."""
+    return synthetic_quotes(3500, seed=7)
@@ -0,0 +1,25 @@
+import json
+import pandas as pd
+import pytest
+
+from terminals.main import DoubleST
+
+ORDER_COLUMNS = ['SIGNAL', 'BUY_PRICE', 'SELL_PRICE', 'TAKE_PROFIT']
+
+
+@pytest.fixture
+def double_st(tmp_path):
+    with open(tmp_path / 'config.json', 'w') as f:
+        json.dump({'var_take': 1.5, 'indicators': {'super_trends': [{'period': 10, 'multiplier': 3}, {'period': 20, 'multiplier': 5}]}}, f)
+    return DoubleST(str(tmp_path))
+
+
+@pytest.mark.parametrize('var_take', [1.0, 1.5, 3.0])
+def test_vector_engine_matches_loop_engine(double_st, quotes, var_take):
+    data = double_st.run(quotes)
+
+    vector = double_st.calculate(data, var_take, engine='vector')
+    loop = double_st.calculate(data, var_take, engine='loop')
+
+    assert vector['SIGNAL'].notnull().sum() > 10  # the series has enough trades to compare
+    pd.testing.assert_frame_equal(vector.reindex(columns=ORDER_COLUMNS), loop.reindex(columns=ORDER_COLUMNS), check_dtype=False)
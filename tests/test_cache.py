@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from services.cache import INDICATORS, IndicatorCache
+
+PARAMS = [('super_trend', {'period': 10, 'multiplier': 3}), ('super_trend', {'period': 20, 'multiplier': 5}), ('ema', {'period': 50})]
+
+
+def stream(indicator: str, params: dict, quotes) -> dict:
+    definition = INDICATORS[indicator]
+    state = definition['create'](params)
+    values = [definition['update'](state, *bar) for bar in quotes[['open', 'high', 'low', 'close']].itertuples(index=False)]
+    return {name: np.array(column, dtype=float) for name, column in zip(definition['outputs'], zip(*values))}
+
+
+@pytest.mark.parametrize('indicator, params', PARAMS)
+def test_cold_build_matches_streaming(tmp_path, quotes, indicator, params):
+    values = IndicatorCache(str(tmp_path)).get('SBER', indicator, params, quotes)
+
+    expected = stream(indicator, params, quotes)
+    for name in expected:
+        np.testing.assert_allclose(values[name], expected[name], rtol=1e-12, equal_nan=True)
+
+
+@pytest.mark.parametrize('indicator, params', PARAMS)
+def test_extension_continues_batch_state(tmp_path, quotes, indicator, params):
+    cache = IndicatorCache(str(tmp_path / 'extended'))
+    cache.get('SBER', indicator, params, quotes.iloc[:2000])
+    extended = cache.get('SBER', indicator, params, quotes)
+
+    full = IndicatorCache(str(tmp_path / 'full')).get('SBER', indicator, params, quotes)
+    for name in full:
+        np.testing.assert_allclose(extended[name], full[name], rtol=1e-12, equal_nan=True)
+
+
+def test_short_history_is_streamed(tmp_path, quotes):
+    values = IndicatorCache(str(tmp_path)).get('SBER', 'super_trend', {'period': 10, 'multiplier': 3}, quotes.iloc[:5])
+    assert np.isnan(values['UP']).all() and np.isnan(values['LOW']).all()
+
+    # the state of the short history continues to the same values
+    extended = IndicatorCache(str(tmp_path)).get('SBER', 'super_trend', {'period': 10, 'multiplier': 3}, quotes)
+    np.testing.assert_array_equal(extended['UP'], stream('super_trend', {'period': 10, 'multiplier': 3}, quotes)['UP'])
+
+
+def test_cached_arrays_are_read_only(tmp_path, quotes):
+    cache = IndicatorCache(str(tmp_path))
+    cache.get('SBER', 'ema', {'period': 50}, quotes)
+    values = cache.get('SBER', 'ema', {'period': 50}, quotes)  # from the memory tier
+
+    with pytest.raises(ValueError):
+        values['EMA'][0] = 0.0
+
+
+def test_histories_with_other_start_do_not_share_entry(tmp_path, quotes):
+    cache = IndicatorCache(str(tmp_path))
+    params = {'period': 10, 'multiplier': 3}
+    for _ in range(2):
+        window = cache.get('SBER', 'super_trend', params, quotes.iloc[1000:])
+        full = cache.get('SBER', 'super_trend', params, quotes)
+
+    assert len(list(tmp_path.iterdir())) == 2
+    np.testing.assert_array_equal(window['UP'], stream('super_trend', params, quotes.iloc[1000:])['UP'])
+    np.testing.assert_array_equal(full['UP'], stream('super_trend', params, quotes)['UP'])
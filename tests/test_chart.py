@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from services.chart import ChartData
+
+
+def test_data_without_orders(quotes):
+    chart = ChartData(quotes)
+    level, candles = chart.window(width=1000)
+
+    assert level == '1h'
+    for column in ('BUY_PRICE', 'SELL_PRICE', 'TAKE_PROFIT'):
+        prices = chart.sparse(column, level)
+        assert prices.empty and isinstance(prices.index, pd.DatetimeIndex)
+        prices.index = prices.index.tz_localize('Etc/GMT-5')  # as the viewer does
+    assert chart.signals(level) == {}
+
+
+def test_backtest_without_fills(quotes):
+    data = quotes.assign(SIGNAL=None, BUY_PRICE=np.nan, SELL_PRICE=np.nan, TAKE_PROFIT=np.nan)
+    chart = ChartData(data)
+
+    for level in chart.levels():
+        prices = chart.sparse('BUY_PRICE', level)
+        assert prices.empty and isinstance(prices.index, pd.DatetimeIndex)
+        assert chart.signals(level) == {}
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import talib
+
+from indicators.atr import ATRState
+from indicators.ema import EMAState
+from indicators.super_trend import SuperTrendState, super_trend
+
+
+@pytest.mark.parametrize('period', [1, 10, 20])
+def test_atr_state_matches_talib(quotes, period):
+    state = ATRState(period)
+    streamed = [state.update(high, low, close) for high, low, close in quotes[['high', 'low', 'close']].itertuples(index=False)]
+
+    expected = talib.ATR(quotes['high'].to_numpy(float), quotes['low'].to_numpy(float), quotes['close'].to_numpy(float), timeperiod=period)
+    np.testing.assert_allclose(streamed, expected, rtol=1e-9, equal_nan=True)
+
+
+@pytest.mark.parametrize('period', [1, 50])
+def test_ema_state_matches_talib(quotes, period):
+    state = EMAState(period)
+    streamed = [state.update(close) for close in quotes['close']]
+
+    np.testing.assert_allclose(streamed, talib.EMA(quotes['close'].to_numpy(float), timeperiod=period), rtol=1e-9, equal_nan=True)
+
+
+def test_super_trend_state_matches_batch(quotes):
+    config = [{'period': 10, 'multiplier': 3}, {'period': 20, 'multiplier': 5}]
+    expected = super_trend(config, quotes[['open', 'high', 'low', 'close']].copy())
+
+    for params in config:
+        state = SuperTrendState(params['period'], params['multiplier'])
+        streamed = np.array([state.update(*bar) for bar in quotes[['open', 'high', 'low', 'close']].itertuples(index=False)])
+
+        np.testing.assert_array_equal(streamed[:, 0], expected[f'{state.name} UP'].to_numpy())
+        np.testing.assert_array_equal(streamed[:, 1], expected[f'{state.name} LOW'].to_numpy())
+
+
+def test_super_trend_state_round_trip(quotes):
+    bars = list(quotes[['open', 'high', 'low', 'close']].itertuples(index=False))
+    state = SuperTrendState(10, 3)
+    for bar in bars[:1000]:
+        state.update(*bar)
+
+    # a state restored from its dictionary continues with the same values
+    restored = SuperTrendState.from_dict(state.to_dict())
+    np.testing.assert_array_equal([restored.update(*bar) for bar in bars[1000:]], [state.update(*bar) for bar in bars[1000:]])
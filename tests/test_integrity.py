@@ -0,0 +1,21 @@
+import numpy as np
+
+from services.integrity import GapScanner
+
+
+def test_compact_ranges():
+    ranges = [[900, 1200], [0, 300], [300, 600], [1000, 1500], [-600, -300], [1800, 2100]]
+    assert GapScanner.compact(ranges, 0) == [[0, 600], [900, 1500], [1800, 2100]]
+
+
+def test_compacted_ranges_skip_the_same_bars(quotes):
+    scanner = GapScanner(10, 24, [0, 1, 2, 3, 4], max_bars=50)
+    time = np.delete(quotes['time'].to_numpy(), np.r_[100:400, 1000:1010, 2000:2001])
+
+    checked = scanner.scan(time)['ranges']
+    checked = checked + checked[:2] + [[int(time[0]) - 86400, int(time[0]) - 3600]]  # repeated and old ranges
+    compacted = GapScanner.compact(checked, int(time[0]))
+
+    assert len(compacted) < len(checked)
+    assert all(end < start for (_, end), (start, _) in zip(compacted, compacted[1:]))
+    assert scanner.scan(time, compacted) == scanner.scan(time, checked)
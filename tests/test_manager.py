@@ -0,0 +1,25 @@
+import json
+
+from services.bars import BarStore, COLUMNS
+from services.manager import Manager
+
+
+def config(directory, super_trends: list) -> None:
+    with open(directory / 'config.json', 'w') as f:
+        json.dump({'indicators': {'super_trends': super_trends}}, f)
+
+
+def test_changed_super_trends_rebuild_state(tmp_path, quotes):
+    BarStore(str(tmp_path), 'SBER').append({column: quotes[column].to_numpy() for column in COLUMNS})
+    config(tmp_path, [{'period': 10, 'multiplier': 3}])
+    manager = Manager('SBER', str(tmp_path))
+    manager.save_indicators_state(manager.get_indicators_state())
+
+    config(tmp_path, [{'period': 14, 'multiplier': 2}, {'period': 20, 'multiplier': 1.5}])
+    state = Manager('SBER', str(tmp_path)).get_indicators_state()
+
+    (tmp_path / 'state.json').unlink()
+    fresh = Manager('SBER', str(tmp_path)).get_indicators_state()
+    assert [(item.period, item.multiplier) for item in state['super_trends']] == [(14, 2), (20, 1.5)]
+    assert Manager.get_indicators_values(state) == Manager.get_indicators_values(fresh)
+    assert state['time'] == int(quotes['time'].iloc[-1])
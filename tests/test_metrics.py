@@ -0,0 +1,38 @@
+from services.metrics import Metrics
+
+
+def registry() -> Metrics:
+    metrics = Metrics()  # enabled without the start, so nothing is written at exit
+    metrics.enabled = True
+    return metrics
+
+
+def test_snapshot_returns_only_new_metrics():
+    metrics = registry()
+    with metrics.stage('fit'):
+        metrics.count('fit', 'bars', 10)
+
+    first = metrics.snapshot()
+    metrics.count('fit', 'bars', 5)
+    second = metrics.snapshot()
+
+    assert first['stages']['fit']['calls'] == 1 and first['counters'] == {'fit': {'bars': 10}}
+    assert second == {'stages': {}, 'counters': {'fit': {'bars': 5}}}
+
+
+def test_merge_adds_worker_snapshots():
+    parent, worker = registry(), registry()
+    with parent.stage('fit'):
+        parent.count('fit', 'bars', 1)
+    for _ in range(2):
+        with worker.stage('fit'):
+            worker.count('fit', 'bars', 3)
+
+    snapshot = worker.snapshot()
+    parent.merge(snapshot)
+    parent.merge(None)  # the snapshot of a disabled worker
+
+    stages = parent.to_dict()['stages']
+    assert stages['fit']['calls'] == 3
+    assert stages['fit']['max_seconds'] == max(snapshot['stages']['fit']['max_seconds'], stages['fit']['max_seconds'])
+    assert parent.to_dict()['counters'] == {'fit': {'bars': 7}}
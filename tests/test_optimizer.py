@@ -0,0 +1,29 @@
+import json
+import pandas as pd
+import pytest
+
+from services.optimizer import Optimizer
+
+SPACE = {'var_take': [1.0, 2.0], 'super_trends': [{'period': [10], 'multiplier': [3]}, {'period': [20], 'multiplier': [5]}]}
+
+
+@pytest.fixture
+def directory(tmp_path):
+    with open(tmp_path / 'config.json', 'w') as f:
+        json.dump({'var_take': 1.5, 'indicators': {'super_trends': [{'period': 10, 'multiplier': 3}, {'period': 20, 'multiplier': 5}]}}, f)
+    return str(tmp_path)
+
+
+def test_resume_against_changed_quotes(directory, quotes):
+    first = Optimizer(directory, SPACE, workers=1).run(quotes.iloc[:2000])
+    rows = len(pd.read_csv(f'{directory}/optimization.csv'))
+
+    # the same quotes are not evaluated again
+    pd.testing.assert_frame_equal(Optimizer(directory, SPACE, workers=1).run(quotes.iloc[:2000]), first)
+    assert len(pd.read_csv(f'{directory}/optimization.csv')) == rows
+
+    # new bars: the results of the shorter history are not returned
+    resumed = Optimizer(directory, SPACE, workers=1).run(quotes)
+    fresh = Optimizer(directory, SPACE, workers=1, file_name='fresh.csv').run(quotes)
+    pd.testing.assert_frame_equal(resumed, fresh)
+    assert not resumed['account_end'].equals(first['account_end'])
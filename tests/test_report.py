@@ -0,0 +1,34 @@
+import json
+import pandas as pd
+import pytest
+
+from terminals.main import DoubleST
+
+
+@pytest.fixture
+def double_st(tmp_path):
+    with open(tmp_path / 'config.json', 'w') as f:
+        json.dump({'var_take': 1.5, 'indicators': {'super_trends': [{'period': 10, 'multiplier': 3}, {'period': 20, 'multiplier': 5}]}}, f)
+    return DoubleST(str(tmp_path))
+
+
+@pytest.mark.parametrize('orders', [{}, {'SIGNAL': None, 'BUY_PRICE': float('nan'), 'SELL_PRICE': float('nan')}])
+def test_report_without_trades(double_st, quotes, orders):
+    # a backtest without fills has no order columns or only empty ones
+    data = quotes.assign(**orders)
+
+    report = double_st.report(data, 'optimization').iloc[0]
+
+    assert report['trades'] == 0
+    assert report['win_rate'] == '0.0%'
+    assert report['account_end'] == report['account_start']
+    assert report['max_drawdown'] == '0.0%'
+    assert pd.isnull(report['avg_holding'])
+
+
+def test_report_of_backtest(double_st, quotes):
+    report = double_st.report(double_st.calculate(double_st.run(quotes)), 'optimization').iloc[0]
+
+    assert report['trades'] > 0
+    assert report['loss'] + report['profit'] <= report['trades']
+    assert report['account_end'] != report['account_start']
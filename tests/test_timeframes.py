@@ -0,0 +1,66 @@
+import shutil
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_quotes
+from services.bars import BarStore, COLUMNS
+from services.timeframes import TimeframeStore
+
+OPEN, CLOSE = 10, 24  # session hours of the synthetic quotes
+
+
+def columns(quotes: pd.DataFrame) -> dict:
+    return {column: quotes[column].to_numpy() for column in COLUMNS}
+
+
+def fresh(tmp_path, quotes: pd.DataFrame, timeframe: str) -> pd.DataFrame:
+    directory = tmp_path / 'fresh'
+    shutil.rmtree(directory, ignore_errors=True)
+    BarStore(str(directory), 'SBER').append(columns(quotes))
+    return TimeframeStore(str(directory), 'SBER', OPEN, CLOSE).read(timeframe, partial=False)
+
+
+def test_rewritten_base_store_rebuilds_timeframe(tmp_path):
+    quotes = synthetic_quotes(3100, seed=3)
+    directory = tmp_path / 'ticker'
+    BarStore(str(directory), 'SBER').append(columns(quotes.iloc[:3000]))
+    TimeframeStore(str(directory), 'SBER', OPEN, CLOSE).update('1h')
+
+    # the base store is downloaded again from a later start, it has the same number of bars
+    shutil.rmtree(directory / 'bars')
+    BarStore(str(directory), 'SBER').append(columns(quotes.iloc[100:3100]))
+
+    bars = TimeframeStore(str(directory), 'SBER', OPEN, CLOSE).read('1h', partial=False)
+    pd.testing.assert_frame_equal(bars, fresh(tmp_path, quotes.iloc[100:3100], '1h'))
+
+
+def test_merge_followed_by_update(tmp_path):
+    quotes = synthetic_quotes(3100, seed=4)
+    holes = quotes.index.isin(range(1000, 1030)) | quotes.index.isin(range(2000, 2006))
+    directory = tmp_path / 'ticker'
+    store = BarStore(str(directory), 'SBER')
+    store.append(columns(quotes[~holes]))
+    TimeframeStore(str(directory), 'SBER', OPEN, CLOSE).update('1h')
+
+    # the missing bars are backfilled in the middle of the store
+    assert store.merge(columns(quotes[holes])) == holes.sum()
+
+    bars = TimeframeStore(str(directory), 'SBER', OPEN, CLOSE).read('1h', partial=False)
+    assert bars['time'].is_monotonic_increasing and bars['time'].is_unique
+    pd.testing.assert_frame_equal(bars, fresh(tmp_path, quotes, '1h'))
+
+
+def test_invalidate_removes_derived_data(tmp_path):
+    from services.manager import Manager
+
+    quotes = synthetic_quotes(3100, seed=4)
+    directory = tmp_path / 'ticker'
+    BarStore(str(directory), 'SBER').append(columns(quotes.iloc[:3000]))
+    TimeframeStore(str(directory), 'SBER', OPEN, CLOSE).update('1h')
+    for name in ('state.json', 'terminal.csv'):
+        (directory / name).write_text('{}')
+
+    Manager.invalidate(str(directory))
+
+    assert not (directory / 'timeframes').exists()
+    assert not (directory / 'state.json').exists() and not (directory / 'terminal.csv').exists()
+    assert len(BarStore(str(directory), 'SBER')) == 3000  # the bars stay
@@ -0,0 +1,49 @@
+import json
+import numpy as np
+import pytest
+
+from services.optimizer import _attach, share_quotes
+from services.walkforward import ORDER_COLUMNS, WalkForward, _test
+
+SUPER_TRENDS = [{'period': 10, 'multiplier': 3}, {'period': 20, 'multiplier': 5}]
+
+
+@pytest.fixture
+def directory(tmp_path):
+    with open(tmp_path / 'config.json', 'w') as f:
+        json.dump({'var_take': 1.5, 'indicators': {'super_trends': SUPER_TRENDS}}, f)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def worker(directory, quotes):
+    # the state of a worker in this process
+    memory, specs = share_quotes(quotes)
+    _attach(directory, 'SBER', specs)
+    yield
+    for block in memory:
+        block.close()
+        block.unlink()
+
+
+def test_window_without_trades(worker):
+    # a window of one bar has no fills
+    fold, orders, report = _test(3, SUPER_TRENDS, 1.5, 1000, 1001)
+
+    assert fold == 3
+    assert len(orders) == 0 and list(orders.columns) == ORDER_COLUMNS
+    assert report == {'oos_trades': 0, 'oos_account_end': 3000.0}
+
+
+def test_walk_forward_chains_windows(directory, quotes):
+    space = {'var_take': [1.0, 2.0], 'super_trends': [{'period': [10], 'multiplier': [3]}, {'period': [20], 'multiplier': [5]}]}
+    walk_forward = WalkForward(directory, space, in_sample=5, out_of_sample=1, workers=2)
+
+    results = walk_forward.run(quotes)
+
+    folds = walk_forward.folds(quotes['time'].to_numpy())
+    assert len(results['folds']) == len(folds)
+    assert len(results['data']) == folds[-1]['oos_end'] - folds[0]['oos_start']
+    assert results['folds']['oos_trades'].sum() == results['data']['SIGNAL'].isin(['LONG_SELL', 'TAKE_PROFIT', 'MARKET_STOP']).sum()
+    assert set(results['stability']['parameter']) == {'var_take', 'period 1', 'multiplier 1', 'period 2', 'multiplier 2'}
+    assert np.isfinite(results['folds']['oos_account_end']).all()
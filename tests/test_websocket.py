@@ -0,0 +1,49 @@
+import asyncio
+import json
+import websockets
+
+from api.websocket import AlorWebsocketSession
+
+
+async def alor_server(websocket) -> None:
+    """Answer every 'BarsGetAndSubscribe' like ALOR: two history bars, the confirmation with only 'requestGuid', one new bar."""
+    async for message in websocket:
+        request = json.loads(message)
+        guid = request['guid']
+        for time in (request['from'], request['from'] + 300):
+            await websocket.send(json.dumps({'data': {'time': time, 'open': 1.0, 'high': 1.0, 'low': 1.0, 'close': 1.0, 'volume': 1}, 'guid': guid}))
+        await websocket.send(json.dumps({'requestGuid': guid, 'httpCode': 200, 'message': 'Handled successfully'}))
+        await websocket.send(json.dumps({'data': {'time': request['from'] + 600, 'open': 1.0, 'high': 1.0, 'low': 1.0, 'close': 1.0, 'volume': 1}, 'guid': guid}))
+
+
+async def token() -> str:
+    return 'token'
+
+
+async def receive(url: str) -> tuple[list, list, str]:
+    session = AlorWebsocketSession(url, token)
+    try:
+        first = await session.subscribe({'opcode': 'BarsGetAndSubscribe', 'code': 'SBER', 'from': 1000})
+        second = await session.subscribe({'opcode': 'BarsGetAndSubscribe', 'code': 'GAZP', 'from': 5000})
+
+        # the history ends at the confirmation of its own subscription
+        first_history = await asyncio.wait_for(first.history(), 5)
+        second_history = await asyncio.wait_for(second.history(), 5)
+        new_bar = await asyncio.wait_for(first.__anext__(), 5)
+    finally:
+        await session.close()
+
+    return first_history, second_history, new_bar
+
+
+def test_history_ends_at_alor_confirmation():
+    async def run():
+        async with websockets.serve(alor_server, '127.0.0.1', 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            return await receive(f'ws://127.0.0.1:{port}')
+
+    first, second, new_bar = asyncio.run(run())
+
+    assert [json.loads(message)['data']['time'] for message in first] == [1000, 1300]
+    assert [json.loads(message)['data']['time'] for message in second] == [5000, 5300]
+    assert json.loads(new_bar)['data']['time'] == 1600